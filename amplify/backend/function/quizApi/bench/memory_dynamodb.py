@@ -0,0 +1,884 @@
+"""In-memory stand-in for the DynamoDB low-level client, for local benchmarks.
+
+Covers the operations and expression syntax index.py uses: get/put/update/
+delete_item, query and scan (GSIs, Limit, ExclusiveStartKey, Segment,
+FilterExpression, ProjectionExpression), batch_get/batch_write_item and
+transact_write_items, with condition and update expressions on top-level
+attributes. Install it in place of the real client with
+
+    index._clients['dynamodb'] = MemoryDynamoDB()
+
+Every call is metered in read and write request units the way on-demand
+tables bill them (4 KB reads, half price when eventually consistent; 1 KB
+writes plus one write per GSI touched; transactions at double cost), so a
+benchmark can report cost next to latency. ReturnConsumedCapacity='TOTAL'
+is honoured as well.
+
+Not covered: nested attribute paths, LSIs, streams, TTL and PartiQL. GSIs
+are always ALL-projected and strongly consistent.
+"""
+import bisect
+import collections
+import functools
+import math
+import re
+import threading
+import time
+import zlib
+from decimal import Decimal
+
+PAGE_BYTES = 1024 * 1024
+
+
+class ClientError(Exception):
+    """Shaped like botocore's ClientError as far as index.py inspects it."""
+
+    def __init__(self, code, message='', operation='', **extra):
+        super().__init__(f'An error occurred ({code}) when calling the {operation} operation: {message}')
+        self.response = {'Error': {'Code': code, 'Message': message}, **extra}
+
+
+def _invalid(message):
+    return ClientError('ValidationException', message)
+
+
+# -- attribute values ---------------------------------------------------------
+
+def _norm(av):
+    """Hashable, comparable form of an attribute value."""
+    (kind, value), = av.items()
+    if kind == 'N':
+        return Decimal(value)
+    if kind in ('S', 'B', 'BOOL'):
+        return value
+    if kind == 'NULL':
+        return None
+    if kind in ('SS', 'BS'):
+        return frozenset(value)
+    if kind == 'NS':
+        return frozenset(Decimal(v) for v in value)
+    if kind == 'L':
+        return ('L', tuple(_norm(v) for v in value))
+    if kind == 'M':
+        return ('M', tuple(sorted((k, _norm(v)) for k, v in value.items())))
+    raise _invalid(f'Unsupported attribute type {kind}')
+
+
+def _number_av(value):
+    text = format(value.normalize() if value == value.to_integral_value() else value, 'f')
+    return {'N': text}
+
+
+def _av_size(av):
+    (kind, value), = av.items()
+    if kind == 'S':
+        return len(value.encode('utf-8'))
+    if kind == 'N':
+        return (len(value.lstrip('-').replace('.', '').strip('0')) + 1) // 2 + 1
+    if kind == 'B':
+        return len(value)
+    if kind in ('BOOL', 'NULL'):
+        return 1
+    if kind == 'SS':
+        return sum(len(v.encode('utf-8')) for v in value)
+    if kind == 'NS':
+        return sum(_av_size({'N': v}) for v in value)
+    if kind == 'BS':
+        return sum(len(v) for v in value)
+    if kind == 'L':
+        return 3 + sum(1 + _av_size(v) for v in value)
+    if kind == 'M':
+        return 3 + sum(len(k.encode('utf-8')) + 1 + _av_size(v) for k, v in value.items())
+    return 0
+
+
+def item_size(item):
+    """Item size in bytes as DynamoDB counts it for capacity."""
+    return sum(len(k.encode('utf-8')) + _av_size(v) for k, v in item.items()) if item else 0
+
+
+def _type_of(av):
+    return next(iter(av)) if av else None
+
+
+# -- expressions --------------------------------------------------------------
+
+_TOKEN = re.compile(r'\s*(?:(<>|<=|>=|[=<>(),+\-\[\].])|(:[A-Za-z0-9_]+)|(#[A-Za-z0-9_]+)|([A-Za-z_][A-Za-z0-9_]*)|(\d+))')
+_FUNCTIONS = {'attribute_exists', 'attribute_not_exists', 'attribute_type', 'begins_with', 'contains', 'size'}
+
+
+def _tokenize(text):
+    tokens, pos = [], 0
+    text = text.rstrip()
+    while pos < len(text):
+        m = _TOKEN.match(text, pos)
+        if not m or m.end() == pos:
+            raise _invalid(f'Invalid expression near: {text[pos:pos + 20]!r}')
+        pos = m.end()
+        op, value, name, word, number = m.groups()
+        if op:
+            tokens.append(('op', op))
+        elif value:
+            tokens.append(('value', value))
+        elif name:
+            tokens.append(('path', name))
+        elif number:
+            tokens.append(('number', number))
+        else:
+            tokens.append(('word', word))
+    return tokens
+
+
+class _Parser:
+    def __init__(self, text):
+        self.tokens = _tokenize(text)
+        self.pos = 0
+
+    def peek(self, offset=0):
+        i = self.pos + offset
+        return self.tokens[i] if i < len(self.tokens) else (None, None)
+
+    def keyword(self, *words):
+        kind, text = self.peek()
+        return kind == 'word' and text.upper() in words
+
+    def take(self, kind=None, text=None):
+        token = self.peek()
+        if token[0] is None or (kind and token[0] != kind) or (text and token[1] != text):
+            raise _invalid(f'Syntax error: expected {text or kind}, got {token[1]!r}')
+        self.pos += 1
+        return token
+
+    def done(self):
+        if self.pos != len(self.tokens):
+            raise _invalid(f'Syntax error: unexpected {self.peek()[1]!r}')
+
+    def path(self):
+        kind, text = self.peek()
+        if kind not in ('path', 'word') or (kind == 'word' and text in _FUNCTIONS):
+            raise _invalid(f'Syntax error: expected attribute name, got {text!r}')
+        self.pos += 1
+        if self.peek() in (('op', '.'), ('op', '[')):
+            raise _invalid('Nested attribute paths are not supported by the stand-in')
+        return ('path', text)
+
+    # condition := or ; or := and (OR and)* ; and := not (AND not)* ; not := NOT not | primary
+    def condition(self):
+        node = self.conjunction()
+        while self.keyword('OR'):
+            self.pos += 1
+            node = ('or', node, self.conjunction())
+        return node
+
+    def conjunction(self):
+        node = self.negation()
+        while self.keyword('AND'):
+            self.pos += 1
+            node = ('and', node, self.negation())
+        return node
+
+    def negation(self):
+        if self.keyword('NOT'):
+            self.pos += 1
+            return ('not', self.negation())
+        return self.primary()
+
+    def primary(self):
+        if self.peek() == ('op', '('):
+            self.pos += 1
+            node = self.condition()
+            self.take('op', ')')
+            return node
+        kind, text = self.peek()
+        if kind == 'word' and text in _FUNCTIONS and text != 'size':
+            self.pos += 1
+            self.take('op', '(')
+            args = [self.path()]
+            while self.peek() == ('op', ','):
+                self.pos += 1
+                args.append(self.operand())
+            self.take('op', ')')
+            return ('fn', text, tuple(args))
+        left = self.operand()
+        if self.keyword('BETWEEN'):
+            self.pos += 1
+            low = self.operand()
+            self.take('word')
+            return ('between', left, low, self.operand())
+        if self.keyword('IN'):
+            self.pos += 1
+            self.take('op', '(')
+            options = [self.operand()]
+            while self.peek() == ('op', ','):
+                self.pos += 1
+                options.append(self.operand())
+            self.take('op', ')')
+            return ('in', left, tuple(options))
+        _, op = self.take('op')
+        if op not in ('=', '<>', '<', '<=', '>', '>='):
+            raise _invalid(f'Syntax error: unexpected {op!r}')
+        return ('cmp', op, left, self.operand())
+
+    def operand(self):
+        kind, text = self.peek()
+        if kind == 'value':
+            self.pos += 1
+            return ('value', text)
+        if kind == 'word' and text == 'size':
+            self.pos += 1
+            self.take('op', '(')
+            node = ('size', self.path())
+            self.take('op', ')')
+            return node
+        return self.path()
+
+    # update := (SET a, ... | REMOVE p, ... | ADD p v, ... | DELETE p v, ...)+
+    def update(self):
+        clauses = []
+        while self.peek()[0] is not None:
+            _, word = self.take('word')
+            clause = word.upper()
+            if clause not in ('SET', 'REMOVE', 'ADD', 'DELETE'):
+                raise _invalid(f'Syntax error: unexpected {word!r}')
+            while True:
+                target = self.path()
+                if clause == 'SET':
+                    self.take('op', '=')
+                    clauses.append(('SET', target, self.set_value()))
+                elif clause == 'REMOVE':
+                    clauses.append(('REMOVE', target, None))
+                else:
+                    clauses.append((clause, target, self.operand()))
+                if self.peek() != ('op', ','):
+                    break
+                self.pos += 1
+        if not clauses:
+            raise _invalid('Empty update expression')
+        return tuple(clauses)
+
+    def set_value(self):
+        node = self.set_operand()
+        if self.peek() in (('op', '+'), ('op', '-')):
+            _, op = self.take()
+            node = ('arith', op, node, self.set_operand())
+        return node
+
+    def set_operand(self):
+        kind, text = self.peek()
+        if kind == 'word' and text in ('if_not_exists', 'list_append'):
+            self.pos += 1
+            self.take('op', '(')
+            first = self.path() if text == 'if_not_exists' else self.set_value()
+            self.take('op', ',')
+            second = self.set_value()
+            self.take('op', ')')
+            return (text, first, second)
+        return self.operand()
+
+
+@functools.lru_cache(maxsize=2048)
+def _parse_condition(text):
+    parser = _Parser(text)
+    node = parser.condition()
+    parser.done()
+    return node
+
+
+@functools.lru_cache(maxsize=2048)
+def _parse_update(text):
+    parser = _Parser(text)
+    node = parser.update()
+    parser.done()
+    return node
+
+
+@functools.lru_cache(maxsize=2048)
+def _parse_projection(text):
+    parser = _Parser(text)
+    paths = [parser.path()]
+    while parser.peek() == ('op', ','):
+        parser.pos += 1
+        paths.append(parser.path())
+    parser.done()
+    return tuple(paths)
+
+
+class _Context:
+    """Expression attribute names and values for one request."""
+
+    def __init__(self, names, values):
+        self.names = names or {}
+        self.values = values or {}
+
+    def name(self, node):
+        text = node[1]
+        if text.startswith('#'):
+            if text not in self.names:
+                raise _invalid(f'An expression attribute name used in the document path is not defined; attribute name: {text}')
+            return self.names[text]
+        return text
+
+    def operand(self, node, item):
+        kind = node[0]
+        if kind == 'value':
+            if node[1] not in self.values:
+                raise _invalid(f'An expression attribute value used in expression is not defined; attribute value: {node[1]}')
+            return self.values[node[1]]
+        if kind == 'path':
+            return item.get(self.name(node))
+        if kind == 'size':
+            av = item.get(self.name(node[1]))
+            if av is None:
+                return None
+            (t, value), = av.items()
+            length = len(value.encode('utf-8')) if t == 'S' else len(value)
+            return {'N': str(length)}
+        if kind == 'if_not_exists':
+            current = item.get(self.name(node[1]))
+            return current if current is not None else self.operand(node[2], item)
+        if kind == 'list_append':
+            a, b = self.operand(node[1], item), self.operand(node[2], item)
+            if _type_of(a) != 'L' or _type_of(b) != 'L':
+                raise _invalid('list_append operands must be lists')
+            return {'L': a['L'] + b['L']}
+        if kind == 'arith':
+            a, b = self.operand(node[2], item), self.operand(node[3], item)
+            if _type_of(a) != 'N' or _type_of(b) != 'N':
+                raise _invalid('An operand in the update expression has an incorrect data type')
+            x, y = Decimal(a['N']), Decimal(b['N'])
+            return _number_av(x + y if node[1] == '+' else x - y)
+        raise _invalid(f'Unsupported operand {kind}')
+
+    def test(self, node, item):
+        kind = node[0]
+        if kind == 'and':
+            return self.test(node[1], item) and self.test(node[2], item)
+        if kind == 'or':
+            return self.test(node[1], item) or self.test(node[2], item)
+        if kind == 'not':
+            return not self.test(node[1], item)
+        if kind == 'cmp':
+            return _compare(node[1], self.operand(node[2], item), self.operand(node[3], item))
+        if kind == 'between':
+            value = self.operand(node[1], item)
+            return (_compare('>=', value, self.operand(node[2], item))
+                    and _compare('<=', value, self.operand(node[3], item)))
+        if kind == 'in':
+            value = self.operand(node[1], item)
+            return any(_compare('=', value, self.operand(o, item)) for o in node[2])
+        if kind == 'fn':
+            name, args = node[1], node[2]
+            present = item.get(self.name(args[0]))
+            if name == 'attribute_exists':
+                return present is not None
+            if name == 'attribute_not_exists':
+                return present is None
+            if present is None:
+                return False
+            arg = self.operand(args[1], item)
+            if name == 'attribute_type':
+                return _type_of(present) == arg.get('S')
+            if name == 'begins_with':
+                t = _type_of(present)
+                return t in ('S', 'B') and t == _type_of(arg) and present[t].startswith(arg[t])
+            if name == 'contains':
+                t, value = next(iter(present.items()))
+                if t == 'S':
+                    return _type_of(arg) == 'S' and arg['S'] in value
+                if t == 'L':
+                    return _norm(arg) in {_norm(v) for v in value}
+                if t in ('SS', 'NS', 'BS'):
+                    return _type_of(arg) == t[0] and _norm(arg) in _norm(present)
+                return False
+        raise _invalid(f'Unsupported condition {kind}')
+
+
+def _compare(op, a, b):
+    if a is None or b is None:
+        return op == '<>' and (a is None) != (b is None)
+    if op in ('=', '<>'):
+        equal = _type_of(a) == _type_of(b) and _norm(a) == _norm(b)
+        return equal if op == '=' else not equal
+    if _type_of(a) != _type_of(b) or _type_of(a) not in ('S', 'N', 'B'):
+        return False
+    x, y = _norm(a), _norm(b)
+    return {'<': x < y, '<=': x <= y, '>': x > y, '>=': x >= y}[op]
+
+
+# -- tables -------------------------------------------------------------------
+
+class _Top:
+    """Sorts after everything; used as an exclusive upper bound in bisect."""
+
+    def __lt__(self, other):
+        return False
+
+    def __gt__(self, other):
+        return True
+
+
+_TOP = _Top()
+
+
+class _Index:
+    """Items grouped by hash key and sorted by (range key, primary key)."""
+
+    def __init__(self, hash_key, range_key=None):
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.partitions = collections.defaultdict(list)
+
+    def entry(self, item, pk):
+        if self.hash_key not in item or (self.range_key and self.range_key not in item):
+            return None
+        sort = (_norm(item[self.range_key]), pk) if self.range_key else (pk,)
+        return _norm(item[self.hash_key]), sort
+
+    def add(self, entry):
+        if entry:
+            bisect.insort(self.partitions[entry[0]], entry[1])
+
+    def remove(self, entry):
+        if entry:
+            part = self.partitions[entry[0]]
+            i = bisect.bisect_left(part, entry[1])
+            if i < len(part) and part[i] == entry[1]:
+                del part[i]
+            if not part:
+                del self.partitions[entry[0]]
+
+
+class _Table:
+    def __init__(self, name, key, indexes):
+        self.name = name
+        self.key = key
+        self.items = {}
+        self.primary = _Index(*key)
+        self.indexes = {index_name: _Index(*schema) for index_name, schema in indexes.items()}
+        self._segments = {}
+
+    def pk(self, item):
+        try:
+            return tuple(_norm(item[k]) for k in self.key if k)
+        except KeyError:
+            raise _invalid('The provided key element does not match the schema')
+
+    def key_of(self, item):
+        return {k: item[k] for k in self.key if k}
+
+    def store(self, pk, new):
+        """Replace the item at pk (None deletes); returns the write units used."""
+        old = self.items.get(pk)
+        units = max(1, math.ceil(max(item_size(old), item_size(new)) / 1024))
+        for index in [self.primary, *self.indexes.values()]:
+            before, after = (index.entry(old, pk) if old else None), (index.entry(new, pk) if new else None)
+            if index is not self.primary and (before or after) and old != new:
+                units += max(1, math.ceil(item_size(new or old) / 1024)) * (2 if before and after and before != after else 1)
+            if before != after:
+                index.remove(before)
+                index.add(after)
+        if new is None:
+            self.items.pop(pk, None)
+        else:
+            self.items[pk] = new
+        if (old is None) != (new is None):
+            self._segments.clear()
+        return units
+
+    def segments(self, total):
+        order = self._segments.get(total)
+        if order is None:
+            order = [[] for _ in range(total)]
+            for pk in sorted(self.items):
+                order[zlib.crc32(repr(pk).encode('utf-8')) % total].append(pk)
+            self._segments[total] = order
+        return order
+
+
+def _project(item, expression, ctx):
+    if not expression:
+        return dict(item)
+    out = {}
+    for node in _parse_projection(expression):
+        name = ctx.name(node)
+        if name in item:
+            out[name] = item[name]
+    return out
+
+
+def _read_units(size, consistent):
+    return math.ceil(max(size, 1) / 4096) * (1 if consistent else 0.5)
+
+
+class MemoryDynamoDB:
+    """A thread-safe, in-process subset of boto3.client('dynamodb')."""
+
+    def __init__(self, latency_ms=0.0):
+        self.latency = latency_ms / 1000.0
+        self.tables = {}
+        self._lock = threading.RLock()
+        self.reset_meter()
+
+    # -- metering --
+
+    def reset_meter(self):
+        """Zero the counters; returns what they held."""
+        snapshot = getattr(self, 'meter', None)
+        self.meter = {'read': 0.0, 'write': 0.0, 'calls': collections.Counter()}
+        return snapshot
+
+    def _consume(self, table, read=0.0, write=0.0):
+        self.meter['read'] += read
+        self.meter['write'] += write
+        return {'TableName': table, 'CapacityUnits': read + write}
+
+    def _begin(self, operation):
+        with self._lock:
+            self.meter['calls'][operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _table(self, name):
+        table = self.tables.get(name)
+        if table is None:
+            raise ClientError('ResourceNotFoundException', f'Requested resource not found: Table: {name} not found')
+        return table
+
+    # -- control plane --
+
+    def create_table(self, TableName, KeySchema, GlobalSecondaryIndexes=(), **_):
+        def schema(elements):
+            roles = {e['KeyType']: e['AttributeName'] for e in elements}
+            return roles['HASH'], roles.get('RANGE')
+
+        with self._lock:
+            if TableName in self.tables:
+                raise ClientError('ResourceInUseException', f'Table already exists: {TableName}')
+            self.tables[TableName] = _Table(
+                TableName,
+                schema(KeySchema),
+                {g['IndexName']: schema(g['KeySchema']) for g in GlobalSecondaryIndexes or ()},
+            )
+        return {'TableDescription': {'TableName': TableName, 'TableStatus': 'ACTIVE'}}
+
+    # -- single items --
+
+    def get_item(self, TableName, Key, ProjectionExpression=None, ExpressionAttributeNames=None,
+                 ConsistentRead=False, ReturnConsumedCapacity='NONE'):
+        self._begin('GetItem')
+        with self._lock:
+            table = self._table(TableName)
+            item = table.items.get(table.pk(Key))
+            res = {}
+            if item is not None:
+                res['Item'] = _project(item, ProjectionExpression, _Context(ExpressionAttributeNames, None))
+            used = self._consume(TableName, read=_read_units(item_size(item), ConsistentRead))
+        if ReturnConsumedCapacity != 'NONE':
+            res['ConsumedCapacity'] = used
+        return res
+
+    def _write(self, operation, table, pk, build, condition, names, values, return_values, units_scale=1):
+        old = table.items.get(pk)
+        ctx = _Context(names, values)
+        if condition and not ctx.test(_parse_condition(condition), old or {}):
+            self._consume(table.name, write=max(1, math.ceil(item_size(old) / 1024)) * units_scale)
+            raise ClientError('ConditionalCheckFailedException', 'The conditional request failed', operation)
+        new, touched = build(old, ctx)
+        used = self._consume(table.name, write=table.store(pk, new) * units_scale)
+        res = {}
+        if return_values in ('ALL_OLD', 'UPDATED_OLD') and old:
+            res['Attributes'] = dict(old) if return_values == 'ALL_OLD' else {k: old[k] for k in touched if k in old}
+        elif return_values in ('ALL_NEW', 'UPDATED_NEW') and new:
+            res['Attributes'] = dict(new) if return_values == 'ALL_NEW' else {k: new[k] for k in touched if k in new}
+        return res, used
+
+    def put_item(self, TableName, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+                 ExpressionAttributeValues=None, ReturnValues='NONE', ReturnConsumedCapacity='NONE'):
+        self._begin('PutItem')
+        with self._lock:
+            table = self._table(TableName)
+            res, used = self._write('PutItem', table, table.pk(Item), lambda old, ctx: (dict(Item), ()),
+                                    ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues, ReturnValues)
+        if ReturnConsumedCapacity != 'NONE':
+            res['ConsumedCapacity'] = used
+        return res
+
+    def _updater(self, table, key, expression):
+        def build(old, ctx):
+            item = dict(old) if old else dict(key)
+            touched = []
+            for action, target, operand in _parse_update(expression):
+                name = ctx.name(target)
+                if name in table.key:
+                    raise _invalid(f'Cannot update attribute {name}. This attribute is part of the key')
+                touched.append(name)
+                if action == 'REMOVE':
+                    item.pop(name, None)
+                    continue
+                value = ctx.operand(operand, old or {})
+                if action == 'SET':
+                    item[name] = value
+                    continue
+                current = item.get(name)
+                kind = _type_of(value)
+                if action == 'ADD':
+                    if current is None:
+                        item[name] = value
+                    elif kind == 'N' and _type_of(current) == 'N':
+                        item[name] = _number_av(Decimal(current['N']) + Decimal(value['N']))
+                    elif kind in ('SS', 'NS', 'BS') and _type_of(current) == kind:
+                        item[name] = {kind: list(dict.fromkeys(current[kind] + value[kind]))}
+                    else:
+                        raise _invalid('An operand in the update expression has an incorrect data type')
+                elif current is not None:
+                    remaining = [v for v in current[kind] if v not in value[kind]]
+                    if remaining:
+                        item[name] = {kind: remaining}
+                    else:
+                        item.pop(name)
+            return item, touched
+        return build
+
+    def update_item(self, TableName, Key, UpdateExpression, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues='NONE', ReturnConsumedCapacity='NONE'):
+        self._begin('UpdateItem')
+        with self._lock:
+            table = self._table(TableName)
+            res, used = self._write('UpdateItem', table, table.pk(Key), self._updater(table, Key, UpdateExpression),
+                                    ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues, ReturnValues)
+        if ReturnConsumedCapacity != 'NONE':
+            res['ConsumedCapacity'] = used
+        return res
+
+    def delete_item(self, TableName, Key, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues='NONE', ReturnConsumedCapacity='NONE'):
+        self._begin('DeleteItem')
+        with self._lock:
+            table = self._table(TableName)
+            res, used = self._write('DeleteItem', table, table.pk(Key), lambda old, ctx: (None, ()),
+                                    ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues, ReturnValues)
+        if ReturnConsumedCapacity != 'NONE':
+            res['ConsumedCapacity'] = used
+        return res
+
+    # -- reads over many items --
+
+    def _page(self, table, pks, ctx, index, filter_expression, projection, limit, select, consistent):
+        """Read items in order until Limit or 1 MB; returns the response body."""
+        filter_node = _parse_condition(filter_expression) if filter_expression else None
+        items, scanned, size, last = [], 0, 0, None
+        for pk in pks:
+            item = table.items[pk]
+            scanned += 1
+            size += item_size(item)
+            last = item
+            if filter_node is None or ctx.test(filter_node, item):
+                if select != 'COUNT':
+                    items.append(_project(item, projection, ctx))
+            if scanned == limit or size >= PAGE_BYTES:
+                break
+        else:
+            last = None
+        res = {'Count': len(items) if select != 'COUNT' else scanned, 'ScannedCount': scanned}
+        if select != 'COUNT':
+            res['Items'] = items
+        if last is not None:
+            key = table.key_of(last)
+            if index:
+                key.update({k: last[k] for k in (index.hash_key, index.range_key) if k})
+            res['LastEvaluatedKey'] = key
+        used = self._consume(table.name, read=_read_units(size, consistent) if scanned else 0.5)
+        return res, used
+
+    def query(self, TableName, KeyConditionExpression, IndexName=None, FilterExpression=None,
+              ProjectionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None,
+              Limit=None, ExclusiveStartKey=None, ScanIndexForward=True, Select=None, ConsistentRead=False,
+              ReturnConsumedCapacity='NONE'):
+        self._begin('Query')
+        ctx = _Context(ExpressionAttributeNames, ExpressionAttributeValues)
+        with self._lock:
+            table = self._table(TableName)
+            if IndexName and IndexName not in table.indexes:
+                raise _invalid(f'The table does not have the specified index: {IndexName}')
+            index = table.indexes[IndexName] if IndexName else table.primary
+            partition, bounds = self._key_condition(index, _parse_condition(KeyConditionExpression), ctx)
+            entries = index.partitions.get(partition, [])
+            lo, hi = self._range(entries, bounds)
+            if ExclusiveStartKey:
+                start = index.entry(ExclusiveStartKey, table.pk(ExclusiveStartKey))[1]
+                if ScanIndexForward:
+                    lo = max(lo, bisect.bisect_right(entries, start))
+                else:
+                    hi = min(hi, bisect.bisect_left(entries, start))
+            span = entries[lo:hi] if ScanIndexForward else entries[lo:hi][::-1]
+            prefix = bounds.get('prefix')
+            pks = (e[-1] for e in span if prefix is None or _starts(e[0], prefix))
+            res, used = self._page(table, pks, ctx, index if IndexName else None, FilterExpression,
+                                   ProjectionExpression, Limit, Select, ConsistentRead and not IndexName)
+        if ReturnConsumedCapacity != 'NONE':
+            res['ConsumedCapacity'] = used
+        return res
+
+    def scan(self, TableName, IndexName=None, FilterExpression=None, ProjectionExpression=None,
+             ExpressionAttributeNames=None, ExpressionAttributeValues=None, Limit=None, ExclusiveStartKey=None,
+             Segment=0, TotalSegments=1, Select=None, ConsistentRead=False, ReturnConsumedCapacity='NONE'):
+        self._begin('Scan')
+        if IndexName:
+            raise _invalid('Index scans are not supported by the stand-in')
+        ctx = _Context(ExpressionAttributeNames, ExpressionAttributeValues)
+        with self._lock:
+            table = self._table(TableName)
+            order = table.segments(TotalSegments)[Segment]
+            start = bisect.bisect_right(order, table.pk(ExclusiveStartKey)) if ExclusiveStartKey else 0
+            res, used = self._page(table, iter(order[start:]), ctx, None, FilterExpression,
+                                   ProjectionExpression, Limit, Select, ConsistentRead)
+        if ReturnConsumedCapacity != 'NONE':
+            res['ConsumedCapacity'] = used
+        return res
+
+    @staticmethod
+    def _key_condition(index, node, ctx):
+        parts = []
+
+        def flatten(n):
+            if n[0] == 'and':
+                flatten(n[1])
+                flatten(n[2])
+            else:
+                parts.append(n)
+
+        flatten(node)
+        partition, bounds = None, {}
+        for part in parts:
+            if part[0] == 'cmp' and part[2][0] == 'path' and ctx.name(part[2]) == index.hash_key and part[1] == '=':
+                partition = _norm(ctx.operand(part[3], {}))
+            elif part[0] == 'cmp' and part[2][0] == 'path' and ctx.name(part[2]) == index.range_key:
+                value = _norm(ctx.operand(part[3], {}))
+                bounds.update({'=': {'lo': value, 'hi': value},
+                               '<': {'hi': value, 'hi_open': True},
+                               '<=': {'hi': value},
+                               '>': {'lo': value, 'lo_open': True},
+                               '>=': {'lo': value}}.get(part[1], {}))
+                if part[1] == '<>':
+                    raise _invalid('Unsupported operator in KeyConditionExpression: <>')
+            elif part[0] == 'between' and ctx.name(part[1]) == index.range_key:
+                bounds.update(lo=_norm(ctx.operand(part[2], {})), hi=_norm(ctx.operand(part[3], {})))
+            elif part[0] == 'fn' and part[1] == 'begins_with' and ctx.name(part[2][0]) == index.range_key:
+                bounds.update(lo=_norm(ctx.operand(part[2][1], {})), prefix=_norm(ctx.operand(part[2][1], {})))
+            else:
+                raise _invalid('Query key condition not supported')
+        if partition is None:
+            raise _invalid('Query condition missed key schema element')
+        return partition, bounds
+
+    @staticmethod
+    def _range(entries, bounds):
+        lo, hi = 0, len(entries)
+        if 'lo' in bounds:
+            lo = bisect.bisect_left(entries, (bounds['lo'], _TOP) if bounds.get('lo_open') else (bounds['lo'],))
+        if 'hi' in bounds:
+            hi = bisect.bisect_left(entries, (bounds['hi'],) if bounds.get('hi_open') else (bounds['hi'], _TOP))
+        return lo, max(lo, hi)
+
+    # -- batches and transactions --
+
+    def batch_get_item(self, RequestItems, ReturnConsumedCapacity='NONE'):
+        self._begin('BatchGetItem')
+        if sum(len(r['Keys']) for r in RequestItems.values()) > 100:
+            raise _invalid('Too many items requested for the BatchGetItem call')
+        responses, consumed = {}, []
+        with self._lock:
+            for name, request in RequestItems.items():
+                table = self._table(name)
+                ctx = _Context(request.get('ExpressionAttributeNames'), None)
+                found, read = [], 0.0
+                for key in request['Keys']:
+                    item = table.items.get(table.pk(key))
+                    read += _read_units(item_size(item), request.get('ConsistentRead', False))
+                    if item is not None:
+                        found.append(_project(item, request.get('ProjectionExpression'), ctx))
+                responses[name] = found
+                consumed.append(self._consume(name, read=read))
+        res = {'Responses': responses, 'UnprocessedKeys': {}}
+        if ReturnConsumedCapacity != 'NONE':
+            res['ConsumedCapacity'] = consumed
+        return res
+
+    def batch_write_item(self, RequestItems, ReturnConsumedCapacity='NONE'):
+        self._begin('BatchWriteItem')
+        if sum(len(r) for r in RequestItems.values()) > 25:
+            raise _invalid('Too many items requested for the BatchWriteItem call')
+        consumed = []
+        with self._lock:
+            for name, requests in RequestItems.items():
+                table = self._table(name)
+                seen, writes = set(), []
+                for request in requests:
+                    (kind, body), = request.items()
+                    item = body['Item'] if kind == 'PutRequest' else body['Key']
+                    pk = table.pk(item)
+                    if pk in seen:
+                        raise _invalid('Provided list of item keys contains duplicates')
+                    seen.add(pk)
+                    writes.append((pk, dict(item) if kind == 'PutRequest' else None))
+                units = sum(table.store(pk, new) for pk, new in writes)
+                consumed.append(self._consume(name, write=units))
+        res = {'UnprocessedItems': {}}
+        if ReturnConsumedCapacity != 'NONE':
+            res['ConsumedCapacity'] = consumed
+        return res
+
+    def transact_write_items(self, TransactItems, ReturnConsumedCapacity='NONE', ClientRequestToken=None):
+        self._begin('TransactWriteItems')
+        if len(TransactItems) > 100:
+            raise _invalid('Member must have length less than or equal to 100')
+        with self._lock:
+            plan, reasons, failed, seen = [], [], False, set()
+            for action in TransactItems:
+                (kind, body), = action.items()
+                table = self._table(body['TableName'])
+                pk = table.pk(body['Item'] if kind == 'Put' else body['Key'])
+                if (table.name, pk) in seen:
+                    raise _invalid('Transaction request cannot include multiple operations on one item')
+                seen.add((table.name, pk))
+                ctx = _Context(body.get('ExpressionAttributeNames'), body.get('ExpressionAttributeValues'))
+                old = table.items.get(pk)
+                condition = body.get('ConditionExpression')
+                if condition and not ctx.test(_parse_condition(condition), old or {}):
+                    reasons.append({'Code': 'ConditionalCheckFailed', 'Message': 'The conditional request failed'})
+                    failed = True
+                    continue
+                reasons.append({'Code': 'None'})
+                if kind == 'Put':
+                    new = dict(body['Item'])
+                elif kind == 'Update':
+                    new = self._updater(table, body['Key'], body['UpdateExpression'])(old, ctx)[0]
+                elif kind == 'Delete':
+                    new = None
+                else:
+                    continue
+                plan.append((table, pk, new))
+            if failed:
+                for action in TransactItems:
+                    body = next(iter(action.values()))
+                    self._consume(body['TableName'], write=2)
+                raise ClientError(
+                    'TransactionCanceledException',
+                    'Transaction cancelled, please refer cancellation reasons for specific reasons '
+                    f"[{', '.join(r['Code'] for r in reasons)}]",
+                    'TransactWriteItems',
+                    CancellationReasons=reasons,
+                )
+            consumed = collections.defaultdict(float)
+            for table, pk, new in plan:
+                consumed[table.name] += table.store(pk, new) * 2
+            for name, units in consumed.items():
+                self._consume(name, write=units)
+        res = {}
+        if ReturnConsumedCapacity != 'NONE':
+            res['ConsumedCapacity'] = [{'TableName': n, 'CapacityUnits': u} for n, u in consumed.items()]
+        return res
+
+
+def _starts(value, prefix):
+    return isinstance(value, (str, bytes)) and value.startswith(prefix)
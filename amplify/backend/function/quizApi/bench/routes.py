@@ -0,0 +1,291 @@
+"""Route benchmark for the quizApi Lambda handler.
+
+Drives lambda_handler with synthetic API Gateway events against the in-memory
+DynamoDB stand-in (memory_dynamodb.py), seeded with question banks of each
+requested size, and reports per route:
+
+  latency - p50/p99/max wall time of lambda_handler
+  units   - read and write request units and DynamoDB calls per request
+  memory  - peak Python allocations during one request (tracemalloc)
+
+Every bank size runs in a fresh interpreter so warm pools and allocator
+state do not carry over between sizes. Results are printed as one JSON
+object so runs can be stored per release and compared:
+
+    python bench/routes.py --sizes 1000,10000,100000 --label v1.5.0 >> routes-history.jsonl
+
+The stand-in answers in microseconds; --latency-ms adds a fixed delay per
+DynamoDB call as a rough model of the network round trip. No AWS calls are
+made; credentials are not needed. --storage sqlite runs the same routes on
+the embedded SQLite backend (QUIZ_STORAGE=sqlite:...) instead; units are
+then not reported. --bundle builds a quiz bundle after seeding (as
+`maintenance.py build-bundle` would) so GET /quiz is served from it.
+"""
+import argparse
+import contextlib
+import json
+import math
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(BENCH, '..', 'src')
+
+ADMIN = {'authorizer': {'jwt': {'claims': {'cognito:groups': 'Admin', 'sub': 'bench-user'}}}}
+PROGRESS_TABLES = {'USERPROGRESS_TABLE': 'BenchUserProgress', 'QUIZSESSION_TABLE': 'BenchQuizSession'}
+DIFFICULTIES = ('EASY', 'MEDIUM', 'HARD')
+
+
+def _event(method, path, qs=None, body=None, admin=False):
+    return {
+        'httpMethod': method,
+        'path': path,
+        'headers': {'content-type': 'application/json'},
+        'queryStringParameters': qs,
+        'body': json.dumps(body) if body is not None else None,
+        'isBase64Encoded': False,
+        'requestContext': ADMIN if admin else {},
+    }
+
+
+def _row(n, subject):
+    return {
+        'subject': subject,
+        'question': f'Synthetic question {n}: which control best mitigates threat {n % 97} in scenario {n}?',
+        'options': [f'Option {c} for question {n}' for c in 'ABCD'],
+        'answerIndex': n % 4,
+        'difficulty': DIFFICULTIES[n % 3],
+        'tags': ['bench', f'topic-{n % 13}'],
+    }
+
+
+def _create_tables(ddb, index):
+    def key(name, kind='HASH'):
+        return {'AttributeName': name, 'KeyType': kind}
+
+    def gsi(name, *schema):
+        return {'IndexName': name, 'KeySchema': list(schema), 'Projection': {'ProjectionType': 'ALL'}}
+
+    ddb.create_table(TableName=index.QUESTIONS_TABLE, KeySchema=[key('questionId')], GlobalSecondaryIndexes=[
+        gsi('SubjectIndex', key('subjectId')),
+        gsi('SubjectRandomIndex', key('subjectId'), key('randomKey', 'RANGE')),
+        gsi('RandomIndex', key('randomShard'), key('randomKey', 'RANGE')),
+        gsi('SubjectDifficultyIndex', key('subjectDifficulty'), key('randomKey', 'RANGE')),
+    ])
+    ddb.create_table(TableName=index.SUBJECTS_TABLE, KeySchema=[key('subjectId')], GlobalSecondaryIndexes=[
+        gsi('SubjectNameIndex', key('subjectName')),
+    ])
+    ddb.create_table(TableName=index.CONTENT_HASH_TABLE, KeySchema=[key('contentHash')])
+    for table in PROGRESS_TABLES.values():
+        ddb.create_table(TableName=table, KeySchema=[key('id')], GlobalSecondaryIndexes=[gsi('byUserId', key('userId'))])
+
+
+def _seed(index, size, subjects):
+    names = [f'Bench Subject {i:02d}' for i in range(subjects)]
+    cache = {}
+    chunk = 1000
+    for start in range(0, size, chunk):
+        rows = [_row(n, names[n % subjects]) for n in range(start, min(size, start + chunk))]
+        report = index._bulk_create_questions(rows, row_offset=start, subject_cache=cache, id_prefix='seed')
+        if report['errors']:
+            raise RuntimeError(f"seeding failed: {report['error_details'][:3]}")
+    return [cache[name]['subjectId'] for name in names]
+
+
+def _scenarios(index, size, subject_ids, iterations, bulk_rows):
+    """(name, [events]) in run order; read routes first, writes last."""
+    question_ids = [f'seed-{n + 1}' for n in random.sample(range(size), min(iterations, size))]
+    quiz_tokens = []
+    for _ in range(iterations):
+        res = index.lambda_handler(_event('GET', '/quiz', {'count': '10', 'subjectId': random.choice(subject_ids)}), None)
+        quiz = json.loads(res['body'])
+        quiz_tokens.append({
+            'token': quiz['token'],
+            'answers': {q['questionId']: q.get('answerIndex', 0) for q in quiz['questions']},
+        })
+    # Build the search index here so its one-off scan is not timed as a request
+    index.lambda_handler(_event('GET', '/questions/search', {'q': 'threat'}, admin=True), None)
+    searches = ['threat', 'mitigates threat 42', 'scen', 'control', 'topic-7', 'option a question 99']
+    return [
+        ('GET /quiz?subjectId', [_event('GET', '/quiz', {'count': '10', 'subjectId': random.choice(subject_ids)})
+                                 for _ in range(iterations)]),
+        ('GET /quiz?subjectId=5 subjects&difficulty', [_event('GET', '/quiz', {
+            'count': '10', 'subjectId': ','.join(random.sample(subject_ids, min(5, len(subject_ids)))),
+            'difficulty': random.choice(DIFFICULTIES),
+        }) for _ in range(iterations)]),
+        ('GET /quiz', [_event('GET', '/quiz', {'count': '10'}) for _ in range(iterations)]),
+        ('POST /quiz/grade', [_event('POST', '/quiz/grade', body=t, admin=True) for t in quiz_tokens]),
+        # After grading, so the bench user has a history to weight by
+        ('GET /quiz?subjectId&adaptive', [_event('GET', '/quiz', {
+            'count': '10', 'subjectId': random.choice(subject_ids), 'adaptive': '1',
+        }, admin=True) for _ in range(iterations)]),
+        ('GET /subjects', [_event('GET', '/subjects') for _ in range(iterations)]),
+        ('GET /subjects/{id}', [_event('GET', f'/subjects/{random.choice(subject_ids)}') for _ in range(iterations)]),
+        ('GET /questions?subjectId', [_event('GET', '/questions', {'subjectId': random.choice(subject_ids), 'limit': '50'}, admin=True)
+                                      for _ in range(iterations)]),
+        ('GET /questions/{id}', [_event('GET', f'/questions/{qid}', admin=True) for qid in question_ids]),
+        ('GET /questions/search', [_event('GET', '/questions/search', {'q': random.choice(searches)}, admin=True)
+                                   for _ in range(iterations)]),
+        ('POST /questions', [_event('POST', '/questions', body={
+            'subjectId': random.choice(subject_ids), **{k: v for k, v in _row(10**9 + i, '').items() if k != 'subject'},
+        }, admin=True) for i in range(iterations)]),
+        ('POST /questions/bulk', [_event('POST', '/questions/bulk', body={
+            'questions': [_row(2 * 10**9 + i * bulk_rows + r, f'Bench Subject {r % len(subject_ids):02d}') for r in range(bulk_rows)],
+        }, admin=True) for i in range(max(1, iterations // 10))]),
+    ]
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    return values[max(0, math.ceil(pct / 100 * len(values)) - 1)]
+
+
+def _run_route(index, ddb, events, memory_samples):
+    timings, reads, writes, calls, statuses = [], [], [], [], {}
+    for event in events:
+        if ddb:
+            ddb.reset_meter()
+        t0 = time.perf_counter()
+        res = index.lambda_handler(event, None)
+        timings.append(time.perf_counter() - t0)
+        if ddb:
+            meter = ddb.meter
+            reads.append(meter['read'])
+            writes.append(meter['write'])
+            calls.append(sum(meter['calls'].values()))
+        statuses[str(res['statusCode'])] = statuses.get(str(res['statusCode']), 0) + 1
+
+    peaks = []
+    for event in events[:memory_samples]:
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        index.lambda_handler(event, None)
+        peaks.append(tracemalloc.get_traced_memory()[1] - base)
+        tracemalloc.stop()
+
+    return {
+        'requests': len(events),
+        'status': statuses,
+        'latency': {
+            'p50_ms': round(statistics.median(timings) * 1000, 3),
+            'p99_ms': round(_percentile(timings, 99) * 1000, 3),
+            'max_ms': round(max(timings) * 1000, 3),
+        },
+        'units': {
+            'read_per_request': round(statistics.mean(reads), 2),
+            'write_per_request': round(statistics.mean(writes), 2),
+            'ddb_calls_per_request': round(statistics.mean(calls), 2),
+        } if ddb else None,
+        'memory': {
+            'peak_kb_p50': round(statistics.median(peaks) / 1024, 1) if peaks else None,
+            'peak_kb_max': round(max(peaks) / 1024, 1) if peaks else None,
+        },
+    }
+
+
+def worker(args):
+    """Seed one bank size and run every route against it (in this process)."""
+    for name, table in PROGRESS_TABLES.items():
+        os.environ.setdefault(name, table)
+    os.environ.setdefault('QUIZ_TOKEN_SECRET', 'bench')
+    os.environ['QUIZ_METRICS_SAMPLE_RATE'] = str(args.metrics_sample_rate)
+    if args.storage == 'sqlite':
+        os.environ['QUIZ_STORAGE'] = 'sqlite::memory:'
+    sys.path.insert(0, SRC)
+    sys.path.insert(0, BENCH)
+    import index
+    from memory_dynamodb import MemoryDynamoDB
+
+    random.seed(args.seed)
+    ddb = None
+    if args.storage == 'memory':
+        ddb = MemoryDynamoDB()
+        index._clients['dynamodb'] = ddb
+        _create_tables(ddb, index)
+    t0 = time.perf_counter()
+    subject_ids = _seed(index, args.size, args.subjects)
+    seed_seconds = time.perf_counter() - t0
+    index.QUIZ_BUNDLE_PATHS = []
+    bundle_info = None
+    if args.bundle:
+        import maintenance
+        path = os.path.join(tempfile.mkdtemp(prefix='quiz-bench-'), 'quiz-bundle.qzb')
+        t0 = time.perf_counter()
+        bundle_info = maintenance.build_bundle(out=path)
+        bundle_info['build_seconds'] = round(time.perf_counter() - t0, 2)
+        index.QUIZ_BUNDLE_PATHS = [path]
+
+    routes = {}
+    scenarios = _scenarios(index, args.size, subject_ids, args.iterations, args.bulk_rows)
+    if ddb:
+        ddb.latency = args.latency_ms / 1000.0
+    for name, events in scenarios:
+        if args.routes and name not in args.routes:
+            continue
+        routes[name] = _run_route(index, ddb, events, args.memory_samples)
+    return {
+        'size': args.size,
+        'storage': args.storage,
+        'subjects': args.subjects,
+        'seed_seconds': round(seed_seconds, 2),
+        'bundle': bundle_info,
+        'rss_max_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'routes': routes,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='quizApi route benchmark against an in-memory DynamoDB')
+    parser.add_argument('--sizes', default='1000,10000,100000', help='comma-separated question bank sizes')
+    parser.add_argument('--subjects', type=int, default=20)
+    parser.add_argument('--iterations', type=int, default=200, help='requests per route (bulk uploads: a tenth)')
+    parser.add_argument('--bulk-rows', type=int, default=100, help='rows per POST /questions/bulk request')
+    parser.add_argument('--memory-samples', type=int, default=5, help='requests per route traced for memory')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='simulated delay per DynamoDB call')
+    parser.add_argument('--metrics-sample-rate', type=float, default=0.0,
+                        help='QUIZ_METRICS_SAMPLE_RATE for the handler (EMF lines go to stderr)')
+    parser.add_argument('--storage', choices=('memory', 'sqlite'), default='memory',
+                        help='in-memory DynamoDB stand-in or the embedded SQLite backend')
+    parser.add_argument('--bundle', action='store_true', help='serve GET /quiz from a bundle built after seeding')
+    parser.add_argument('--routes', help='comma-separated route names to run (default: all)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--label', default=os.environ.get('RELEASE_LABEL', 'dev'))
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    args.routes = [r.strip() for r in args.routes.split(',')] if args.routes else None
+
+    if args.size:
+        with contextlib.redirect_stdout(sys.stderr):  # the handler's EMF lines
+            result = worker(args)
+        print(json.dumps(result))
+        return 0
+
+    results = []
+    for size in (int(s) for s in args.sizes.split(',')):
+        cmd = [sys.executable, os.path.abspath(__file__), '--size', str(size)] + [
+            a for a in (argv if argv is not None else sys.argv[1:])
+        ]
+        out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+    report = {
+        'benchmark': 'quizApi.routes',
+        'label': args.label,
+        'timestamp': int(time.time()),
+        'python': sys.version.split()[0],
+        'iterations': args.iterations,
+        'latency_ms_per_call': args.latency_ms,
+        'sizes': results,
+    }
+    print(json.dumps(report))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
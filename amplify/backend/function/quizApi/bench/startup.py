@@ -0,0 +1,96 @@
+"""Cold-start benchmark for the quizApi Lambda module.
+
+Every sample runs in a fresh interpreter, the way a new Lambda container
+does, and times:
+
+  import   - `import index` (module init, what Lambda reports as Init Duration)
+  client   - building the DynamoDB client on first use
+  resource - in a separate fresh interpreter, importing boto3 and building
+             boto3.resource('dynamodb') plus two Table objects, which is what
+             the module used to do at import; kept for comparison
+
+Results are printed as one JSON object so runs can be stored per release:
+
+    python bench/startup.py --runs 20 --label v1.4.0 >> startup-history.jsonl
+
+No AWS calls are made; credentials are not needed.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+_CLIENT_PROBE = r'''
+import json, time
+t0 = time.perf_counter()
+import index
+t1 = time.perf_counter()
+index._dynamodb_client()
+t2 = time.perf_counter()
+print(json.dumps({'import': t1 - t0, 'client': t2 - t1}))
+'''
+
+_RESOURCE_PROBE = r'''
+import json, time
+t0 = time.perf_counter()
+import boto3
+ddb = boto3.resource('dynamodb')
+ddb.Table('QuizQuestions')
+ddb.Table('QuizSubjects')
+print(json.dumps({'resource': time.perf_counter() - t0}))
+'''
+
+
+def _run(probe):
+    env = dict(os.environ)
+    env.setdefault('AWS_DEFAULT_REGION', 'eu-west-2')
+    out = subprocess.run([sys.executable, '-c', probe], cwd=SRC, env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def _sample(with_resource):
+    result = _run(_CLIENT_PROBE)
+    if with_resource:
+        result.update(_run(_RESOURCE_PROBE))
+    return result
+
+
+def _summary(values):
+    values = sorted(values)
+    return {
+        'p50_ms': round(statistics.median(values) * 1000, 2),
+        'p90_ms': round(values[min(len(values) - 1, int(len(values) * 0.9))] * 1000, 2),
+        'min_ms': round(values[0] * 1000, 2),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='quizApi cold-start benchmark')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--label', default=os.environ.get('RELEASE_LABEL', 'dev'))
+    parser.add_argument('--no-resource', action='store_true', help='skip the boto3.resource comparison')
+    args = parser.parse_args(argv)
+
+    samples = [_sample(not args.no_resource) for _ in range(args.runs)]
+    report = {
+        'benchmark': 'quizApi.startup',
+        'label': args.label,
+        'timestamp': int(time.time()),
+        'python': sys.version.split()[0],
+        'runs': args.runs,
+        'phases': {
+            phase: _summary([s[phase] for s in samples])
+            for phase in samples[0]
+        },
+    }
+    print(json.dumps(report))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
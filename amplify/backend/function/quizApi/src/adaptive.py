@@ -0,0 +1,167 @@
+"""Adaptive question selection from a user's answer history.
+
+A History holds one slot per question the user has answered, in compact
+arrays: attempts, misses and when it was last seen, plus its subject and
+difficulty. Questions the user has never answered are not stored at all.
+
+Selection is weighted sampling without replacement (Efraimidis-Spirakis):
+every question draws key = Exp(1) / weight and the `count` smallest keys
+win. An answered question's weight grows with its miss rate and is damped
+while it was seen recently:
+
+    (SEEN_WEIGHT + MISS_WEIGHT * misses / attempts) * (1 - exp(-age / RECENCY_SECONDS))
+
+Unanswered questions all weigh NEW_WEIGHT, so the smallest of their keys
+are the first order statistics of `unseen` exponentials and are generated
+directly. A selection therefore costs O(answered + count) whatever the size
+of the subject. The per-answer arithmetic and key draws are vectorised with
+NumPy when it is installed; otherwise the same computation runs in Python,
+on at most MAX_CANDIDATES answered questions: a uniform random subset of
+them, each standing in for n / MAX_CANDIDATES (its weight scaled by that),
+so the smallest keys, and the mix of answered and new questions, stay
+distributed about as they would over every answer.
+"""
+import heapq
+import math
+import random
+from array import array
+
+try:
+    import numpy
+except ImportError:  # not in the Lambda runtime unless a layer provides it
+    numpy = None
+
+SEEN_WEIGHT = 0.5
+MISS_WEIGHT = 4.0
+NEW_WEIGHT = 1.0
+RECENCY_SECONDS = 86400.0
+MAX_CANDIDATES = 512  # pure-Python ranking only
+
+_INF = float('inf')
+_rng = numpy.random.default_rng() if numpy is not None else None
+
+
+class History:
+
+    def __init__(self):
+        self.ids = []  # slot -> questionId
+        self.slots = {}  # questionId -> slot
+        self.subject_of = []  # slot -> subjectId
+        self.subjects = {}  # subjectId -> array('I') of slots
+        self.difficulty_codes = {}  # difficulty -> code
+        self.difficulties = array('B')  # slot -> difficulty code
+        self.attempts = array('I')
+        self.misses = array('I')
+        self.seen = array('d')  # slot -> last answered, epoch seconds
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, question_id, subject_id, difficulty, correct, when):
+        """Record one answer."""
+        code = self.difficulty_codes.setdefault(difficulty, len(self.difficulty_codes))
+        slot = self.slots.get(question_id)
+        if slot is None:
+            slot = self.slots[question_id] = len(self.ids)
+            self.ids.append(question_id)
+            self.subject_of.append(subject_id)
+            self.subjects.setdefault(subject_id, array('I')).append(slot)
+            self.difficulties.append(code)
+            self.attempts.append(0)
+            self.misses.append(0)
+            self.seen.append(when)
+        elif when >= self.seen[slot]:
+            # The latest answer tells where the question lives now
+            if self.subject_of[slot] != subject_id:
+                self.subjects[self.subject_of[slot]].remove(slot)
+                self.subjects.setdefault(subject_id, array('I')).append(slot)
+                self.subject_of[slot] = subject_id
+            self.difficulties[slot] = code
+            self.seen[slot] = when
+        self.attempts[slot] += 1
+        self.misses[slot] += not correct
+
+    def select(self, subject_id=None, difficulty=None):
+        """Slots of the answered questions of a subject (all when None), optionally of one difficulty."""
+        if subject_id is not None:
+            slots = self.subjects.get(subject_id, array('I'))
+        else:
+            slots = numpy.arange(len(self.ids)) if numpy is not None else range(len(self.ids))
+        if difficulty is None:
+            return slots
+        code = self.difficulty_codes.get(difficulty)
+        if code is None or not len(slots):
+            return array('I')
+        if numpy is not None:
+            idx = numpy.asarray(slots, dtype=numpy.intp)
+            return idx[numpy.frombuffer(self.difficulties, dtype=numpy.uint8)[idx] == code]
+        difficulties = self.difficulties
+        return array('I', [s for s in slots if difficulties[s] == code])
+
+    def weights(self, slots, now, seen_weight=SEEN_WEIGHT, miss_weight=MISS_WEIGHT, recency=RECENCY_SECONDS):
+        if numpy is not None and len(slots):
+            idx = numpy.asarray(slots, dtype=numpy.intp)
+            attempts = numpy.frombuffer(self.attempts, dtype=numpy.uint32)[idx]
+            misses = numpy.frombuffer(self.misses, dtype=numpy.uint32)[idx]
+            age = numpy.maximum(now - numpy.frombuffer(self.seen, dtype=numpy.float64)[idx], 0.0)
+            return (seen_weight + miss_weight * misses / attempts) * -numpy.expm1(-age / recency)
+        attempts, misses, seen, expm1 = self.attempts, self.misses, self.seen, math.expm1
+        return [
+            (seen_weight + miss_weight * misses[s] / attempts[s]) * -expm1(min(seen[s] - now, 0.0) / recency)
+            for s in slots
+        ]
+
+    def rank(self, slots, unseen, count, now, new_weight=NEW_WEIGHT, max_candidates=MAX_CANDIDATES, **weighting):
+        """Draw `count` questions from `slots` plus `unseen` unanswered ones.
+
+        Returns (ranked, review, new): the answered slots in draw order (at
+        most `count`, for topping up), how many of them were drawn, and how
+        many unanswered questions were.
+        """
+        scale = 1.0
+        if numpy is None and len(slots) > max(max_candidates, count):
+            scale = len(slots) / max(max_candidates, count)
+            slots = random.sample(slots, max(max_candidates, count))
+        weights = self.weights(slots, now, **weighting)
+        take = min(count, len(slots))
+        if numpy is not None and len(slots):
+            with numpy.errstate(divide='ignore'):
+                keys = _rng.standard_exponential(len(slots)) / weights
+            top = numpy.argpartition(keys, take - 1)[:take] if take < len(keys) else numpy.arange(len(keys))
+            top = top[numpy.argsort(keys[top])]
+            ranked = numpy.asarray(slots, dtype=numpy.intp)[top].tolist()
+            seen_keys = keys[top].tolist()
+        else:
+            draw = random.random
+            keys = [-math.log(1.0 - draw()) / (w * scale) if w > 0 else _INF for w in weights]
+            top = heapq.nsmallest(take, range(len(keys)), key=keys.__getitem__)
+            ranked = [slots[i] for i in top]
+            seen_keys = [keys[i] for i in top]
+        new_keys = _smallest_keys(unseen, min(count, unseen), new_weight)
+
+        review = new = 0
+        while review + new < count:
+            if review < len(seen_keys) and (new == len(new_keys) or seen_keys[review] <= new_keys[new]):
+                review += 1
+            elif new < len(new_keys):
+                new += 1
+            else:
+                break
+        return ranked, review, new
+
+    def stats(self):
+        return {'questions': len(self.ids), 'answers': sum(self.attempts), 'subjects': len(self.subjects)}
+
+
+def _smallest_keys(population, k, weight):
+    """The k smallest of `population` Exp(1) / weight keys, ascending, without drawing the rest."""
+    if k <= 0 or weight <= 0:
+        return []
+    if numpy is not None:
+        rates = weight * (population - numpy.arange(k, dtype=numpy.float64))
+        return numpy.cumsum(_rng.standard_exponential(k) / rates).tolist()
+    keys, total = [], 0.0
+    for j in range(k):
+        total += random.expovariate(weight * (population - j))
+        keys.append(total)
+    return keys
@@ -0,0 +1,148 @@
+"""Precompiled question bank for serving GET /quiz without DynamoDB.
+
+A bundle is one file built offline (`maintenance.py build-bundle`) for one
+value of the questions version marker. Layout, little-endian:
+
+    header   MAGIC, format, bank version, record count, position of the
+             offsets array, position and length of the subject index
+    records  per question: uint32 length + compact JSON, grouped by subject
+             and then by difficulty
+    offsets  uint32 start of every record, in record order (8-byte aligned)
+    index    JSON {subjectId: {difficulty: [first record, record count]}}
+
+open_bundle() memory-maps the file and parses only the header and the (small)
+subject index. The offsets array is used in place through a memoryview, and
+a record is decoded only when it is picked, so sampling reads a few hundred
+bytes wherever they are in the file and nothing is copied up front.
+"""
+import json
+import mmap
+import os
+import struct
+from array import array
+from collections.abc import Sequence
+
+MAGIC = b'QZB1'
+FORMAT = 1
+
+# magic, format, version, records, offsets at, index at, index length
+_HEADER = struct.Struct('<4sHxxqIxxxxQQQ')
+_LENGTH = struct.Struct('<I')
+_EMPTY = ()
+
+
+def write(path, version, records):
+    """Write a bundle atomically (temp file + rename).
+
+    `records` are (subjectId, difficulty, JSON bytes) tuples in any order.
+    """
+    offsets = array('I')
+    if offsets.itemsize != 4 or struct.pack('=I', 1) != struct.pack('<I', 1):
+        # The offsets array is read back in native order (memoryview.cast)
+        raise RuntimeError('Bundles need a little-endian host with 4-byte unsigned ints')
+    records = sorted(records, key=lambda r: (r[0], r[1]))
+    index = {}
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(bytes(_HEADER.size))
+        for subject_id, difficulty, data in records:
+            position = f.tell()
+            if position + _LENGTH.size + len(data) >= 2 ** 32:
+                raise ValueError('Question bank too large for a bundle (4 GiB)')
+            runs = index.setdefault(subject_id, {})
+            runs.setdefault(difficulty, [len(offsets), 0])[1] += 1
+            offsets.append(position)
+            f.write(_LENGTH.pack(len(data)))
+            f.write(data)
+        f.write(bytes(-f.tell() % 8))
+        offsets_at = f.tell()
+        f.write(offsets.tobytes())
+        index_at = f.tell()
+        index_json = json.dumps(index, separators=(',', ':')).encode('utf-8')
+        f.write(index_json)
+        f.seek(0)
+        f.write(_HEADER.pack(MAGIC, FORMAT, version, len(offsets), offsets_at, index_at, len(index_json)))
+    os.replace(tmp, path)
+
+
+class Records(Sequence):
+    """A run of consecutive bundle records, decoded on access."""
+
+    __slots__ = ('_bundle', '_start', '_stop')
+
+    def __init__(self, bundle, start, stop):
+        self._bundle, self._start, self._stop = bundle, start, stop
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('record index out of range')
+        return self._bundle.record(self._start + i)
+
+
+class Bundle:
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < _HEADER.size:
+            raise ValueError(f'{path} is not a quiz bundle')
+        magic, fmt, self.version, count, offsets_at, index_at, index_len = _HEADER.unpack_from(self._map)
+        if magic != MAGIC or fmt != FORMAT:
+            raise ValueError(f'{path} is not a format {FORMAT} quiz bundle')
+        self.path = path
+        self._offsets = memoryview(self._map)[offsets_at:offsets_at + 4 * count].cast('I')
+        self.subjects = json.loads(self._map[index_at:index_at + index_len])
+        self.records = Records(self, 0, count)
+
+    def __len__(self):
+        return len(self.records)
+
+    def record(self, n):
+        position = self._offsets[n]
+        (length,) = _LENGTH.unpack_from(self._map, position)
+        start = position + _LENGTH.size
+        return json.loads(self._map[start:start + length])
+
+    def select(self, subject_id=None, difficulty=None):
+        """The records of a subject (all when None), optionally of one difficulty."""
+        if subject_id is None:
+            return self.records
+        runs = self.subjects.get(subject_id)
+        if not runs:
+            return _EMPTY
+        if difficulty is not None:
+            run = runs.get(difficulty)
+            return Records(self, run[0], run[0] + run[1]) if run else _EMPTY
+        start = min(first for first, _ in runs.values())
+        return Records(self, start, start + sum(n for _, n in runs.values()))
+
+    def stats(self):
+        return {'version': self.version, 'path': self.path, 'questions': len(self), 'subjects': len(self.subjects)}
+
+
+def peek_version(path):
+    """The bank version in a bundle's header; None if it is missing or not a bundle."""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(_HEADER.size)
+    except OSError:
+        return None
+    if len(header) < _HEADER.size:
+        return None
+    magic, fmt, version = _HEADER.unpack(header)[:3]
+    return version if magic == MAGIC and fmt == FORMAT else None
+
+
+def open_bundle(path):
+    """Map a bundle; None if it is missing or not a bundle."""
+    try:
+        return Bundle(path)
+    except (OSError, ValueError):
+        return None
@@ -1,12 +1,49 @@
 import os
+import io
+import math
+import csv
+import gzip
 import json
-import boto3
+import time
+import uuid
+import base64
+import hmac
+import hashlib
+import heapq
+import itertools
+import queue
 import random
+import logging
 import datetime
+import threading
+import collections
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
 from urllib.parse import parse_qs
 
+import adaptive
+import bundle
+import search
+import storage
+import storage_dynamodb
+
+_INIT_STARTED = time.perf_counter()
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+# boto3 is imported and the DynamoDB client built on first use, not at import:
+# the low-level client loads far less than boto3.resource() and keeps cold
+# starts short. See bench/startup.py.
+DDB_MAX_POOL_CONNECTIONS = int(os.environ.get('DDB_MAX_POOL_CONNECTIONS', '32'))
+DDB_MAX_ATTEMPTS = int(os.environ.get('DDB_MAX_ATTEMPTS', '5'))
+DDB_CONNECT_TIMEOUT = float(os.environ.get('DDB_CONNECT_TIMEOUT', '1'))
+DDB_READ_TIMEOUT = float(os.environ.get('DDB_READ_TIMEOUT', '3'))
+
+_clients = {}
 
-dynamodb = boto3.resource('dynamodb')
 QUESTIONS_TABLE = (
     os.environ.get('STORAGE_QUIZQUESTIONS_NAME')
     or os.environ.get('QUESTIONS_TABLE')
@@ -17,8 +54,255 @@ SUBJECTS_TABLE = (
     or os.environ.get('SUBJECTS_TABLE')
     or 'QuizSubjects'
 )
-questions_table = dynamodb.Table(QUESTIONS_TABLE)
-subjects_table = dynamodb.Table(SUBJECTS_TABLE)
+CONTENT_HASH_TABLE = (
+    os.environ.get('STORAGE_QUIZCONTENTHASHES_NAME')
+    or os.environ.get('CONTENT_HASH_TABLE')
+    or 'QuizContentHashes'
+)
+# Data store: 'dynamodb', or 'sqlite:<path>' to run without AWS (see storage.py)
+QUIZ_STORAGE = os.environ.get('QUIZ_STORAGE', 'dynamodb')
+
+
+def _aws_client(service):
+    client = _clients.get(service)
+    if client is None:
+        import boto3
+        from botocore.config import Config
+        client = boto3.client(service, config=Config(
+            tcp_keepalive=True,
+            max_pool_connections=DDB_MAX_POOL_CONNECTIONS,
+            connect_timeout=DDB_CONNECT_TIMEOUT,
+            read_timeout=DDB_READ_TIMEOUT,
+            retries={'mode': 'adaptive', 'max_attempts': DDB_MAX_ATTEMPTS},
+        ))
+        _clients[service] = client
+    return client
+
+
+def _dynamodb_client():
+    return _aws_client('dynamodb')
+
+
+# Request metrics. A sampled share of requests (always a container's first
+# routed one) times every DynamoDB call, asks for its consumed capacity, and
+# splits the handler's time from serialisation; lambda_handler then prints
+# one CloudWatch Embedded Metric Format line for the request. Unsampled
+# requests cost a random() call, and emit a line only if they fail.
+METRICS_SAMPLE_RATE = float(os.environ.get('QUIZ_METRICS_SAMPLE_RATE', '0.05'))
+METRICS_NAMESPACE = os.environ.get('QUIZ_METRICS_NAMESPACE', 'CyberMcq/QuizApi')
+
+_READ_OPERATIONS = frozenset(('get_item', 'query', 'scan', 'batch_get_item'))
+# 'cold' stays set until a routed request has been measured; 'initMs' is the
+# time from import to the container's first invocation
+_request_metrics = {'current': None, 'cold': True, 'initMs': None}
+_request_metrics_lock = threading.Lock()  # export and bulk workers share the request's record
+
+
+def _ddb_call(operation, **kwargs):
+    """Call the DynamoDB client; for sampled requests, record time and capacity."""
+    client = _dynamodb_client()
+    metrics = _request_metrics['current']
+    if metrics is None:
+        return getattr(client, operation)(**kwargs)
+    kwargs['ReturnConsumedCapacity'] = 'TOTAL'
+    res = {}
+    t0 = time.perf_counter()
+    try:
+        res = getattr(client, operation)(**kwargs)
+        return res
+    finally:
+        elapsed = (time.perf_counter() - t0) * 1000
+        consumed = res.get('ConsumedCapacity') or ()
+        units = sum(float(c.get('CapacityUnits', 0)) for c in ([consumed] if isinstance(consumed, dict) else consumed))
+        with _request_metrics_lock:
+            metrics['DynamoDBTime'] += elapsed
+            metrics['DynamoDBCalls'] += 1
+            metrics['ReadUnits' if operation in _READ_OPERATIONS else 'WriteUnits'] += units
+            calls, ms, op_units = metrics['operations'].get(operation, (0, 0.0, 0.0))
+            metrics['operations'][operation] = (calls + 1, ms + elapsed, op_units + units)
+
+
+# Items whose subjectId starts with this prefix are bookkeeping records kept in
+# the subjects table (e.g. the question bank version marker), not subjects.
+META_PREFIX = '__meta__#'
+QUESTIONS_VERSION_KEY = {'subjectId': META_PREFIX + 'questions-version'}
+
+# Warm-container question pool for GET /quiz
+QUIZ_PROJECTION = ('questionId', 'question', 'options', 'answerIndex', 'difficulty')
+QUIZ_POOL_TTL_SECONDS = float(os.environ.get('QUIZ_POOL_TTL_SECONDS', '300'))
+QUIZ_POOL_MAX_ITEMS = int(os.environ.get('QUIZ_POOL_MAX_ITEMS', '20000'))
+QUIZ_VERSION_CHECK_SECONDS = float(os.environ.get('QUIZ_VERSION_CHECK_SECONDS', '5'))
+# Subjects larger than this are not pooled; /quiz samples them via the random-key indexes
+QUIZ_POOL_MAX_SUBJECT_ITEMS = int(os.environ.get('QUIZ_POOL_MAX_SUBJECT_ITEMS', '2000'))
+
+# Random-key sampling. Every question carries an integer `randomKey` in
+# [0, 2**52) and a `randomShard` in [0, QUIZ_RANDOM_SHARDS). GSIs:
+#   SubjectRandomIndex:     subjectId (hash), randomKey (range)
+#   RandomIndex:            randomShard (hash), randomKey (range)
+#   SubjectDifficultyIndex: subjectDifficulty (hash), randomKey (range)
+RANDOM_KEY_BITS = storage.RANDOM_KEY_BITS
+QUIZ_RANDOM_SHARDS = int(os.environ.get('QUIZ_RANDOM_SHARDS', '8'))
+QUIZ_SAMPLE_PIVOTS = int(os.environ.get('QUIZ_SAMPLE_PIVOTS', '4'))
+QUIZ_SAMPLE_MAX_ROUNDS = int(os.environ.get('QUIZ_SAMPLE_MAX_ROUNDS', '3'))
+
+# Multi-subject quizzes (?subjectId=a,b&weights=2,1&difficulty=EASY,MEDIUM).
+# Each subject/difficulty pair is pooled or sampled on its own; the pairs
+# are fetched on up to QUIZ_FETCH_CONCURRENCY threads.
+QUIZ_MAX_SUBJECTS = int(os.environ.get('QUIZ_MAX_SUBJECTS', '20'))
+QUIZ_FETCH_CONCURRENCY = int(os.environ.get('QUIZ_FETCH_CONCURRENCY', '8'))
+
+# Precompiled question bank (bundle.py, built by `maintenance.py build-bundle`).
+# The first of these files whose version matches the version marker serves
+# /quiz from a memory map, without reading the questions table.
+QUIZ_BUNDLE_PATHS = os.environ.get('QUIZ_BUNDLE_PATHS', os.pathsep.join([
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'quiz-bundle.qzb'),
+    '/tmp/quiz-bundle.qzb',
+])).split(os.pathsep)
+
+# DynamoDB batch API limits and retry budget for unprocessed items
+BATCH_WRITE_MAX = 25
+BATCH_GET_MAX = 100
+BATCH_MAX_ATTEMPTS = int(os.environ.get('BATCH_MAX_ATTEMPTS', '6'))
+
+# Bulk delete / move and cascading subject delete. Batch reads, BatchWriteItem
+# chunks and per-question updates run on up to BULK_CONCURRENCY threads.
+BULK_CONCURRENCY = int(os.environ.get('BULK_CONCURRENCY', '16'))
+BULK_MAX_ITEMS = int(os.environ.get('BULK_MAX_ITEMS', '10000'))
+BULK_DELETE_FIELDS = ('questionId', 'subjectId', 'difficulty', 'contentHash')
+
+# Duplicate detection. Every question carries `contentHash`, a digest of its
+# normalised text, sorted options and subjectId. The hashes table holds one
+# {contentHash, questionId} marker per hash: single creates, updates and
+# moves claim it in the same transaction as the question, so the hash stays
+# unique; bulk writes check markers with consistent BatchGetItem reads.
+CONTENT_HASH_ATTR = 'contentHash'
+
+DIFFICULTIES = ('EASY', 'MEDIUM', 'HARD')
+
+# Materialised counters on subject items: questionCount plus one
+# questionCount_<DIFFICULTY> attribute per difficulty (UNSPECIFIED when a
+# question has none). Top-level attributes so they can be ADDed in a
+# transaction; API responses fold them into a difficultyCounts map.
+COUNT_ATTR = 'questionCount'
+COUNT_ATTR_PREFIX = 'questionCount_'
+NO_DIFFICULTY = storage.NO_DIFFICULTY
+
+# Streaming CSV import (cyber_questions.csv / question-template.csv layout)
+CSV_IMPORT_COLUMNS = ['question', 'option1', 'option2', 'option3', 'option4', 'answer_index', 'subject', 'difficulty']
+CSV_IMPORT_BUCKET = os.environ.get('QUIZ_IMPORT_BUCKET')
+CSV_IMPORT_CHUNK_ROWS = int(os.environ.get('CSV_IMPORT_CHUNK_ROWS', '500'))
+CSV_IMPORT_READ_BYTES = 64 * 1024
+CSV_IMPORT_MAX_ERROR_DETAILS = 100
+# Stop starting new chunks once the invocation has less time than this left
+CSV_IMPORT_TIME_MARGIN_MS = int(os.environ.get('CSV_IMPORT_TIME_MARGIN_MS', '5000'))
+# A finished job deletes its checkpoint. Running ones carry expiresAt (epoch
+# seconds) so DynamoDB TTL on QuizSubjects removes abandoned jobs
+CSV_IMPORT_TTL_SECONDS = int(os.environ.get('CSV_IMPORT_TTL_SECONDS', str(7 * 86400)))
+CSV_IMPORT_TTL_ATTR = 'expiresAt'
+
+# Full export (parallel scan). Without QUIZ_EXPORT_BUCKET the export is
+# returned inline and must fit in a Lambda response.
+EXPORT_BUCKET = os.environ.get('QUIZ_EXPORT_BUCKET')
+EXPORT_SEGMENTS = int(os.environ.get('EXPORT_SEGMENTS', '8'))
+EXPORT_MAX_SEGMENTS = 64
+EXPORT_PART_BYTES = 8 * 1024 * 1024
+EXPORT_INLINE_MAX_BYTES = 5 * 1024 * 1024
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+# Admin question search (search.py). The index is built from a parallel scan,
+# kept in warm containers and updated in place by this container's writes.
+# Other writers' version bumps make it rebuild. A snapshot in
+# SEARCH_SNAPSHOT_PATH lets a restarted runtime reload it instead.
+SEARCH_SNAPSHOT_PATH = os.environ.get('SEARCH_SNAPSHOT_PATH', '/tmp/quiz-search-index.snap')
+SEARCH_SNAPSHOT_INTERVAL_SECONDS = float(os.environ.get('SEARCH_SNAPSHOT_INTERVAL_SECONDS', '60'))
+SEARCH_PROJECTION = ('questionId', 'subjectId', 'updatedAt') + search.TEXT_FIELDS
+
+
+# subject key ('*' for the whole bank) -> {'items', 'version', 'loadedAt'}, LRU ordered.
+# 'items' is None for subjects too large to pool.
+_quiz_pool = collections.OrderedDict()
+_quiz_pool_lock = threading.Lock()
+# 'bundle' is the mapped bundle for version 'checked', or None if no file had
+# it when last looked at ('checkedAt')
+_quiz_bundle = {'bundle': None, 'checked': None, 'checkedAt': 0.0}
+_quiz_pool_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0, 'bundleHits': 0}
+# Every subject's counters ({subjectId: {difficulty: count}}, None for a
+# subject without counters) as of 'version', for whole-bank quizzes by difficulty
+_quiz_subject_counts = {'counts': None, 'version': None, 'loadedAt': 0.0}
+_questions_version = {'value': None, 'checkedAt': 0.0}
+
+# 'pending' holds this container's question writes ('put', item) / ('delete', id)
+# until the version bump that lets them be applied to 'index'.
+_search = {'index': None, 'pending': [], 'source': None, 'dirty': False, 'savedAt': 0.0}
+
+# userId -> {'history': adaptive.History, 'loadedAt'}, LRU ordered
+_adaptive_users = collections.OrderedDict()
+_adaptive_lock = threading.Lock()
+
+
+# Server-side grading. /quiz hands out a signed token holding each question's
+# option permutation; POST /quiz/grade verifies it and grades in one
+# BatchGetItem. Progress is written to the Amplify Data tables when their
+# names are configured and the caller is signed in.
+QUIZ_TOKEN_SECRET = os.environ.get('QUIZ_TOKEN_SECRET', '')
+QUIZ_TOKEN_TTL_SECONDS = int(os.environ.get('QUIZ_TOKEN_TTL_SECONDS', '7200'))
+QUIZ_HIDE_ANSWERS = os.environ.get('QUIZ_HIDE_ANSWERS') == '1'
+USER_PROGRESS_TABLE = os.environ.get('USERPROGRESS_TABLE')
+QUIZ_SESSION_TABLE = os.environ.get('QUIZSESSION_TABLE')
+
+# Adaptive quizzes (GET /quiz?adaptive=1, adaptive.py) for signed-in users.
+# Answer histories are read from UserProgress through its byUserId GSI, kept
+# for ADAPTIVE_HISTORY_TTL_SECONDS in warm containers and updated in place
+# by this container's grading. The weights are explained in adaptive.py.
+ADAPTIVE_MAX_USERS = int(os.environ.get('ADAPTIVE_MAX_USERS', '1000'))
+ADAPTIVE_HISTORY_TTL_SECONDS = float(os.environ.get('ADAPTIVE_HISTORY_TTL_SECONDS', '900'))
+ADAPTIVE_HISTORY_MAX_RECORDS = int(os.environ.get('ADAPTIVE_HISTORY_MAX_RECORDS', '20000'))
+ADAPTIVE_WEIGHTING = {
+    'seen_weight': float(os.environ.get('ADAPTIVE_SEEN_WEIGHT', adaptive.SEEN_WEIGHT)),
+    'miss_weight': float(os.environ.get('ADAPTIVE_MISS_WEIGHT', adaptive.MISS_WEIGHT)),
+    'new_weight': float(os.environ.get('ADAPTIVE_NEW_WEIGHT', adaptive.NEW_WEIGHT)),
+    'recency': float(os.environ.get('ADAPTIVE_RECENCY_SECONDS', adaptive.RECENCY_SECONDS)),
+}
+# Without NumPy, ranking looks at a random subset of this many answers per subject
+ADAPTIVE_MAX_CANDIDATES = int(os.environ.get('ADAPTIVE_MAX_CANDIDATES', adaptive.MAX_CANDIDATES))
+ADAPTIVE_PROGRESS_FIELDS = ['questionId', 'subjectId', 'difficulty', 'isCorrect', 'timestamp']
+
+
+def _make_storage(spec):
+    """'dynamodb' (default) or 'sqlite:<path>' (':memory:' for a throwaway one)."""
+    if spec.startswith('sqlite:'):
+        return storage.SqliteStorage(spec[len('sqlite:'):])
+    if spec != 'dynamodb':
+        raise ValueError(f'Unknown QUIZ_STORAGE: {spec}')
+    return storage_dynamodb.DynamoStorage(
+        {
+            'questions': QUESTIONS_TABLE,
+            'subjects': SUBJECTS_TABLE,
+            'progress': USER_PROGRESS_TABLE,
+            'sessions': QUIZ_SESSION_TABLE,
+            'hashes': CONTENT_HASH_TABLE,
+        },
+        _ddb_call,
+        _dynamodb_client,
+        batch_get_max=BATCH_GET_MAX,
+        batch_write_max=BATCH_WRITE_MAX,
+        batch_max_attempts=BATCH_MAX_ATTEMPTS,
+        random_shards=QUIZ_RANDOM_SHARDS,
+        sample_pivots=QUIZ_SAMPLE_PIVOTS,
+        sample_max_rounds=QUIZ_SAMPLE_MAX_ROUNDS,
+    )
+
+
+store = _make_storage(QUIZ_STORAGE)
+
+# Option orders for 4 options, indexed so a permutation fits in one number
+PERMUTATIONS = list(itertools.permutations(range(4)))
+PERMUTATION_CODES = {p: i for i, p in enumerate(PERMUTATIONS)}
+
+# Responses at least this large are gzipped for clients that accept it. The
+# REST API needs binary media types ('*/*') enabled for base64 bodies.
+RESPONSE_GZIP = os.environ.get('RESPONSE_GZIP', '1') == '1'
+RESPONSE_GZIP_MIN_BYTES = int(os.environ.get('RESPONSE_GZIP_MIN_BYTES', '1024'))
 
 
 ALLOWED_ORIGINS = set([
@@ -38,11 +322,74 @@ def _cors_headers(event):
     }
 
 
-def _response(event, status, body=None, content_type='application/json'):
+def _json_default(value):
+    # DynamoDB numbers may arrive as Decimal and sets as Python sets
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(value).decode('ascii')
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+_json_encoder = json.JSONEncoder(default=_json_default, ensure_ascii=False, separators=(',', ':'))
+
+
+def _header(event, name):
+    name = name.lower()
+    for k, v in (event.get('headers') or {}).items():
+        if k.lower() == name:
+            return v
+    return None
+
+
+def _accepts_gzip(event):
+    for part in (_header(event, 'Accept-Encoding') or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        if coding.strip().lower() in ('gzip', '*'):
+            return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+
+def _response(event, status, body=None, content_type='application/json', etag=False):
+    """Build an API Gateway proxy response.
+
+    With etag=True a weak ETag of the JSON body is attached and a matching
+    If-None-Match short-circuits to 304. Large bodies are gzipped when the
+    client accepts it.
+    """
+    metrics = _request_metrics['current']
+    t0 = time.perf_counter()
+    payload = _json_encoder.encode(body or {}).encode('utf-8')
+    res = _raw_response(event, status, payload, content_type, etag)
+    if metrics is not None:
+        metrics['SerializeTime'] += (time.perf_counter() - t0) * 1000
+    return res
+
+
+def _raw_response(event, status, payload, content_type, etag=False):
+    headers = {**_cors_headers(event), 'Content-Type': content_type}
+    if etag:
+        tag = 'W/"' + hashlib.blake2b(payload, digest_size=16).hexdigest() + '"'
+        headers['ETag'] = tag
+        if_none_match = _header(event, 'If-None-Match')
+        if if_none_match and (if_none_match.strip() == '*' or tag in [t.strip() for t in if_none_match.split(',')]):
+            return {'statusCode': 304, 'headers': headers, 'body': ''}
+    if RESPONSE_GZIP:
+        headers['Vary'] = 'Accept-Encoding'
+        if len(payload) >= RESPONSE_GZIP_MIN_BYTES and _accepts_gzip(event):
+            headers['Content-Encoding'] = 'gzip'
+            return {
+                'statusCode': status,
+                'headers': headers,
+                'body': base64.b64encode(gzip.compress(payload, compresslevel=5)).decode('ascii'),
+                'isBase64Encoded': True,
+            }
     return {
         'statusCode': status,
-        'headers': {**_cors_headers(event), 'Content-Type': content_type},
-        'body': json.dumps(body or {}),
+        'headers': headers,
+        'body': payload.decode('utf-8'),
     }
 
 
@@ -50,14 +397,18 @@ def _now_iso():
     return datetime.datetime.utcnow().replace(microsecond=0).isoformat() + 'Z'
 
 
-def _require_admin(event):
+def _claims(event):
     # Amplify user pool authorizer injects claims in requestContext authorizer
-    claims = (
+    return (
         (event.get('requestContext') or {})
         .get('authorizer', {})
         .get('jwt', {})
         .get('claims', {})
     )
+
+
+def _require_admin(event):
+    claims = _claims(event)
     groups = []
     if 'cognito:groups' in claims:
         raw = claims['cognito:groups']
@@ -68,408 +419,2175 @@ def _require_admin(event):
     return 'Admin' in groups
 
 
-def lambda_handler(event, context):
-    method = event.get('httpMethod', 'GET')
-    path = event.get('path', '/')
+def _b64url(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
 
-    if method == 'OPTIONS':
-        return {'statusCode': 200, 'headers': _cors_headers(event), 'body': ''}
 
-    qs = event.get('queryStringParameters') or {}
-    body = event.get('body') or ''
-    if event.get('isBase64Encoded') and body:
-        import base64
-        body = base64.b64decode(body).decode('utf-8')
+def _b64url_decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
 
-    # Subjects
-    if method == 'GET' and path.endswith('/subjects'):
-        limit = int(qs.get('limit', '50'))
-        eks = qs.get('nextToken')
-        scan_kwargs = {'Limit': min(limit, 100)}
-        if eks:
-            scan_kwargs['ExclusiveStartKey'] = json.loads(eks)
-        res = subjects_table.scan(**scan_kwargs)
-        return _response(event, 200, {
-            'items': res.get('Items', []),
-            'nextToken': json.dumps(res['LastEvaluatedKey']) if 'LastEvaluatedKey' in res else None,
-        })
 
-    if path.endswith('/subjects') and method == 'POST':
-        if not _require_admin(event):
-            return _response(event, 404, {'error': 'Not found'})
-        try:
-            payload = json.loads(body or '{}')
-            for f in ['subjectName']:
-                if f not in payload or not str(payload[f]).strip():
-                    return _response(event, 400, {'error': f'Missing field: {f}'})
-            subject_name = str(payload['subjectName']).strip()
-            # Enforce unique subjectName via GSI
-            existing = subjects_table.query(
-                IndexName='SubjectNameIndex',
-                KeyConditionExpression=boto3.dynamodb.conditions.Key('subjectName').eq(subject_name),
-                Limit=1,
+def _sign_quiz_token(questions):
+    """Sign [(questionId, permutation code)] into a compact quiz token."""
+    payload = _b64url(json.dumps({'t': int(time.time()), 'q': questions}, separators=(',', ':')).encode('utf-8'))
+    sig = hmac.new(QUIZ_TOKEN_SECRET.encode('utf-8'), payload.encode('ascii'), hashlib.sha256).digest()[:16]
+    return f'{payload}.{_b64url(sig)}'
+
+
+def _verify_quiz_token(token):
+    """Return the token's payload, or raise ValueError if it is forged or expired."""
+    try:
+        payload, sig = str(token).split('.')
+        expected = hmac.new(QUIZ_TOKEN_SECRET.encode('utf-8'), payload.encode('ascii'), hashlib.sha256).digest()[:16]
+        valid = hmac.compare_digest(expected, _b64url_decode(sig))
+        data = json.loads(_b64url_decode(payload)) if valid else None
+    except (ValueError, UnicodeError):
+        raise ValueError('Invalid quiz token')
+    if data is None:
+        raise ValueError('Invalid quiz token')
+    if time.time() - data['t'] > QUIZ_TOKEN_TTL_SECONDS:
+        raise ValueError('Quiz token expired')
+    return data
+
+
+def _is_meta_subject(item):
+    return str(item.get('subjectId', '')).startswith(META_PREFIX)
+
+
+def _current_questions_version():
+    # The marker is re-read at most every QUIZ_VERSION_CHECK_SECONDS so a warm
+    # container pays one small get_item per window, not per request.
+    now = time.monotonic()
+    if _questions_version['value'] is None or now - _questions_version['checkedAt'] >= QUIZ_VERSION_CHECK_SECONDS:
+        item = store.get('subjects', QUESTIONS_VERSION_KEY, fields=['version']) or {}
+        _questions_version['value'] = int(item.get('version', 0))
+        _questions_version['checkedAt'] = now
+    return _questions_version['value']
+
+
+def _bump_questions_version():
+    # Called after every question write so warm containers drop stale pools.
+    # A failed bump must not fail the write itself; the pool TTL still applies.
+    version = None
+    try:
+        marker = store.update(
+            'subjects', QUESTIONS_VERSION_KEY, changes={'updatedAt': _now_iso()}, add={'version': 1}, must_exist=False,
+        )
+        version = _questions_version['value'] = int(marker['version'])
+        _questions_version['checkedAt'] = time.monotonic()
+    except Exception:
+        logger.exception('Failed to bump questions version marker')
+        _questions_version['value'] = None
+    with _quiz_pool_lock:
+        _quiz_pool_stats['invalidations'] += len(_quiz_pool)
+        _quiz_pool.clear()
+    _search_apply_pending(version)
+
+
+def _search_note(puts=(), deletes=()):
+    """Queue question writes for the search index until the next version bump."""
+    if _search['index'] is None:
+        return
+    _search['pending'].extend(('put', {k: it[k] for k in SEARCH_PROJECTION if k in it}) for it in puts)
+    _search['pending'].extend(('delete', qid) for qid in deletes)
+
+
+def _search_apply_pending(version):
+    # Applying in place is only safe when this bump is the only change since
+    # the index was current; otherwise leave it stale so the next search rebuilds.
+    pending, _search['pending'] = _search['pending'], []
+    index = _search['index']
+    if index is None:
+        return
+    if version is None or index.version != version - 1:
+        index.version = None
+        return
+    for op, arg in pending:
+        if op == 'put':
+            index.add(arg)
+        else:
+            index.remove(arg)
+    index.version = version
+    _search['dirty'] = True
+
+
+def _search_index():
+    """The search index for the current version: in memory, from the snapshot, or rebuilt."""
+    version = _current_questions_version()
+    index = _search['index']
+    if index is not None and index.version == version:
+        return index
+    index = search.SearchIndex.load(SEARCH_SNAPSHOT_PATH) if index is None else None
+    if index is not None and index.version == version:
+        _search['source'], _search['dirty'] = 'snapshot', False
+    else:
+        # Slots follow write order, which is what in-place updates produce too
+        items = [item for page in _scan_pages(EXPORT_SEGMENTS, SEARCH_PROJECTION) for item in page]
+        items.sort(key=lambda it: (it.get('updatedAt', ''), it['questionId']))
+        index = search.SearchIndex(version)
+        for item in items:
+            index.add(item)
+        _search['source'], _search['dirty'], _search['savedAt'] = 'scan', True, 0.0
+    _search['index'] = index
+    _search['pending'] = []
+    return index
+
+
+def _save_search_snapshot():
+    if not _search['dirty'] or time.monotonic() - _search['savedAt'] < SEARCH_SNAPSHOT_INTERVAL_SECONDS:
+        return
+    try:
+        _search['index'].save(SEARCH_SNAPSHOT_PATH)
+    except OSError:
+        logger.exception('Failed to save search index snapshot')
+    _search['dirty'], _search['savedAt'] = False, time.monotonic()
+
+
+def _content_hash(question, options, subject_id):
+    """Digest of what makes two questions the same, ignoring case, spacing and option order."""
+    def norm(text):
+        return ' '.join(unicodedata.normalize('NFKC', str(text)).casefold().split())
+    parts = [str(subject_id), norm(question)] + sorted(norm(o) for o in options)
+    return hashlib.blake2b('\x1f'.join(parts).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _find_duplicates(hashes):
+    """{contentHash: questionId} for the hashes already claimed, read with consistent BatchGetItem calls."""
+    keys = [{CONTENT_HASH_ATTR: h} for h in hashes]
+    pages = _fan_out(
+        lambda chunk: store.batch_get('hashes', chunk, [CONTENT_HASH_ATTR, 'questionId'], consistent=True),
+        _chunked(keys, BATCH_GET_MAX),
+    )
+    return {it[CONTENT_HASH_ATTR]: it['questionId'] for page in pages for it in page}
+
+
+def _put_hash_markers(items):
+    """Markers for freshly batch-written questions.
+
+    Writes that fail are only logged; `maintenance.py backfill-content-hashes`
+    puts the missing markers back.
+    """
+    markers = [{CONTENT_HASH_ATTR: it[CONTENT_HASH_ATTR], 'questionId': it['questionId']} for it in items]
+    try:
+        unprocessed = store.batch_write('hashes', puts=markers) if markers else []
+    except Exception:
+        logger.exception('Failed to write %d content hash markers', len(markers))
+        return
+    if unprocessed:
+        logger.warning('%d content hash markers were not written', len(unprocessed))
+
+
+def _drop_hash_markers(items):
+    """Delete the markers still held by these deleted questions."""
+    ids = {it['questionId'] for it in items}
+    owners = _find_duplicates({it[CONTENT_HASH_ATTR] for it in items if it.get(CONTENT_HASH_ATTR)})
+    keys = [{CONTENT_HASH_ATTR: h} for h, qid in owners.items() if qid in ids]
+    try:
+        unprocessed = store.batch_write('hashes', deletes=keys) if keys else []
+    except Exception:
+        logger.exception('Failed to delete %d content hash markers', len(keys))
+        return
+    if unprocessed:
+        logger.warning('%d content hash markers were not deleted', len(unprocessed))
+
+
+def _hash_owner(content_hash):
+    marker = store.get('hashes', {CONTENT_HASH_ATTR: content_hash}, consistent=True) if content_hash else None
+    return marker['questionId'] if marker else None
+
+
+def _hash_claim(content_hash, qid):
+    """Transaction action giving content_hash to qid; fails while another question holds it."""
+    return {
+        'op': 'put', 'table': 'hashes', 'item': {CONTENT_HASH_ATTR: content_hash, 'questionId': qid},
+        'expect': {'questionId': (qid, None)},
+    }
+
+
+def _hash_release(content_hash, qid):
+    """Transaction action dropping qid's marker for content_hash."""
+    return {'op': 'delete', 'table': 'hashes', 'key': {CONTENT_HASH_ATTR: content_hash}, 'expect': {'questionId': qid}}
+
+
+def _random_key_fields():
+    return {
+        'randomKey': random.getrandbits(RANDOM_KEY_BITS),
+        'randomShard': random.randrange(QUIZ_RANDOM_SHARDS),
+    }
+
+
+def _load_quiz_items(subject_id, limit):
+    """Read up to `limit` items for a subject; returns None if there are more."""
+    items, cursor = [], None
+    while True:
+        if subject_id:
+            page, cursor = store.query(
+                'questions', 'SubjectIndex', subject_id, limit + 1 - len(items), cursor, QUIZ_PROJECTION,
             )
-            if existing.get('Items'):
-                return _response(event, 409, {'error': 'Subject name already exists'})
-
-            subject_id = payload.get('subjectId') or _gen_id()
-            now = _now_iso()
-            item = {
-                'subjectId': subject_id,
-                'subjectName': subject_name,
-                'description': str(payload.get('description') or ''),
-                'createdAt': now,
-                'updatedAt': now,
-            }
-            subjects_table.put_item(Item=item, ConditionExpression='attribute_not_exists(subjectId)')
-            return _response(event, 201, item)
+        else:
+            page, cursor = store.scan('questions', limit + 1 - len(items), cursor, QUIZ_PROJECTION)
+        items.extend(page)
+        if len(items) > limit:
+            return None
+        if cursor is None:
+            return items
+
+
+def _question_count(subject_id, by_difficulty=False):
+    """Questions in a subject (or the whole bank) from the subject counters.
+
+    Returns None when a subject has no counters yet. With by_difficulty,
+    returns (count, {difficulty: count}) for a subject.
+    """
+    if subject_id:
+        fields = [COUNT_ATTR]
+        if by_difficulty:
+            fields += [COUNT_ATTR_PREFIX + d for d in DIFFICULTIES + (NO_DIFFICULTY,)]
+        item = store.get('subjects', {'subjectId': subject_id}, fields=fields) or {}
+        if by_difficulty:
+            counts = {k[len(COUNT_ATTR_PREFIX):]: v for k, v in item.items() if k.startswith(COUNT_ATTR_PREFIX)}
+            return item.get(COUNT_ATTR), counts if COUNT_ATTR in item else None
+        return item.get(COUNT_ATTR)
+    total, cursor = 0, None
+    while True:
+        page, cursor = store.scan('subjects', cursor=cursor, fields=['subjectId', COUNT_ATTR])
+        for item in page:
+            if _is_meta_subject(item):
+                continue
+            if COUNT_ATTR not in item:
+                return None
+            total += item[COUNT_ATTR]
+        if cursor is None:
+            return total
+
+
+def _subject_counts(version):
+    """{subjectId: {difficulty: count} or None} for every subject, cached for a questions version."""
+    with _quiz_pool_lock:
+        cached = dict(_quiz_subject_counts)
+    if cached['version'] == version and time.monotonic() - cached['loadedAt'] < QUIZ_POOL_TTL_SECONDS:
+        return cached['counts']
+    fields = ['subjectId', COUNT_ATTR] + [COUNT_ATTR_PREFIX + d for d in DIFFICULTIES + (NO_DIFFICULTY,)]
+    counts, cursor = {}, None
+    while True:
+        page, cursor = store.scan('subjects', cursor=cursor, fields=fields)
+        for item in page:
+            if _is_meta_subject(item):
+                continue
+            counts[item['subjectId']] = {
+                k[len(COUNT_ATTR_PREFIX):]: v for k, v in item.items() if k.startswith(COUNT_ATTR_PREFIX)
+            } if COUNT_ATTR in item else None
+        if cursor is None:
+            break
+    with _quiz_pool_lock:
+        _quiz_subject_counts.update(counts=counts, version=version, loadedAt=time.monotonic())
+    return counts
+
+
+def _current_quiz_bundle(version):
+    """The bundle built for `version`, or None.
+
+    Without one, the files' headers are looked at again at most every
+    QUIZ_VERSION_CHECK_SECONDS, so a bundle copied to /tmp is picked up.
+    """
+    with _quiz_pool_lock:
+        current = _quiz_bundle['bundle']
+        if current is not None and current.version == version:
+            return current
+        now = time.monotonic()
+        if _quiz_bundle['checked'] == version and now - _quiz_bundle['checkedAt'] < QUIZ_VERSION_CHECK_SECONDS:
+            return None
+        _quiz_bundle.update(bundle=None, checked=version, checkedAt=now)
+        for path in QUIZ_BUNDLE_PATHS:
+            if path and bundle.peek_version(path) == version:
+                _quiz_bundle['bundle'] = bundle.open_bundle(path)
+                if _quiz_bundle['bundle'] is not None:
+                    break
+        return _quiz_bundle['bundle']
+
+
+def _bundle_entry(current, subject_id):
+    """A pool entry over the bundle's records for a subject (or all of them)."""
+    items = current.select(subject_id)
+    runs = current.subjects.get(subject_id, {}) if subject_id else {}
+    return {
+        'items': items,
+        'count': len(items),
+        'counts': {d: n for d, (_, n) in runs.items()},
+        'byDifficulty': {d: current.select(subject_id, d) for d in runs},
+    }
+
+
+def _quiz_pool_items(subject_id):
+    """Return (entry, hit) for a subject, loading and caching on a miss.
+
+    entry['items'] is None when the subject is too large to pool;
+    entry['count'] and entry['counts'] ({difficulty: count}) then come from
+    the counters (None if it has none). Pooled items are also grouped in
+    entry['byDifficulty']. When the bundle is current the entry comes from
+    it and hit is 'bundle'. Safe to call from several threads.
+    """
+    key = subject_id or '*'
+    version = _current_questions_version()
+    current = _current_quiz_bundle(version)
+    if current is not None:
+        with _quiz_pool_lock:
+            _quiz_pool_stats['bundleHits'] += 1
+        return _bundle_entry(current, subject_id), 'bundle'
+    with _quiz_pool_lock:
+        entry = _quiz_pool.get(key)
+        if entry is not None:
+            fresh = time.monotonic() - entry['loadedAt'] < QUIZ_POOL_TTL_SECONDS
+            if fresh and entry['version'] == version:
+                _quiz_pool.move_to_end(key)
+                _quiz_pool_stats['hits'] += 1
+                return entry, True
+            del _quiz_pool[key]
+            _quiz_pool_stats['invalidations'] += 1
+        _quiz_pool_stats['misses'] += 1
+
+    limit = min(QUIZ_POOL_MAX_SUBJECT_ITEMS, QUIZ_POOL_MAX_ITEMS)
+    count, counts = _question_count(subject_id, by_difficulty=True) if subject_id else (_question_count(None), None)
+    by_difficulty = None
+    if count is not None and count > limit:
+        items = None
+    else:
+        items = _load_quiz_items(subject_id, limit)
+        if items is not None:
+            by_difficulty = {}
+            for item in items:
+                by_difficulty.setdefault(_difficulty_key(item), []).append(item)
+    entry = {
+        'items': items, 'count': count, 'counts': counts, 'byDifficulty': by_difficulty,
+        'version': version, 'loadedAt': time.monotonic(),
+    }
+    with _quiz_pool_lock:
+        _quiz_pool[key] = entry
+        total = sum(len(e['items'] or ()) for e in _quiz_pool.values())
+        while total > QUIZ_POOL_MAX_ITEMS:
+            _, evicted = _quiz_pool.popitem(last=False)
+            total -= len(evicted['items'] or ())
+            _quiz_pool_stats['evictions'] += 1
+    return entry, False
+
+
+def _quiz_source(entry, difficulty):
+    """(items or None, count) of a pool entry, or of its questions of one difficulty.
+
+    Difficulties of a pooled subject are read from its pool; those of a
+    larger subject are sampled through SubjectDifficultyIndex.
+    """
+    if difficulty is None:
+        return entry['items'], entry['count']
+    if entry['items'] is not None:
+        items = entry['byDifficulty'].get(difficulty, [])
+        return items, len(items)
+    return None, entry['counts'].get(difficulty, 0) if entry['counts'] is not None else None
+
+
+def _allocate(count, weights, capacity):
+    """Split `count` into whole shares in proportion to `weights`, none above its capacity.
+
+    Shares a source cannot fill go to the others; ties for the last units
+    are broken at random.
+    """
+    shares = [0] * len(weights)
+    remaining = count
+    open_ = [i for i, w in enumerate(weights) if w > 0 and capacity[i] > 0]
+    while remaining > 0 and open_:
+        total = sum(weights[i] for i in open_)
+        quotas = {i: remaining * weights[i] / total for i in open_}
+        grants = {i: int(q) for i, q in quotas.items()}
+        leftover = remaining - sum(grants.values())
+        for i in sorted(open_, key=lambda i: (quotas[i] - grants[i], random.random()), reverse=True)[:leftover]:
+            grants[i] += 1
+        for i in open_:
+            granted = min(grants[i], capacity[i] - shares[i])
+            shares[i] += granted
+            remaining -= granted
+        open_ = [i for i in open_ if shares[i] < capacity[i]]
+    return shares
+
+
+def _quiz_sources(subject_ids, weights, difficulties):
+    """Pool or size up every subject concurrently, then split them by difficulty.
+
+    Returns [subjectId, difficulty, items or None, available, hit, quota]
+    lists. The quotas split each subject's weight across its difficulties in
+    proportion to what they hold; with weights None every pair's quota is
+    its size.
+    """
+    _current_questions_version()  # read the marker once, not from every worker
+    loaded = _fan_out(_quiz_pool_items, subject_ids, QUIZ_FETCH_CONCURRENCY)
+    sources = []
+    for sid, (entry, hit) in zip(subject_ids, loaded):
+        for difficulty in difficulties or [None]:
+            items, count = _quiz_source(entry, difficulty)
+            # A subject without counters that is too large to pool: assume plenty
+            available = len(items) if items is not None else QUIZ_POOL_MAX_ITEMS if count is None else count
+            sources.append([sid, difficulty, items, available, hit])
+    if weights is None:
+        for source in sources:
+            source.append(source[3])
+        return sources
+    by_subject = {}
+    for source in sources:
+        by_subject.setdefault(source[0], []).append(source)
+    weight_of = dict(zip(subject_ids, weights))
+    for sid, group in by_subject.items():
+        held = sum(s[3] for s in group) or 1
+        for source in group:
+            source.append(weight_of[sid] * source[3] / held if len(group) > 1 else weight_of[sid])
+    return sources
+
+
+def _difficulty_key(item):
+    return item.get('difficulty') or NO_DIFFICULTY
+
+
+def _subject_difficulty(item):
+    return storage.subject_difficulty(item['subjectId'], item.get('difficulty'))
+
+
+def _normalize_difficulty(value):
+    difficulty = str(value or '').strip().upper()
+    if difficulty and difficulty not in DIFFICULTIES:
+        raise ValueError('difficulty must be one of ' + ', '.join(DIFFICULTIES))
+    return difficulty
+
+
+def _subject_count_update(subject_id, deltas):
+    """Transaction action adding {difficulty: delta} to a subject's counters, or None."""
+    deltas = {d: n for d, n in deltas.items() if n}
+    if not deltas:
+        return None
+    add = {COUNT_ATTR: sum(deltas.values())}
+    for difficulty, n in sorted(deltas.items()):
+        add[COUNT_ATTR_PREFIX + difficulty] = n
+    return {'op': 'update', 'table': 'subjects', 'key': {'subjectId': subject_id}, 'add': add}
+
+
+def _apply_subject_counts(deltas):
+    """Apply {subjectId: {difficulty: delta}} with one atomic ADD per subject.
+
+    Used where the question writes are not transactional (bulk paths); a
+    failure is logged and left for `maintenance.py recompute-counters`.
+    """
+    for subject_id, by_difficulty in deltas.items():
+        update = _subject_count_update(subject_id, by_difficulty)
+        if update is None:
+            continue
+        try:
+            store.update('subjects', update['key'], add=update['add'])
+        except Exception:
+            logger.exception('Failed to update question counters for subject %s', subject_id)
+
+
+def _add_count_delta(deltas, subject_id, difficulty, n):
+    by_difficulty = deltas.setdefault(subject_id, {})
+    by_difficulty[difficulty] = by_difficulty.get(difficulty, 0) + n
+
+
+def _known_subject_deltas(deltas):
+    """Drop the counter deltas of subjects that no longer exist (e.g. legacy data)."""
+    if not deltas:
+        return deltas
+    keys = [{'subjectId': subject_id} for subject_id in deltas]
+    found = {it['subjectId'] for it in store.batch_get('subjects', keys, ['subjectId'])}
+    return {subject_id: d for subject_id, d in deltas.items() if subject_id in found}
+
+
+def _present_subject(item):
+    """Fold the per-difficulty counter attributes into a difficultyCounts map."""
+    out = {k: v for k, v in item.items() if not k.startswith(COUNT_ATTR_PREFIX)}
+    if COUNT_ATTR in item:
+        out['difficultyCounts'] = {
+            k[len(COUNT_ATTR_PREFIX):]: v for k, v in item.items() if k.startswith(COUNT_ATTR_PREFIX) and v
+        }
+    return out
+
+
+def _slugify(name):
+    slug = name.lower().replace(' ', '-').replace('_', '-')
+    slug = ''.join(c for c in slug if c.isalnum() or c == '-')
+    return slug[:60]
+
+
+def _validate_bulk_row(q):
+    """Return the cleaned row or raise ValueError with the row's error message."""
+    if not isinstance(q, dict):
+        raise ValueError('row must be an object')
+    for f in ['question', 'options', 'answerIndex', 'subject']:
+        if f not in q:
+            raise ValueError(f'Missing field: {f}')
+    options = q['options']
+    if not isinstance(options, list) or len(options) != 4 or not all(isinstance(x, str) and x.strip() for x in options):
+        raise ValueError('options must be a list of 4 non-empty strings')
+    ai = _int_arg(q['answerIndex'], 'answerIndex')
+    if not (0 <= ai <= 3):
+        raise ValueError('answerIndex must be 0..3')
+    subject_name = str(q['subject']).strip()
+    if not subject_name:
+        raise ValueError('subject cannot be empty')
+    difficulty = _normalize_difficulty(q.get('difficulty'))
+    return {
+        'questionId': q.get('questionId'),
+        'question': str(q['question']).strip(),
+        'options': options,
+        'answerIndex': ai,
+        'tags': q.get('tags', []),
+        'subject': subject_name,
+        'difficulty': difficulty,
+    }
+
+
+def _resolve_subjects(names, cache):
+    """Map subject names to subject items, creating the missing ones in one batch.
+
+    `cache` (name -> subject item) is shared for the whole request. Returns
+    the names of subjects that were created.
+    """
+    missing = []
+    for name in names:
+        if name in cache:
+            continue
+        found, _ = store.query('subjects', 'SubjectNameIndex', name, limit=1)
+        if found:
+            cache[name] = found[0]
+        else:
+            missing.append(name)
+    if not missing:
+        return []
+
+    # Slugs must be unique; the subjects table is small, so read them once.
+    taken, cursor = set(), None
+    while True:
+        page, cursor = store.scan('subjects', cursor=cursor, fields=['slug'])
+        taken.update(i['slug'] for i in page if 'slug' in i)
+        if cursor is None:
+            break
+
+    now = _now_iso()
+    created = {}
+    for name in missing:
+        slug = _slugify(name)
+        if slug in taken:
+            slug = f"{slug}-{int(datetime.datetime.utcnow().timestamp())}"
+        taken.add(slug)
+        created[name] = {
+            'subjectId': _gen_id(),
+            'subjectName': name,
+            'slug': slug,
+            'description': f'Questions for {name}',
+            COUNT_ATTR: 0,
+            'createdAt': now,
+            'updatedAt': now,
+        }
+    failed = store.batch_write('subjects', puts=list(created.values()))
+    failed_names = {s['subjectName'] for s in failed}
+    for name, subject in created.items():
+        if name not in failed_names:
+            cache[name] = subject
+    return [name for name in created if name not in failed_names]
+
+
+def _bulk_create_questions(questions_data, row_offset=0, subject_cache=None, id_prefix=None):
+    """Validate, resolve subjects for, and batch-write a list of bulk rows.
+
+    Rows are numbered from row_offset + 1 in the report. Questions whose
+    caller-supplied questionId already exists (or repeats an earlier row) are
+    skipped, as with the single-item conditional put. With id_prefix, rows
+    without a questionId get the deterministic id `{id_prefix}-{row}`, so
+    re-running the same rows skips them instead of duplicating them.
+    """
+    outcomes = {}  # row index -> result dict
+    errors = {}  # row index -> message
+    rows = []
+    for i, q in enumerate(questions_data):
+        try:
+            row = _validate_bulk_row(q)
         except Exception as e:
-            return _response(event, 500, {'error': str(e)})
-
-    if '/subjects/' in path and method == 'GET':
-        sid = path.rsplit('/', 1)[-1]
-        res = subjects_table.get_item(Key={'subjectId': sid})
-        item = res.get('Item')
-        if not item:
-            return _response(event, 404, {'error': 'Not found'})
-        return _response(event, 200, item)
-
-    if '/subjects/' in path and method == 'PUT':
-        if not _require_admin(event):
-            return _response(event, 404, {'error': 'Not found'})
-        sid = path.rsplit('/', 1)[-1]
+            errors[i] = str(e)
+            continue
+        if id_prefix and not row['questionId']:
+            row['questionId'] = f'{id_prefix}-{i + row_offset + 1}'
+        rows.append((i, row))
+
+    subject_cache = {} if subject_cache is None else subject_cache
+    created_subjects = []
+    try:
+        created_subjects = _resolve_subjects(sorted({r['subject'] for _, r in rows}), subject_cache)
+    except Exception as e:
+        for i, _ in rows:
+            errors[i] = str(e)
+        rows = []
+
+    supplied_ids = list({r['questionId'] for _, r in rows if r['questionId']})
+    existing = set()
+    if supplied_ids:
+        existing = {
+            it['questionId']
+            for it in store.batch_get('questions', [{'questionId': qid} for qid in supplied_ids], ['questionId'])
+        }
+
+    hashes = {}  # row index -> content hash
+    for i, r in rows:
+        subject = subject_cache.get(r['subject'])
+        if subject is not None:
+            hashes[i] = _content_hash(r['question'], r['options'], subject['subjectId'])
+    duplicates = _find_duplicates(list(set(hashes.values())))
+
+    pending = {}  # questionId -> (row index, subject name)
+    now = _now_iso()
+    for i, r in rows:
+        subject = subject_cache.get(r['subject'])
+        if subject is None:
+            errors[i] = f"could not create subject {r['subject']}"
+            continue
+        qid = r['questionId'] or _gen_id()
+        if qid in existing or qid in pending:
+            outcomes[i] = {'questionId': qid, 'status': 'skipped', 'reason': 'already exists', 'subject': r['subject']}
+            continue
+        # Same content as a stored question, or as an earlier row of this batch
+        if hashes[i] in duplicates:
+            outcomes[i] = {
+                'questionId': duplicates[hashes[i]], 'status': 'skipped', 'reason': 'already exists',
+                'subject': r['subject'],
+            }
+            continue
+        duplicates[hashes[i]] = qid
+        item = {
+            'questionId': qid,
+            'question': r['question'],
+            'options': r['options'],
+            'answerIndex': r['answerIndex'],
+            'tags': r['tags'],
+            'subjectId': subject['subjectId'],
+            'subjectName': subject['subjectName'],
+            'createdAt': now,
+            'updatedAt': now,
+            CONTENT_HASH_ATTR: hashes[i],
+            **_random_key_fields(),
+        }
+        if r['difficulty']:
+            item['difficulty'] = r['difficulty']
+        item[storage.SUBJECT_DIFFICULTY_ATTR] = _subject_difficulty(item)
+        pending[qid] = (i, r['subject'], item)
+
+    items = [item for _, _, item in pending.values()]
+    count_deltas = {}
+    for start in range(0, len(items), BATCH_WRITE_MAX):
+        chunk = items[start:start + BATCH_WRITE_MAX]
         try:
-            payload = json.loads(body or '{}')
-            update_fields = {k: v for k, v in payload.items() if k in {'subjectName', 'description'}}
-            expr, names, values = [], {}, {}
-            if 'subjectName' in update_fields:
-                # Ensure unique new name
-                subject_name = str(update_fields['subjectName']).strip()
-                existing = subjects_table.query(
-                    IndexName='SubjectNameIndex',
-                    KeyConditionExpression=boto3.dynamodb.conditions.Key('subjectName').eq(subject_name),
-                    Limit=1,
-                )
-                if existing.get('Items') and existing['Items'][0]['subjectId'] != sid:
-                    return _response(event, 409, {'error': 'Subject name already exists'})
-            for k, v in update_fields.items():
-                expr.append(f"#_{k} = :{k}")
-                names[f"#_{k}"] = k
-                values[f":{k}"] = v
-            expr.append('#_updatedAt = :updatedAt')
-            names['#_updatedAt'] = 'updatedAt'
-            values[':updatedAt'] = _now_iso()
-            if not expr:
-                return _response(event, 400, {'error': 'No updatable fields provided'})
-            res = subjects_table.update_item(
-                Key={'subjectId': sid},
-                UpdateExpression='SET ' + ', '.join(expr),
-                ExpressionAttributeNames=names,
-                ExpressionAttributeValues=values,
-                ConditionExpression='attribute_exists(subjectId)',
-                ReturnValues='ALL_NEW',
-            )
-            return _response(event, 200, res['Attributes'])
+            failed = {it['questionId'] for it in store.batch_write('questions', puts=chunk)}
         except Exception as e:
-            return _response(event, 500, {'error': str(e)})
+            failed, reason = {it['questionId'] for it in chunk}, str(e)
+        else:
+            reason = 'write was not processed after retries'
+        for it in chunk:
+            qid = it['questionId']
+            i, subject_name, item = pending[qid]
+            if qid in failed:
+                errors[i] = reason
+            else:
+                outcomes[i] = {'questionId': qid, 'status': 'created', 'subject': subject_name}
+                _search_note(puts=[item])
+                _add_count_delta(count_deltas, item['subjectId'], _difficulty_key(item), 1)
+    _put_hash_markers([item for i, _, item in pending.values() if outcomes.get(i, {}).get('status') == 'created'])
+    _apply_subject_counts(count_deltas)
+
+    results = [outcomes[i] for i in sorted(outcomes)]
+    return {
+        'processed': len(questions_data),
+        'successful': len([r for r in results if r['status'] == 'created']),
+        'skipped': len([r for r in results if r['status'] == 'skipped']),
+        'errors': len(errors),
+        'created_subjects': created_subjects,
+        'results': results,
+        'error_details': [f'Row {i + row_offset + 1}: {errors[i]}' for i in sorted(errors)],
+    }
+
+
+def _fan_out(fn, tasks, workers=None):
+    """[fn(task) for task in tasks], run on up to `workers` (BULK_CONCURRENCY) threads."""
+    tasks = list(tasks)
+    if len(tasks) <= 1:
+        return [fn(task) for task in tasks]
+    store.connect()  # build the shared client before the workers race for it
+    with ThreadPoolExecutor(max_workers=min(workers or BULK_CONCURRENCY, len(tasks))) as pool:
+        return list(pool.map(fn, tasks))
+
+
+def _chunked(items, size):
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def _load_questions(question_ids, fields=None):
+    """{questionId: item} for the ids that exist, read with parallel BatchGetItem calls."""
+    keys = [{'questionId': qid} for qid in question_ids]
+    pages = _fan_out(lambda chunk: store.batch_get('questions', chunk, fields), _chunked(keys, BATCH_GET_MAX))
+    return {item['questionId']: item for page in pages for item in page}
 
-    if '/subjects/' in path and method == 'DELETE':
-        if not _require_admin(event):
-            return _response(event, 404, {'error': 'Not found'})
-        sid = path.rsplit('/', 1)[-1]
+
+def _delete_question_items(items):
+    """Delete questions with parallel BatchWriteItem chunks.
+
+    `items` need questionId, subjectId and difficulty. Returns
+    ({questionId: result}, {subjectId: {difficulty: delta}}), the deltas
+    covering the deletes that went through.
+    """
+    def delete_chunk(chunk):
         try:
-            # Optionally prevent deletion if questions exist for subject
-            q = questions_table.query(
-                IndexName='SubjectIndex',
-                KeyConditionExpression=boto3.dynamodb.conditions.Key('subjectId').eq(sid),
-                Limit=1,
-            )
-            if q.get('Items'):
-                return _response(event, 400, {'error': 'Subject has questions; delete them first'})
-            subjects_table.delete_item(Key={'subjectId': sid}, ConditionExpression='attribute_exists(subjectId)')
-            return _response(event, 204, {})
+            unprocessed = store.batch_write('questions', deletes=[{'questionId': it['questionId']} for it in chunk])
         except Exception as e:
-            return _response(event, 500, {'error': str(e)})
-
-    # Questions
-    if path.endswith('/questions') and method == 'GET':
-        if not _require_admin(event):
-            return _response(event, 404, {'error': 'Not found'})
-        limit = int(qs.get('limit', '50'))
-        eks = qs.get('nextToken')
-        subject_id = qs.get('subjectId')
-        if subject_id:
-            query_kwargs = {
-                'IndexName': 'SubjectIndex',
-                'KeyConditionExpression': boto3.dynamodb.conditions.Key('subjectId').eq(subject_id),
-                'Limit': min(limit, 100),
+            return {it['questionId'] for it in chunk}, str(e)
+        return {key['questionId'] for key in unprocessed}, 'delete was not processed after retries'
+
+    results, deltas = {}, {}
+    chunks = _chunked(items, BATCH_WRITE_MAX)
+    for chunk, (failed, reason) in zip(chunks, _fan_out(delete_chunk, chunks)):
+        for item in chunk:
+            qid = item['questionId']
+            if qid in failed:
+                results[qid] = {'questionId': qid, 'status': 'failed', 'reason': reason}
+            else:
+                results[qid] = {'questionId': qid, 'status': 'deleted'}
+                _add_count_delta(deltas, item['subjectId'], _difficulty_key(item), -1)
+    _drop_hash_markers([it for it in items if results[it['questionId']]['status'] == 'deleted'])
+    return results, deltas
+
+
+def _move_question_items(items, subject):
+    """Move questions to `subject` with parallel conditional transactions.
+
+    Each one rewrites subjectId, the denormalised subjectName, the
+    subject/difficulty key and the content hash (which covers the subject),
+    moves the question's hash marker, and only applies while the question
+    still has the subject and difficulty it was read with, so the counter
+    deltas match what was written. Questions whose content already exists in
+    the target subject are skipped. Returns ({questionId: result}, counter
+    deltas, [updated items]).
+    """
+    target = subject['subjectId']
+    results, todo = {}, []
+    hashes = {
+        it['questionId']: _content_hash(it.get('question', ''), it.get('options') or [], target) for it in items
+    }
+    duplicates = _find_duplicates(list(set(hashes.values())))
+    owners = _find_duplicates({it[CONTENT_HASH_ATTR] for it in items if it.get(CONTENT_HASH_ATTR)})
+    for item in items:
+        qid = item['questionId']
+        if item['subjectId'] == target:
+            results[qid] = {'questionId': qid, 'status': 'skipped', 'reason': 'already in subject'}
+        elif hashes[qid] in duplicates:
+            results[qid] = {
+                'questionId': qid, 'status': 'skipped', 'reason': 'already exists',
+                'existingQuestionId': duplicates[hashes[qid]],
             }
-            if eks:
-                query_kwargs['ExclusiveStartKey'] = json.loads(eks)
-            res = questions_table.query(**query_kwargs)
         else:
-            scan_kwargs = {'Limit': min(limit, 100)}
-            if eks:
-                scan_kwargs['ExclusiveStartKey'] = json.loads(eks)
-            res = questions_table.scan(**scan_kwargs)
-        return _response(event, 200, {
-            'items': res.get('Items', []),
-            'nextToken': json.dumps(res['LastEvaluatedKey']) if 'LastEvaluatedKey' in res else None,
-        })
+            duplicates[hashes[qid]] = qid
+            todo.append(item)
+
+    now = _now_iso()
 
-    if path.endswith('/questions') and method == 'POST':
-        if not _require_admin(event):
-            return _response(event, 404, {'error': 'Not found'})
+    def move(item):
+        qid = item['questionId']
+        changes = {
+            'subjectId': target,
+            'subjectName': subject['subjectName'],
+            CONTENT_HASH_ATTR: hashes[qid],
+            storage.SUBJECT_DIFFICULTY_ATTR: storage.subject_difficulty(target, item.get('difficulty')),
+            'updatedAt': now,
+        }
+        expect = {'subjectId': item['subjectId'], 'difficulty': item.get('difficulty') or None}
+        actions = [
+            {'op': 'update', 'table': 'questions', 'key': {'questionId': qid}, 'changes': changes, 'expect': expect},
+            _hash_claim(hashes[qid], qid),
+        ]
+        old_hash = item.get(CONTENT_HASH_ATTR)
+        if old_hash and old_hash != hashes[qid] and owners.get(old_hash) == qid:
+            actions.append(_hash_release(old_hash, qid))
         try:
-            payload = json.loads(body or '{}')
-            for f in ['question', 'options', 'answerIndex', 'subjectId']:
-                if f not in payload:
-                    return _response(event, 400, {'error': f'Missing field: {f}'})
-            options = payload['options']
-            if not isinstance(options, list) or len(options) != 4 or not all(isinstance(x, str) for x in options):
-                return _response(event, 400, {'error': 'options must be a list of 4 strings'})
-            ai = int(payload['answerIndex'])
-            if not (0 <= ai <= 3):
-                return _response(event, 400, {'error': 'answerIndex must be 0..3'})
-            sid = str(payload['subjectId'])
-            # Load subject to denormalize subjectName
-            s = subjects_table.get_item(Key={'subjectId': sid}).get('Item')
-            if not s:
-                return _response(event, 400, {'error': 'Invalid subjectId'})
-            qid = payload.get('questionId') or _gen_id()
-            now = _now_iso()
-            item = {
-                'questionId': qid,
-                'question': str(payload['question']),
-                'options': options,
-                'answerIndex': ai,
-                'tags': payload.get('tags') or [],
-                'subjectId': sid,
-                'subjectName': s['subjectName'],
-                'createdAt': now,
-                'updatedAt': now,
-            }
-            questions_table.put_item(Item=item, ConditionExpression='attribute_not_exists(questionId)')
-            return _response(event, 201, item)
+            store.transact(actions)
+        except storage.ConditionFailed as e:
+            if e.index == 1:
+                return None, 'A question with the same content already exists in the subject'
+            return None, 'Question was modified concurrently; retry'
         except Exception as e:
-            return _response(event, 500, {'error': str(e)})
-
-    if '/questions/' in path and method == 'GET':
-        if not _require_admin(event):
-            return _response(event, 404, {'error': 'Not found'})
-        qid = path.rsplit('/', 1)[-1]
-        res = questions_table.get_item(Key={'questionId': qid})
-        item = res.get('Item')
-        if not item:
-            return _response(event, 404, {'error': 'Not found'})
-        return _response(event, 200, item)
-
-    if '/questions/' in path and method == 'PUT':
-        if not _require_admin(event):
-            return _response(event, 404, {'error': 'Not found'})
-        qid = path.rsplit('/', 1)[-1]
-        try:
-            payload = json.loads(body or '{}')
-            allowed = {'question', 'options', 'answerIndex', 'tags', 'subjectId'}
-            update_fields = {k: v for k, v in payload.items() if k in allowed}
-            if 'options' in update_fields:
-                options = update_fields['options']
-                if not isinstance(options, list) or len(options) != 4 or not all(isinstance(x, str) for x in options):
-                    return _response(event, 400, {'error': 'options must be a list of 4 strings'})
-            if 'answerIndex' in update_fields:
-                ai = int(update_fields['answerIndex'])
-                if not (0 <= ai <= 3):
-                    return _response(event, 400, {'error': 'answerIndex must be 0..3'})
-            if 'subjectId' in update_fields:
-                sid = str(update_fields['subjectId'])
-                s = subjects_table.get_item(Key={'subjectId': sid}).get('Item')
-                if not s:
-                    return _response(event, 400, {'error': 'Invalid subjectId'})
-            expr, names, values = [], {}, {}
-            for k, v in update_fields.items():
-                if k == 'subjectId':
-                    # also update denormalized subjectName
-                    s = subjects_table.get_item(Key={'subjectId': v}).get('Item')
-                    expr.append('#_subjectName = :subjectName')
-                    names['#_subjectName'] = 'subjectName'
-                    values[':subjectName'] = s['subjectName']
-                expr.append(f"#_{k} = :{k}")
-                names[f"#_{k}"] = k
-                values[f":{k}"] = v
-            expr.append('#_updatedAt = :updatedAt')
-            names['#_updatedAt'] = 'updatedAt'
-            values[':updatedAt'] = _now_iso()
-            if not expr:
-                return _response(event, 400, {'error': 'No updatable fields provided'})
-            res = questions_table.update_item(
-                Key={'questionId': qid},
-                UpdateExpression='SET ' + ', '.join(expr),
-                ExpressionAttributeNames=names,
-                ExpressionAttributeValues=values,
-                ConditionExpression='attribute_exists(questionId)',
-                ReturnValues='ALL_NEW',
+            return None, str(e)
+        return {**item, **changes}, None
+
+    deltas, moved = {}, []
+    for item, (new, error) in zip(todo, _fan_out(move, todo)):
+        qid = item['questionId']
+        if new is None:
+            results[qid] = {'questionId': qid, 'status': 'failed', 'reason': error}
+            continue
+        results[qid] = {'questionId': qid, 'status': 'moved'}
+        moved.append(new)
+        _add_count_delta(deltas, item['subjectId'], _difficulty_key(item), -1)
+        _add_count_delta(deltas, target, _difficulty_key(item), 1)
+    return results, deltas, moved
+
+
+def _bulk_report(question_ids, results):
+    """Per-question results in request order, with totals."""
+    ordered = [results[qid] for qid in question_ids]
+    return {
+        'processed': len(ordered),
+        'successful': len([r for r in ordered if r['status'] in ('deleted', 'moved')]),
+        'skipped': len([r for r in ordered if r['status'] == 'skipped']),
+        'errors': len([r for r in ordered if r['status'] == 'failed']),
+        'results': ordered,
+    }
+
+
+def _iter_csv_records(raw, offset):
+    """Yield (record, end_offset) for each CSV record in a binary stream.
+
+    `offset` is the stream's starting byte position in the file and
+    end_offset is the position just past the record, i.e. where a resumed
+    import has to start reading. Only one read buffer is held at a time.
+    """
+    pos = [offset]
+
+    def lines():
+        buf = b''
+        while True:
+            chunk = raw.read(CSV_IMPORT_READ_BYTES)
+            if not chunk:
+                break
+            buf += chunk
+            *complete, buf = buf.split(b'\n')
+            for line in complete:
+                pos[0] += len(line) + 1
+                yield line.decode('utf-8') + '\n'
+        if buf:
+            pos[0] += len(buf)
+            yield buf.decode('utf-8')
+
+    # csv.reader pulls only the lines of the record it is parsing, so pos is
+    # exact whenever a record is yielded.
+    for record in csv.reader(lines()):
+        yield record, pos[0]
+
+
+def _csv_record_to_row(header, record):
+    values = dict(zip(header, record))
+    row = {k: values[k] for k in ('question', 'subject', 'difficulty') if k in values}
+    if all(f'option{n}' in values for n in range(1, 5)):
+        row['options'] = [values[f'option{n}'] for n in range(1, 5)]
+    if 'answer_index' in values:
+        row['answerIndex'] = values['answer_index']
+    return row
+
+
+def _import_checkpoint_key(job_id):
+    return {'subjectId': f'{META_PREFIX}import#{job_id}'}
+
+
+def _import_status(job):
+    return {
+        'jobId': job['jobId'],
+        'status': job['status'],
+        'source': job['source'],
+        'rowsDone': int(job['rowsDone']),
+        'successful': int(job['successful']),
+        'skipped': int(job['skipped']),
+        'errors': int(job['errors']),
+        'created_subjects': list(job.get('createdSubjects') or []),
+        'error_details': list(job.get('errorDetails') or []),
+    }
+
+
+def _start_csv_import(source, job_id=None):
+    """Create the checkpoint record for a new import job."""
+    now = _now_iso()
+    job = {
+        **_import_checkpoint_key(job_id or _gen_id()),
+        'source': source,
+        'status': 'running',
+        'header': [],
+        'offset': 0,
+        'rowsDone': 0,
+        'successful': 0,
+        'skipped': 0,
+        'errors': 0,
+        'errorDetails': [],
+        'createdSubjects': [],
+        'createdAt': now,
+        'updatedAt': now,
+        CSV_IMPORT_TTL_ATTR: int(time.time()) + CSV_IMPORT_TTL_SECONDS,
+    }
+    job['jobId'] = job['subjectId'][len(META_PREFIX + 'import#'):]
+    store.put('subjects', job, if_absent=True)
+    return job
+
+
+def _load_csv_import(job_id):
+    return store.get('subjects', _import_checkpoint_key(job_id), consistent=True)
+
+
+def _save_import_checkpoint(job, prev_rows_done):
+    # Conditional on the previous rowsDone so two runners can't both advance a
+    # job. Once the job has finished the caller holds its final status, and
+    # the checkpoint is deleted rather than left in the subjects table.
+    job['updatedAt'] = _now_iso()
+    job[CSV_IMPORT_TTL_ATTR] = int(time.time()) + CSV_IMPORT_TTL_SECONDS
+    if job['status'] == 'running':
+        store.put('subjects', job, expect={'rowsDone': prev_rows_done})
+    else:
+        store.delete('subjects', _import_checkpoint_key(job['jobId']), expect={'rowsDone': prev_rows_done})
+
+
+def _run_csv_import(job, open_stream, time_left_ms=None):
+    """Import CSV rows from the job's checkpoint onwards, committing in chunks.
+
+    `open_stream(offset)` returns a binary stream positioned at byte `offset`.
+    After every chunk the checkpoint (byte offset, counters, first errors) is
+    saved, so an interrupted job resumes from the last committed chunk.
+    One record is read ahead, so a chunk ending on the last row is saved as
+    completed. Returns True once the whole file has been imported.
+    """
+    subject_cache = {}
+    created_any = False
+    stream = open_stream(int(job['offset']))
+    try:
+        records = _iter_csv_records(stream, int(job['offset']))
+        if not job['header']:
+            header, offset = next(records, (None, 0))
+            if header is None:
+                job['status'] = 'completed'
+                _save_import_checkpoint(job, job['rowsDone'])
+                return True
+            header = [h.strip().lstrip('\ufeff').lower() for h in header]
+            missing = [c for c in CSV_IMPORT_COLUMNS if c not in header and c != 'difficulty']
+            if missing:
+                job['status'] = 'failed'
+                job['errorDetails'] = ['CSV is missing columns: ' + ', '.join(missing)]
+                _save_import_checkpoint(job, job['rowsDone'])
+                return False
+            job['header'] = header
+            job['offset'] = offset
+
+        ahead = next(records, None)
+        if ahead is None:
+            # Header only, or a checkpoint already at the end of the file
+            job['status'] = 'completed'
+            _save_import_checkpoint(job, job['rowsDone'])
+            return True
+        done = False
+        while not done:
+            if time_left_ms is not None and time_left_ms() < CSV_IMPORT_TIME_MARGIN_MS:
+                break
+            chunk = []
+            offset = job['offset']
+            while ahead is not None and len(chunk) < CSV_IMPORT_CHUNK_ROWS:
+                record, offset = ahead
+                if any(cell.strip() for cell in record):
+                    chunk.append(_csv_record_to_row(job['header'], record))
+                ahead = next(records, None)
+            done = ahead is None
+
+            prev_rows_done = job['rowsDone']
+            report = _bulk_create_questions(
+                chunk, row_offset=int(prev_rows_done), subject_cache=subject_cache, id_prefix=f"import-{job['jobId']}",
             )
-            return _response(event, 200, res['Attributes'])
-        except Exception as e:
-            return _response(event, 500, {'error': str(e)})
+            created_any = created_any or report['successful'] > 0
+            job['offset'] = offset
+            job['rowsDone'] = int(prev_rows_done) + len(chunk)
+            job['successful'] = int(job['successful']) + report['successful']
+            job['skipped'] = int(job['skipped']) + report['skipped']
+            job['errors'] = int(job['errors']) + report['errors']
+            room = CSV_IMPORT_MAX_ERROR_DETAILS - len(job['errorDetails'])
+            job['errorDetails'] = list(job['errorDetails']) + report['error_details'][:max(room, 0)]
+            job['createdSubjects'] = list(job['createdSubjects']) + report['created_subjects']
+            if done:
+                job['status'] = 'completed'
+            _save_import_checkpoint(job, prev_rows_done)
+    finally:
+        stream.close()
+        if created_any:
+            _bump_questions_version()
+    return job['status'] == 'completed'
+
+
+def _scan_pages(segments, projection=None, subject_id=None):
+    """Yield pages of question items from a parallel scan.
+
+    Each of `segments` scan segments is paged through on its own worker
+    thread, and pages arrive through a bounded queue in whatever order the
+    workers produce them. With subject_id a single SubjectIndex query is
+    used instead, as an index query cannot be split into segments.
+    """
+    if subject_id:
+        segments = 1
+
+    pages = queue.Queue(maxsize=segments * 2)
+    stop = threading.Event()
+    finished = object()
 
-    if '/questions/' in path and method == 'DELETE':
-        if not _require_admin(event):
-            return _response(event, 404, {'error': 'Not found'})
-        qid = path.rsplit('/', 1)[-1]
+    def put(value):
+        while not stop.is_set():
+            try:
+                pages.put(value, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def worker(segment):
+        cursor = None
         try:
-            questions_table.delete_item(Key={'questionId': qid}, ConditionExpression='attribute_exists(questionId)')
-            return _response(event, 204, {})
+            while not stop.is_set():
+                if subject_id:
+                    page, cursor = store.query('questions', 'SubjectIndex', subject_id, cursor=cursor, fields=projection)
+                else:
+                    page, cursor = store.scan('questions', cursor=cursor, fields=projection, segment=segment, segments=segments)
+                put(page)
+                if cursor is None:
+                    break
         except Exception as e:
-            return _response(event, 500, {'error': str(e)})
+            put(e)
+        finally:
+            put(finished)
 
-    # Quiz (public)
-    if method == 'GET' and path.endswith('/quiz'):
-        count = max(1, min(int(qs.get('count', '10')), 50))
-        subject_id = qs.get('subjectId')
-        items = []
-        if subject_id:
-            q = questions_table.query(
-                IndexName='SubjectIndex',
-                KeyConditionExpression=boto3.dynamodb.conditions.Key('subjectId').eq(subject_id),
-                ProjectionExpression='questionId,question,options,answerIndex',
-            )
-            items = q.get('Items', [])
+    store.connect()  # as in _fan_out
+    with ThreadPoolExecutor(max_workers=segments) as pool:
+        try:
+            for segment in range(segments):
+                pool.submit(worker, segment)
+            remaining = segments
+            while remaining:
+                page = pages.get()
+                if page is finished:
+                    remaining -= 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    yield page
+        finally:
+            stop.set()
+
+
+def _export_csv_row(item):
+    options = list(item.get('options') or [])
+    options += [''] * (4 - len(options))
+    return [
+        item.get('question', ''), *options[:4], item.get('answerIndex', ''),
+        item.get('subjectName', ''), item.get('difficulty', ''),
+    ]
+
+
+def _export_chunks(fmt, segments, fields=None, subject_id=None):
+    """Yield the export as encoded chunks (one per scanned page)."""
+    if fmt == 'csv':
+        fields = ['question', 'options', 'answerIndex', 'subjectName', 'difficulty']
+        out = io.StringIO()
+        csv.writer(out).writerow(CSV_IMPORT_COLUMNS)
+        yield out.getvalue().encode('utf-8')
+    for page in _scan_pages(segments, fields, subject_id):
+        if fmt == 'csv':
+            out = io.StringIO()
+            writer = csv.writer(out)
+            for item in page:
+                writer.writerow(_export_csv_row(item))
+            chunk = out.getvalue()
         else:
-            s = questions_table.scan(ProjectionExpression='questionId,question,options,answerIndex')
-            items = s.get('Items', [])
-        selected = items if len(items) <= count else random.sample(items, count)
-        prepared = []
-        for q in selected:
-            idxs = list(range(4))
-            random.shuffle(idxs)
-            shuffled = [q['options'][i] for i in idxs]
-            correct_new = idxs.index(int(q['answerIndex']))
-            prepared.append({
-                'questionId': q['questionId'],
-                'question': q['question'],
-                'options': shuffled,
-                'answerIndex': correct_new,
+            chunk = ''.join(_json_encoder.encode(item) + '\n' for item in page)
+        if chunk:
+            yield chunk.encode('utf-8')
+
+
+def _upload_export(chunks, bucket, key, content_type):
+    """Stream chunks into an S3 multipart upload; returns the byte count."""
+    s3 = _aws_client('s3')
+    upload_id = s3.create_multipart_upload(Bucket=bucket, Key=key, ContentType=content_type)['UploadId']
+    parts, buf, total = [], bytearray(), 0
+    try:
+        for chunk in chunks:
+            buf += chunk
+            total += len(chunk)
+            if len(buf) >= EXPORT_PART_BYTES:
+                n = len(parts) + 1
+                etag = s3.upload_part(Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=n, Body=bytes(buf))['ETag']
+                parts.append({'PartNumber': n, 'ETag': etag})
+                buf = bytearray()
+        if buf or not parts:
+            n = len(parts) + 1
+            etag = s3.upload_part(Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=n, Body=bytes(buf))['ETag']
+            parts.append({'PartNumber': n, 'ETag': etag})
+        s3.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={'Parts': parts})
+    except Exception:
+        s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
+    return total
+
+
+def _open_s3_stream(bucket, key):
+    def open_stream(offset):
+        kwargs = {'Bucket': bucket, 'Key': key}
+        if offset:
+            kwargs['Range'] = f'bytes={offset}-'
+        try:
+            return _aws_client('s3').get_object(**kwargs)['Body']
+        except Exception as e:
+            # A checkpoint at the end of the file: nothing is left to read
+            if offset and getattr(e, 'response', {}).get('Error', {}).get('Code') == 'InvalidRange':
+                return io.BytesIO()
+            raise
+    return open_stream
+
+
+# Routing. Patterns are compiled once at import: parameter-free routes go into
+# a (method, path) dict, the rest into a per-method trie of path segments in
+# which literal segments are tried before {param} segments (so
+# /questions/bulk never falls into /questions/{questionId}).
+API_BASE_PATH = os.environ.get('API_BASE_PATH', '').rstrip('/')
+
+Request = collections.namedtuple('Request', 'event context method path params qs body')
+
+
+class BadRequest(ValueError):
+    """Malformed client input; lambda_handler answers it with a 400."""
+
+
+_static_routes = {}  # (method, path) -> route
+_route_tries = {}  # method -> trie node {'children': {}, 'param': node, 'route': route}
+
+
+def _route(method, pattern, admin=False):
+    """Register the decorated function as the handler for method + pattern."""
+    def register(fn):
+        segments = pattern.strip('/').split('/')
+        names = [seg[1:-1] for seg in segments if seg.startswith('{')]
+        route = {'handler': fn, 'admin': admin, 'params': names, 'pattern': pattern}
+        if not names:
+            _static_routes[(method, '/' + '/'.join(segments))] = route
+            return fn
+        node = _route_tries.setdefault(method, {'children': {}, 'param': None, 'route': None})
+        for seg in segments:
+            if seg.startswith('{'):
+                if node['param'] is None:
+                    node['param'] = {'children': {}, 'param': None, 'route': None}
+                node = node['param']
+            else:
+                node = node['children'].setdefault(seg, {'children': {}, 'param': None, 'route': None})
+        node['route'] = route
+        return fn
+    return register
+
+
+def _match_trie(node, segments, i, values):
+    if i == len(segments):
+        return node['route']
+    child = node['children'].get(segments[i])
+    if child is not None:
+        found = _match_trie(child, segments, i + 1, values)
+        if found is not None:
+            return found
+    if node['param'] is not None:
+        values.append(segments[i])
+        found = _match_trie(node['param'], segments, i + 1, values)
+        if found is not None:
+            return found
+        values.pop()
+    return None
+
+
+def _match_route(method, path):
+    """Return (route, params) for a normalised path, or (None, None)."""
+    route = _static_routes.get((method, path))
+    if route is not None:
+        return route, {}
+    trie = _route_tries.get(method)
+    if trie is None:
+        return None, None
+    values = []
+    route = _match_trie(trie, path.strip('/').split('/'), 0, values)
+    if route is None:
+        return None, None
+    return route, dict(zip(route['params'], values))
+
+
+def _resolve_route(method, path):
+    if API_BASE_PATH and (path == API_BASE_PATH or path.startswith(API_BASE_PATH + '/')):
+        path = path[len(API_BASE_PATH):]
+    path = '/' + path.strip('/')
+    route, params = _match_route(method, path)
+    if route is None and path.count('/') > 1:
+        # Tolerate one unexpected leading segment (stage or base path mapping)
+        route, params = _match_route(method, '/' + path.split('/', 2)[2])
+    return route, params
+
+
+def _json_body(req):
+    """The request body as a JSON object; raises BadRequest."""
+    try:
+        payload = json.loads(req.body or '{}')
+    except ValueError as e:
+        raise BadRequest(f'Request body is not valid JSON: {e}') from None
+    if not isinstance(payload, dict):
+        raise BadRequest('Request body must be a JSON object')
+    return payload
+
+
+def _int_arg(value, name):
+    """int(value) for a client-supplied field or parameter; raises BadRequest."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise BadRequest(f'{name} must be an integer') from None
+
+
+def _cursor_arg(req):
+    """The decoded nextToken query parameter, or None; raises BadRequest."""
+    token = req.qs.get('nextToken')
+    if not token:
+        return None
+    try:
+        cursor = json.loads(token)
+    except ValueError:
+        cursor = None
+    if not isinstance(cursor, dict):
+        raise BadRequest('Invalid nextToken')
+    return cursor
+
+
+# Subjects
+
+@_route('GET', '/subjects')
+def _list_subjects(req):
+    limit = _int_arg(req.qs.get('limit', '50'), 'limit')
+    items, cursor = store.scan('subjects', min(limit, 100), _cursor_arg(req))
+    return _response(req.event, 200, {
+        'items': [_present_subject(i) for i in items if not _is_meta_subject(i)],
+        'nextToken': _json_encoder.encode(cursor) if cursor else None,
+    }, etag=True)
+
+
+@_route('POST', '/subjects', admin=True)
+def _create_subject(req):
+    event = req.event
+    payload = _json_body(req)
+    for f in ['subjectName']:
+        if f not in payload or not str(payload[f]).strip():
+            return _response(event, 400, {'error': f'Missing field: {f}'})
+    subject_name = str(payload['subjectName']).strip()
+    # Enforce unique subjectName via GSI
+    existing, _ = store.query('subjects', 'SubjectNameIndex', subject_name, limit=1)
+    if existing:
+        return _response(event, 409, {'error': 'Subject name already exists'})
+
+    subject_id = payload.get('subjectId') or _gen_id()
+    now = _now_iso()
+    item = {
+        'subjectId': subject_id,
+        'subjectName': subject_name,
+        'description': str(payload.get('description') or ''),
+        COUNT_ATTR: 0,
+        'createdAt': now,
+        'updatedAt': now,
+    }
+    store.put('subjects', item, if_absent=True)
+    return _response(event, 201, _present_subject(item))
+
+
+@_route('GET', '/subjects/{subjectId}')
+def _get_subject(req):
+    item = store.get('subjects', {'subjectId': req.params['subjectId']})
+    if not item or _is_meta_subject(item):
+        return _response(req.event, 404, {'error': 'Not found'})
+    return _response(req.event, 200, _present_subject(item), etag=True)
+
+
+@_route('PUT', '/subjects/{subjectId}', admin=True)
+def _update_subject(req):
+    event = req.event
+    sid = req.params['subjectId']
+    if sid.startswith(META_PREFIX):
+        return _response(event, 404, {'error': 'Not found'})
+    payload = _json_body(req)
+    update_fields = {k: v for k, v in payload.items() if k in {'subjectName', 'description'}}
+    if 'subjectName' in update_fields:
+        # Ensure unique new name
+        subject_name = str(update_fields['subjectName']).strip()
+        existing, _ = store.query('subjects', 'SubjectNameIndex', subject_name, limit=1)
+        if existing and existing[0]['subjectId'] != sid:
+            return _response(event, 409, {'error': 'Subject name already exists'})
+    try:
+        item = store.update('subjects', {'subjectId': sid}, changes={**update_fields, 'updatedAt': _now_iso()})
+    except storage.ConditionFailed:
+        return _response(event, 404, {'error': 'Not found'})
+    return _response(event, 200, _present_subject(item))
+
+
+@_route('DELETE', '/subjects/{subjectId}', admin=True)
+def _delete_subject(req):
+    sid = req.params['subjectId']
+    if sid.startswith(META_PREFIX):
+        return _response(req.event, 404, {'error': 'Not found'})
+    if (req.qs.get('cascade') or '').lower() in ('1', 'true'):
+        return _delete_subject_cascade(req.event, sid)
+    # Refuse while the subject has questions. The counter answers that without
+    # touching the questions table; subjects created before the counters fall
+    # back to a SubjectIndex probe.
+    count = _question_count(sid)
+    if count is None:
+        count = len(store.query('questions', 'SubjectIndex', sid, limit=1, fields=['questionId'])[0])
+    if count:
+        return _response(req.event, 400, {'error': 'Subject has questions; delete them first'})
+    try:
+        store.delete('subjects', {'subjectId': sid}, expect={COUNT_ATTR: (None, 0)}, must_exist=True)
+    except storage.ConditionFailed:
+        # Gone already, or a question was added since the count was read
+        if store.get('subjects', {'subjectId': sid}, fields=['subjectId'], consistent=True) is None:
+            return _response(req.event, 404, {'error': 'Not found'})
+        return _response(req.event, 400, {'error': 'Subject has questions; delete them first'})
+    return _response(req.event, 204, {})
+
+
+def _delete_subject_cascade(event, sid):
+    """Delete a subject's questions, then the subject once none are left."""
+    subject = store.get('subjects', {'subjectId': sid}, fields=['subjectId'])
+    if not subject or _is_meta_subject(subject):
+        return _response(event, 404, {'error': 'Not found'})
+    items = [it for page in _scan_pages(1, BULK_DELETE_FIELDS, subject_id=sid) for it in page]
+    results, deltas = _delete_question_items(items)
+    report = _bulk_report([it['questionId'] for it in items], results)
+    if report['errors']:
+        # Keep the subject (and its counters right) so the delete can be retried
+        _apply_subject_counts(deltas)
+    else:
+        store.delete('subjects', {'subjectId': sid})
+    report['subjectDeleted'] = not report['errors']
+    if report['successful']:
+        _search_note(deletes=[qid for qid, r in results.items() if r['status'] == 'deleted'])
+        _bump_questions_version()
+    return _response(event, 200, report)
+
+
+# Questions
+
+@_route('GET', '/questions', admin=True)
+def _list_questions(req):
+    limit = _int_arg(req.qs.get('limit', '50'), 'limit')
+    subject_id = req.qs.get('subjectId')
+    cursor = _cursor_arg(req)
+    if subject_id:
+        items, cursor = store.query('questions', 'SubjectIndex', subject_id, min(limit, 100), cursor)
+    else:
+        items, cursor = store.scan('questions', min(limit, 100), cursor)
+    return _response(req.event, 200, {
+        'items': items,
+        'nextToken': _json_encoder.encode(cursor) if cursor else None,
+    })
+
+
+@_route('POST', '/questions', admin=True)
+def _create_question(req):
+    event = req.event
+    payload = _json_body(req)
+    for f in ['question', 'options', 'answerIndex', 'subjectId']:
+        if f not in payload:
+            return _response(event, 400, {'error': f'Missing field: {f}'})
+    options = payload['options']
+    if not isinstance(options, list) or len(options) != 4 or not all(isinstance(x, str) for x in options):
+        return _response(event, 400, {'error': 'options must be a list of 4 strings'})
+    ai = _int_arg(payload['answerIndex'], 'answerIndex')
+    if not (0 <= ai <= 3):
+        return _response(event, 400, {'error': 'answerIndex must be 0..3'})
+    try:
+        difficulty = _normalize_difficulty(payload.get('difficulty'))
+    except ValueError as e:
+        return _response(event, 400, {'error': str(e)})
+    sid = str(payload['subjectId'])
+    # Load subject to denormalize subjectName
+    s = store.get('subjects', {'subjectId': sid})
+    if not s:
+        return _response(event, 400, {'error': 'Invalid subjectId'})
+    content_hash = _content_hash(payload['question'], options, sid)
+    qid = payload.get('questionId') or _gen_id()
+    now = _now_iso()
+    item = {
+        'questionId': qid,
+        'question': str(payload['question']),
+        'options': options,
+        'answerIndex': ai,
+        'tags': payload.get('tags') or [],
+        'subjectId': sid,
+        'subjectName': s['subjectName'],
+        'createdAt': now,
+        'updatedAt': now,
+        CONTENT_HASH_ATTR: content_hash,
+        **_random_key_fields(),
+    }
+    if difficulty:
+        item['difficulty'] = difficulty
+    item[storage.SUBJECT_DIFFICULTY_ATTR] = _subject_difficulty(item)
+    # The question, its content hash marker and its subject's counters are
+    # written in one transaction
+    try:
+        store.transact([
+            {'op': 'put', 'table': 'questions', 'item': item, 'if_absent': True},
+            _hash_claim(content_hash, qid),
+            _subject_count_update(sid, {_difficulty_key(item): 1}),
+        ])
+    except storage.ConditionFailed as e:
+        if e.index == 0:
+            return _response(event, 409, {'error': 'Question already exists'})
+        if e.index == 1:
+            return _response(event, 409, {
+                'error': 'A question with the same content already exists', 'questionId': _hash_owner(content_hash),
             })
-        return _response(event, 200, {'questions': prepared, 'total': len(prepared)})
+        return _response(event, 400, {'error': 'Invalid subjectId'})
+    _search_note(puts=[item])
+    _bump_questions_version()
+    return _response(event, 201, item)
+
 
-    # Bulk upload questions
-    if path.endswith('/questions/bulk') and method == 'POST':
-        if not _require_admin(event):
-            return _response(event, 404, {'error': 'Not found'})
+@_route('GET', '/questions/{questionId}', admin=True)
+def _get_question(req):
+    item = store.get('questions', {'questionId': req.params['questionId']})
+    if not item:
+        return _response(req.event, 404, {'error': 'Not found'})
+    return _response(req.event, 200, item, etag=True)
+
+
+@_route('PUT', '/questions/{questionId}', admin=True)
+def _update_question(req):
+    event = req.event
+    qid = req.params['questionId']
+    payload = _json_body(req)
+    allowed = {'question', 'options', 'answerIndex', 'tags', 'subjectId', 'difficulty'}
+    update_fields = {k: v for k, v in payload.items() if k in allowed}
+    if 'options' in update_fields:
+        options = update_fields['options']
+        if not isinstance(options, list) or len(options) != 4 or not all(isinstance(x, str) for x in options):
+            return _response(event, 400, {'error': 'options must be a list of 4 strings'})
+    if 'answerIndex' in update_fields:
+        ai = _int_arg(update_fields['answerIndex'], 'answerIndex')
+        if not (0 <= ai <= 3):
+            return _response(event, 400, {'error': 'answerIndex must be 0..3'})
+        update_fields['answerIndex'] = ai
+    if 'difficulty' in update_fields:
         try:
-            payload = json.loads(body or '{}')
-            questions_data = payload.get('questions', [])
-            
-            if not questions_data or not isinstance(questions_data, list):
-                return _response(event, 400, {'error': 'questions array is required'})
-            
-            results = []
-            errors = []
-            created_subjects = []
-            
-            for i, q in enumerate(questions_data):
-                try:
-                    # Validate required fields
-                    for f in ['question', 'options', 'answerIndex', 'subject']:
-                        if f not in q:
-                            errors.append(f'Row {i+1}: Missing field: {f}')
-                            continue
-                    
-                    options = q['options']
-                    if not isinstance(options, list) or len(options) != 4 or not all(isinstance(x, str) and x.strip() for x in options):
-                        errors.append(f'Row {i+1}: options must be a list of 4 non-empty strings')
-                        continue
-                    
-                    ai = int(q['answerIndex'])
-                    if not (0 <= ai <= 3):
-                        errors.append(f'Row {i+1}: answerIndex must be 0..3')
-                        continue
-                    
-                    subject_name = str(q['subject']).strip()
-                    if not subject_name:
-                        errors.append(f'Row {i+1}: subject cannot be empty')
-                        continue
-                    
-                    # Find or create subject
-                    subject_scan = subjects_table.scan(
-                        FilterExpression=boto3.dynamodb.conditions.Attr('subjectName').eq(subject_name)
-                    )
-                    existing_subject = subject_scan.get('Items', [])
-                    
-                    if existing_subject:
-                        subject = existing_subject[0]
-                    else:
-                        # Create new subject
-                        subject_id = _gen_id()
-                        # Create slug from subject name
-                        slug = subject_name.lower().replace(' ', '-').replace('_', '-')
-                        slug = ''.join(c for c in slug if c.isalnum() or c == '-')
-                        slug = slug[:60]  # Limit length
-                        
-                        # Check if slug exists and make it unique
-                        slug_scan = subjects_table.scan(
-                            FilterExpression=boto3.dynamodb.conditions.Attr('slug').eq(slug)
-                        )
-                        if slug_scan.get('Items'):
-                            slug = f"{slug}-{int(datetime.datetime.utcnow().timestamp())}"
-                        
-                        now = _now_iso()
-                        subject = {
-                            'subjectId': subject_id,
-                            'subjectName': subject_name,
-                            'slug': slug,
-                            'description': f'Questions for {subject_name}',
-                            'createdAt': now,
-                            'updatedAt': now,
-                        }
-                        
-                        subjects_table.put_item(Item=subject)
-                        created_subjects.append(subject_name)
-                    
-                    qid = q.get('questionId') or _gen_id()
-                    now = _now_iso()
-                    
-                    item = {
-                        'questionId': qid,
-                        'question': str(q['question']).strip(),
-                        'options': options,
-                        'answerIndex': ai,
-                        'tags': q.get('tags', []),
-                        'subjectId': subject['subjectId'],
-                        'subjectName': subject['subjectName'],
-                        'createdAt': now,
-                        'updatedAt': now,
-                    }
-                    
-                    # Try to insert (skip if exists)
-                    try:
-                        questions_table.put_item(Item=item, ConditionExpression='attribute_not_exists(questionId)')
-                        results.append({'questionId': qid, 'status': 'created', 'subject': subject_name})
-                    except questions_table.meta.client.exceptions.ConditionalCheckFailedException:
-                        results.append({'questionId': qid, 'status': 'skipped', 'reason': 'already exists', 'subject': subject_name})
-                        
-                except Exception as e:
-                    errors.append(f'Row {i+1}: {str(e)}')
-            
-            return _response(event, 200, {
-                'processed': len(questions_data),
-                'successful': len([r for r in results if r['status'] == 'created']),
-                'skipped': len([r for r in results if r['status'] == 'skipped']),
-                'errors': len(errors),
-                'created_subjects': list(set(created_subjects)),
-                'results': results,
-                'error_details': errors
+            update_fields['difficulty'] = _normalize_difficulty(update_fields['difficulty'])
+        except ValueError as e:
+            return _response(event, 400, {'error': str(e)})
+    if 'subjectId' in update_fields:
+        sid = str(update_fields['subjectId'])
+        s = store.get('subjects', {'subjectId': sid})
+        if not s or _is_meta_subject(s):
+            return _response(event, 400, {'error': 'Invalid subjectId'})
+        update_fields['subjectId'] = sid
+        # also update denormalized subjectName
+        update_fields['subjectName'] = s['subjectName']
+
+    old = store.get('questions', {'questionId': qid}, consistent=True)
+    if not old:
+        return _response(event, 404, {'error': 'Not found'})
+
+    now = _now_iso()
+    changes = {k: v for k, v in update_fields.items() if k != 'difficulty' or v}
+    changes['updatedAt'] = now
+    remove = ['difficulty'] if 'difficulty' in update_fields and not update_fields['difficulty'] else []
+    # Guard against a concurrent change of the fields the counters depend on
+    expect = {'subjectId': old['subjectId'], 'difficulty': old.get('difficulty') or None}
+
+    new = {k: v for k, v in {**old, **update_fields, 'updatedAt': now}.items() if v != '' or k != 'difficulty'}
+    content_hash = _content_hash(new['question'], new['options'], new['subjectId'])
+    hash_actions = []
+    if content_hash != old.get(CONTENT_HASH_ATTR):
+        changes[CONTENT_HASH_ATTR] = new[CONTENT_HASH_ATTR] = content_hash
+        hash_actions.append(_hash_claim(content_hash, qid))
+        if _hash_owner(old.get(CONTENT_HASH_ATTR)) == qid:
+            hash_actions.append(_hash_release(old[CONTENT_HASH_ATTR], qid))
+    if _subject_difficulty(new) != old.get(storage.SUBJECT_DIFFICULTY_ATTR):
+        changes[storage.SUBJECT_DIFFICULTY_ATTR] = new[storage.SUBJECT_DIFFICULTY_ATTR] = _subject_difficulty(new)
+    deltas = {}
+    old_key, new_key = (old['subjectId'], _difficulty_key(old)), (new['subjectId'], _difficulty_key(new))
+    if old_key != new_key:
+        # The old subject may already be gone (legacy data); then skip its decrement
+        if old_key[0] == new_key[0] or store.get('subjects', {'subjectId': old_key[0]}, fields=['subjectId']):
+            deltas.setdefault(old_key[0], {})[old_key[1]] = -1
+        by_difficulty = deltas.setdefault(new_key[0], {})
+        by_difficulty[new_key[1]] = by_difficulty.get(new_key[1], 0) + 1
+    actions = [{
+        'op': 'update', 'table': 'questions', 'key': {'questionId': qid},
+        'changes': changes, 'remove': remove, 'expect': expect,
+    }, *hash_actions]
+    for subject_id, by_difficulty in deltas.items():
+        update = _subject_count_update(subject_id, by_difficulty)
+        if update is not None:
+            actions.append(update)
+    try:
+        if len(actions) == 1:
+            store.update('questions', {'questionId': qid}, changes=changes, remove=remove, expect=expect)
+        else:
+            store.transact(actions)
+    except storage.ConditionFailed as e:
+        if hash_actions and e.index == 1:
+            return _response(event, 409, {
+                'error': 'A question with the same content already exists', 'questionId': _hash_owner(content_hash),
             })
-            
-        except Exception as e:
-            return _response(event, 500, {'error': str(e)})
+        return _response(event, 409, {'error': 'Question was modified concurrently; retry'})
+    _search_note(puts=[new])
+    _bump_questions_version()
+    return _response(event, 200, new)
+
+
+@_route('DELETE', '/questions/{questionId}', admin=True)
+def _delete_question(req):
+    qid = req.params['questionId']
+    old = store.get('questions', {'questionId': qid}, consistent=True)
+    if not old:
+        return _response(req.event, 404, {'error': 'Not found'})
+    actions = [{
+        'op': 'delete', 'table': 'questions', 'key': {'questionId': qid},
+        'expect': {'subjectId': old['subjectId']}, 'must_exist': True,
+    }]
+    if _hash_owner(old.get(CONTENT_HASH_ATTR)) == qid:
+        actions.append(_hash_release(old[CONTENT_HASH_ATTR], qid))
+    # The subject may already be gone (e.g. legacy data); then only delete the question
+    if store.get('subjects', {'subjectId': old['subjectId']}, fields=['subjectId']):
+        actions.append(_subject_count_update(old['subjectId'], {_difficulty_key(old): -1}))
+    try:
+        store.transact(actions)
+    except storage.ConditionFailed as e:
+        if actions[e.index]['table'] != 'subjects':
+            return _response(req.event, 409, {'error': 'Question was modified concurrently; retry'})
+        raise
+    _search_note(deletes=[qid])
+    _bump_questions_version()
+    return _response(req.event, 204, {})
+
+
+@_route('POST', '/questions/import', admin=True)
+def _import_questions_csv(req):
+    # Streaming CSV import from S3 (start with bucket/key, resume with jobId)
+    event = req.event
+    payload = _json_body(req)
+    if payload.get('jobId'):
+        job = _load_csv_import(str(payload['jobId']))
+        if not job:
+            return _response(event, 404, {'error': 'Import job not found'})
+    else:
+        bucket = payload.get('bucket') or CSV_IMPORT_BUCKET
+        key = payload.get('key')
+        if not bucket or not key:
+            return _response(event, 400, {'error': 'bucket and key are required'})
+        job = _start_csv_import({'bucket': bucket, 'key': key})
+    if job['status'] == 'running':
+        source = job['source']
+        time_left_ms = req.context.get_remaining_time_in_millis if req.context is not None else None
+        _run_csv_import(job, _open_s3_stream(source['bucket'], source['key']), time_left_ms)
+    status = _import_status(job)
+    code = {'completed': 200, 'failed': 400}.get(status['status'], 202)
+    return _response(event, code, status)
+
+
+@_route('GET', '/questions/export', admin=True)
+def _export_questions(req):
+    event = req.event
+    fmt = (req.qs.get('format') or 'ndjson').lower()
+    if fmt not in EXPORT_FORMATS:
+        return _response(event, 400, {'error': 'format must be ndjson or csv'})
+    segments = max(1, min(_int_arg(req.qs.get('segments') or EXPORT_SEGMENTS, 'segments'), EXPORT_MAX_SEGMENTS))
+    fields = [f.strip() for f in (req.qs.get('fields') or '').split(',') if f.strip()] or None
+    chunks = _export_chunks(fmt, segments, fields, req.qs.get('subjectId'))
+    if EXPORT_BUCKET:
+        key = f"exports/questions-{datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')}-{uuid.uuid4().hex[:6]}.{fmt}"
+        size = _upload_export(chunks, EXPORT_BUCKET, key, EXPORT_FORMATS[fmt])
+        url = _aws_client('s3').generate_presigned_url(
+            'get_object', Params={'Bucket': EXPORT_BUCKET, 'Key': key}, ExpiresIn=3600,
+        )
+        return _response(event, 200, {'bucket': EXPORT_BUCKET, 'key': key, 'bytes': size, 'segments': segments, 'url': url})
+    buf = bytearray()
+    for chunk in chunks:
+        buf += chunk
+        if len(buf) > EXPORT_INLINE_MAX_BYTES:
+            chunks.close()
+            return _response(event, 413, {'error': 'Export too large to return inline; set QUIZ_EXPORT_BUCKET'})
+    return _raw_response(event, 200, bytes(buf), EXPORT_FORMATS[fmt])
+
+
+@_route('GET', '/questions/search', admin=True)
+def _search_questions(req):
+    query = (req.qs.get('q') or '').strip()
+    if not query:
+        return _response(req.event, 400, {'error': 'q is required'})
+    limit = max(1, min(_int_arg(req.qs.get('limit', '20'), 'limit'), 100))
+    index = _search_index()
+    t0 = time.perf_counter()
+    ids, total = index.search(query, req.qs.get('subjectId'), limit)
+    took_ms = (time.perf_counter() - t0) * 1000
+    found = {it['questionId']: it for it in store.batch_get('questions', [{'questionId': qid} for qid in ids])}
+    _save_search_snapshot()
+    return _response(req.event, 200, {
+        'items': [found[qid] for qid in ids if qid in found],
+        'total': total,
+        'tookMs': round(took_ms, 3),
+        'index': {**index.stats(), 'source': _search['source']},
+    })
+
+
+@_route('POST', '/questions/bulk', admin=True)
+def _bulk_upload_questions(req):
+    payload = _json_body(req)
+    questions_data = payload.get('questions', [])
+    if not questions_data or not isinstance(questions_data, list):
+        return _response(req.event, 400, {'error': 'questions array is required'})
+    report = _bulk_create_questions(questions_data)
+    if report['successful']:
+        _bump_questions_version()
+    return _response(req.event, 200, report)
+
+
+def _bulk_question_ids(payload):
+    """The request's questionIds without repeats; raises ValueError."""
+    ids = payload.get('questionIds')
+    if not isinstance(ids, list) or not ids:
+        raise ValueError('questionIds array is required')
+    ids = list(dict.fromkeys(str(qid) for qid in ids))
+    if len(ids) > BULK_MAX_ITEMS:
+        raise ValueError(f'At most {BULK_MAX_ITEMS} questionIds per request')
+    return ids
+
+
+@_route('POST', '/questions/bulk-delete', admin=True)
+def _bulk_delete_questions(req):
+    try:
+        ids = _bulk_question_ids(_json_body(req))
+    except ValueError as e:
+        return _response(req.event, 400, {'error': str(e)})
+    found = _load_questions(ids, BULK_DELETE_FIELDS)
+    results, deltas = _delete_question_items(list(found.values()))
+    for qid in ids:
+        results.setdefault(qid, {'questionId': qid, 'status': 'skipped', 'reason': 'not found'})
+    report = _bulk_report(ids, results)
+    if report['successful']:
+        _apply_subject_counts(_known_subject_deltas(deltas))
+        _search_note(deletes=[qid for qid in ids if results[qid]['status'] == 'deleted'])
+        _bump_questions_version()
+    return _response(req.event, 200, report)
+
+
+@_route('POST', '/questions/bulk-move', admin=True)
+def _bulk_move_questions(req):
+    # Move questionIds, or every question of fromSubjectId, to subjectId
+    event = req.event
+    payload = _json_body(req)
+    target_id = str(payload.get('subjectId') or '')
+    subject = store.get('subjects', {'subjectId': target_id}) if target_id else None
+    if not subject or _is_meta_subject(subject):
+        return _response(event, 400, {'error': 'Invalid subjectId'})
+    if payload.get('fromSubjectId'):
+        source_id = str(payload['fromSubjectId'])
+        found = {it['questionId']: it for page in _scan_pages(1, subject_id=source_id) for it in page}
+        if len(found) > BULK_MAX_ITEMS:
+            return _response(event, 400, {'error': f'Subject has more than {BULK_MAX_ITEMS} questions; move them by questionIds'})
+        ids = list(found)
+    else:
+        try:
+            ids = _bulk_question_ids(payload)
+        except ValueError as e:
+            return _response(event, 400, {'error': str(e)})
+        found = _load_questions(ids)
+    results, deltas, moved = _move_question_items(list(found.values()), subject)
+    for qid in ids:
+        results.setdefault(qid, {'questionId': qid, 'status': 'skipped', 'reason': 'not found'})
+    report = _bulk_report(ids, results)
+    if moved:
+        _apply_subject_counts(_known_subject_deltas(deltas))
+        _search_note(puts=moved)
+        _bump_questions_version()
+    return _response(event, 200, report)
+
+
+# Quiz
+
+@_route('GET', '/quiz/pool', admin=True)
+def _quiz_pool_status(req):
+    with _quiz_pool_lock:
+        stats = dict(_quiz_pool_stats)
+        entries = {k: (len(e['items']) if e['items'] is not None else 'sampled') for k, e in _quiz_pool.items()}
+    return _response(req.event, 200, {
+        **stats,
+        'version': _questions_version['value'],
+        'entries': entries,
+        'bundle': _quiz_bundle['bundle'].stats() if _quiz_bundle['bundle'] is not None else None,
+    })
+
+
+def _subjects_with(difficulties):
+    """Ids of up to QUIZ_MAX_SUBJECTS subjects with questions of any of `difficulties`.
+
+    Sizes come from the bundle or the cached counters (a subject without
+    counters counts as 1). Past the cap, subjects are drawn at random in
+    proportion to their size, so the quiz still leans to the larger ones.
+    """
+    version = _current_questions_version()
+    current = _current_quiz_bundle(version)
+    if current is not None:
+        sizes = {sid: sum(runs[d][1] for d in difficulties if d in runs) for sid, runs in current.subjects.items()}
+    else:
+        sizes = {
+            sid: 1 if counts is None else sum(counts.get(d, 0) for d in difficulties)
+            for sid, counts in _subject_counts(version).items()
+        }
+    sizes = {sid: n for sid, n in sizes.items() if n}
+    if len(sizes) <= QUIZ_MAX_SUBJECTS:
+        return list(sizes)
+    # Weighted sampling without replacement: the largest random() ** (1 / size) win
+    return heapq.nlargest(QUIZ_MAX_SUBJECTS, sizes, key=lambda sid: random.random() ** (1.0 / sizes[sid]))
+
+
+def _progress_epoch(timestamp):
+    try:
+        return datetime.datetime.fromisoformat(timestamp[:19]).replace(tzinfo=datetime.timezone.utc).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _adaptive_history(user_id):
+    """A user's answer history, cached or read from UserProgress."""
+    with _adaptive_lock:
+        cached = _adaptive_users.get(user_id)
+        if cached is not None and time.monotonic() - cached['loadedAt'] < ADAPTIVE_HISTORY_TTL_SECONDS:
+            _adaptive_users.move_to_end(user_id)
+            return cached['history']
+    history, read, cursor = adaptive.History(), 0, None
+    while read < ADAPTIVE_HISTORY_MAX_RECORDS:
+        items, cursor = store.query('progress', 'byUserId', user_id, cursor=cursor, fields=ADAPTIVE_PROGRESS_FIELDS)
+        for it in items:
+            history.add(
+                it['questionId'], it.get('subjectId'), _difficulty_key(it), bool(it.get('isCorrect')),
+                _progress_epoch(it.get('timestamp')),
+            )
+        read += len(items)
+        if cursor is None:
+            break
+    with _adaptive_lock:
+        _adaptive_users[user_id] = {'history': history, 'loadedAt': time.monotonic()}
+        while len(_adaptive_users) > ADAPTIVE_MAX_USERS:
+            _adaptive_users.popitem(last=False)
+    return history
+
+
+def _adaptive_note(user_id, records):
+    """Apply UserProgress records just written to the user's cached history, if any."""
+    now = time.time()
+    with _adaptive_lock:
+        cached = _adaptive_users.get(user_id)
+        if cached is None:
+            return
+        for r in records:
+            cached['history'].add(r['questionId'], r['subjectId'], _difficulty_key(r), r['isCorrect'], now)
+
+
+def _answered_items(source, question_ids):
+    """The questions of `question_ids` that (still) belong to a source, in that order."""
+    sid, difficulty, items = source[:3]
+    if not question_ids:
+        return []
+    wanted = set(question_ids)
+    if isinstance(items, list):
+        found = {it['questionId']: it for it in items if it['questionId'] in wanted}
+    else:
+        # Sampled subjects, and bundles (whose records are not indexed by id)
+        keys = [{'questionId': qid} for qid in question_ids]
+        found = {
+            it['questionId']: it for it in store.batch_get('questions', keys, QUIZ_PROJECTION + ('subjectId',))
+            if (sid is None or it.get('subjectId') == sid) and (difficulty is None or _difficulty_key(it) == difficulty)
+        }
+    return [found[qid] for qid in question_ids if qid in found]
 
-    return _response(event, 404, {'error': 'Route not found', 'path': path})
+
+def _new_items(source, count, answered, known):
+    """Up to `count` random questions of a source that are not in `answered`.
+
+    `known` is how many of the source's questions the user has answered.
+    """
+    sid, difficulty, items, available = source[:4]
+    if count <= 0:
+        return []
+    if items is None:
+        # Oversample by the answered share of the subject
+        want = min(available, count + math.ceil(count * known / max(1, available - known)) + 2)
+        return [it for it in store.sample(sid, want, QUIZ_PROJECTION, difficulty) if it['questionId'] not in answered][:count]
+    if 2 * known >= len(items):
+        fresh = [it for it in items if it['questionId'] not in answered]
+        return random.sample(fresh, min(count, len(fresh)))
+    chosen, tried = [], set()
+    for _ in range(4 * count + 16):
+        i = random.randrange(len(items))
+        if i in tried:
+            continue
+        tried.add(i)
+        item = items[i]
+        if item['questionId'] not in answered:
+            chosen.append(item)
+            if len(chosen) == count:
+                break
+    return chosen
+
+
+def _adaptive_pick(task):
+    """Fetch one source's adaptive draw: (questions, how many of them were answered before).
+
+    Answered questions that are gone or moved, and new ones that come up
+    short, are made up from further down the ranking.
+    """
+    source, count, history, ranked, review, known = task
+    ids = history.ids
+    chosen = _answered_items(source, [ids[s] for s in ranked[:review]])
+    fresh = _new_items(source, count - len(chosen), history.slots, known)
+    short = count - len(chosen) - len(fresh)
+    if short > 0 and review < len(ranked):
+        chosen += _answered_items(source, [ids[s] for s in ranked[review:review + short]])
+    return chosen + fresh, len(chosen)
+
+
+@_route('GET', '/quiz')
+def _get_quiz(req):
+    # subjectId and difficulty take comma-separated lists; weights gives each
+    # subjectId's share of the questions (equal shares by default). adaptive=1
+    # draws each share by the signed-in user's answer history.
+    event = req.event
+    count = max(1, min(_int_arg(req.qs.get('count', '10'), 'count'), 50))
+    history = None
+    if (req.qs.get('adaptive') or '').lower() in ('1', 'true'):
+        user_id = _claims(event).get('sub')
+        if not USER_PROGRESS_TABLE:
+            return _response(event, 501, {'error': 'Adaptive quizzes are not configured'})
+        if not user_id:
+            return _response(event, 401, {'error': 'Adaptive quizzes need a signed-in user'})
+        history = _adaptive_history(user_id)
+    subject_ids = list(dict.fromkeys(s.strip() for s in (req.qs.get('subjectId') or '').split(',') if s.strip()))
+    if len(subject_ids) > QUIZ_MAX_SUBJECTS:
+        return _response(event, 400, {'error': f'At most {QUIZ_MAX_SUBJECTS} subjects per quiz'})
+    try:
+        difficulties = list(dict.fromkeys(
+            _normalize_difficulty(d) for d in (req.qs.get('difficulty') or '').split(',') if d.strip()
+        ))
+    except ValueError as e:
+        return _response(event, 400, {'error': str(e)})
+    weights = [1.0] * len(subject_ids)
+    if req.qs.get('weights'):
+        try:
+            weights = [float(w) for w in req.qs['weights'].split(',')]
+        except ValueError:
+            weights = None
+        if not weights or len(weights) != len(subject_ids) or not all(0 <= w < float('inf') for w in weights) \
+                or not any(weights):
+            return _response(event, 400, {'error': 'weights must be one non-negative number per subjectId'})
+    if not subject_ids:
+        # The whole bank: with a difficulty filter that is every subject, in
+        # proportion to its size (weights None)
+        subject_ids, weights = (_subjects_with(difficulties), None) if difficulties else ([None], [1.0])
+
+    sources = _quiz_sources(subject_ids, weights, difficulties)
+    shares = _allocate(count, [s[5] for s in sources], [s[3] for s in sources])
+    if history is not None:
+        # Rank every source here, then fetch the picks concurrently
+        now, ranked = time.time(), []
+        for source, n in zip(sources, shares):
+            if n:
+                slots = history.select(source[0], source[1])
+                order, review, _ = history.rank(
+                    slots, max(0, source[3] - len(slots)), n, now, max_candidates=ADAPTIVE_MAX_CANDIDATES,
+                    **ADAPTIVE_WEIGHTING,
+                )
+                ranked.append((source, n, history, order, review, len(slots)))
+        picks = iter(_fan_out(_adaptive_pick, ranked, QUIZ_FETCH_CONCURRENCY))
+    else:
+        sampled = [(source, n) for source, n in zip(sources, shares) if n and source[2] is None]
+        # Large subjects are sampled concurrently too, in `sources` order
+        picks = iter(_fan_out(
+            lambda task: store.sample(task[0][0], task[1], QUIZ_PROJECTION, task[0][1]), sampled, QUIZ_FETCH_CONCURRENCY,
+        ))
+    selected, per_subject, reviewed = [], {}, 0
+    for source, n in zip(sources, shares):
+        if not n:
+            continue
+        items = source[2]
+        if history is not None:
+            chosen, answered = next(picks)
+            reviewed += answered
+        elif items is None:
+            chosen = next(picks)
+        else:
+            chosen = items if len(items) <= n else random.sample(items, n)
+        selected.extend(chosen)
+        per_subject[source[0]] = per_subject.get(source[0], 0) + len(chosen)
+    if len(sources) > 1:
+        random.shuffle(selected)
+
+    prepared, permutations = [], []
+    for q in selected:
+        idxs = list(range(4))
+        random.shuffle(idxs)
+        shuffled = [q['options'][i] for i in idxs]
+        entry = {
+            'questionId': q['questionId'],
+            'question': q['question'],
+            'options': shuffled,
+        }
+        if not QUIZ_HIDE_ANSWERS:
+            entry['answerIndex'] = idxs.index(int(q['answerIndex']))
+        prepared.append(entry)
+        permutations.append([q['questionId'], PERMUTATION_CODES[tuple(idxs)]])
+    body = {'questions': prepared, 'total': len(prepared)}
+    if len(sources) > 1:
+        body['subjects'] = per_subject
+    if history is not None:
+        body['adaptive'] = {'review': reviewed, 'new': len(selected) - reviewed}
+    if QUIZ_TOKEN_SECRET:
+        body['token'] = _sign_quiz_token(permutations)
+    resp = _response(event, 200, body)
+    # An empty source list (no subject holds the difficulty) consulted nothing
+    if sources and all(s[4] == 'bundle' for s in sources):
+        resp['headers']['X-Quiz-Pool'] = 'bundle'
+    else:
+        resp['headers']['X-Quiz-Pool'] = 'hit' if sources and all(s[4] for s in sources) else 'miss'
+    return resp
+
+
+@_route('POST', '/quiz/grade')
+def _grade_quiz(req):
+    """Grade answers against a /quiz token: {token, answers: {questionId: index}}.
+
+    Indexes refer to the shuffled options the client was shown.
+    """
+    event = req.event
+    if not QUIZ_TOKEN_SECRET:
+        return _response(event, 501, {'error': 'Server-side grading is not configured'})
+    payload = _json_body(req)
+    try:
+        token = _verify_quiz_token(payload.get('token'))
+    except ValueError as e:
+        return _response(event, 400, {'error': str(e)})
+    answers = payload.get('answers') or {}
+    if isinstance(answers, list):
+        if not all(isinstance(a, dict) and isinstance(a.get('questionId'), str) for a in answers):
+            return _response(event, 400, {'error': 'answers must be a list of {questionId, selected} objects'})
+        answers = {a['questionId']: a.get('selected') for a in answers}
+    if not isinstance(answers, dict):
+        return _response(event, 400, {'error': 'answers must be an object of questionId -> option index'})
+
+    keys = [{'questionId': qid} for qid in dict.fromkeys(qid for qid, _ in token['q'])]
+    found = {
+        it['questionId']: it
+        for it in store.batch_get('questions', keys, ['questionId', 'answerIndex', 'options', 'subjectId', 'subjectName', 'difficulty'])
+    }
+    results, score = [], 0
+    for qid, code in token['q']:
+        question = found.get(qid)
+        if question is None:
+            results.append({'questionId': qid, 'error': 'Question no longer exists'})
+            continue
+        order = PERMUTATIONS[code]
+        correct = order.index(int(question['answerIndex']))
+        selected = answers.get(qid)
+        try:
+            selected = int(selected) if selected is not None else None
+        except (TypeError, ValueError):
+            selected = None
+        if selected is not None and not 0 <= selected <= 3:
+            selected = None
+        is_correct = selected == correct
+        score += is_correct
+        results.append({'questionId': qid, 'selected': selected, 'correctIndex': correct, 'isCorrect': is_correct})
+
+    graded = [r for r in results if 'error' not in r]
+    report = {
+        'score': score,
+        'total': len(graded),
+        'accuracy': round(score / len(graded), 4) if graded else 0.0,
+        'results': results,
+    }
+    user_id = _claims(event).get('sub')
+    if user_id and USER_PROGRESS_TABLE and graded:
+        session_id = _quiz_session_id(user_id, payload['token'])
+        if not _record_quiz_progress(user_id, session_id, token, graded, found):
+            return _response(event, 409, {'error': 'This quiz has already been graded', 'sessionId': session_id})
+        report['sessionId'] = session_id
+    return _response(event, 200, report)
+
+
+def _quiz_session_id(user_id, raw_token):
+    """The QuizSession id for one user grading one (verified) token."""
+    digest = hashlib.sha256(f'{user_id}\n{raw_token}'.encode('utf-8')).digest()
+    return str(uuid.UUID(bytes=digest[:16]))
+
+
+def _record_quiz_progress(user_id, session_id, token, graded, questions):
+    """Write one QuizSession and the UserProgress records in batches.
+
+    All ids derive from session_id, and the session (or, without a sessions
+    table, the first progress record) is put only if absent before anything
+    else is written. A replayed token therefore records nothing: returns
+    False.
+    """
+    now = _now_iso()
+    started = datetime.datetime.utcfromtimestamp(token['t']).replace(microsecond=0).isoformat() + 'Z'
+    progress = []
+    for r in graded:
+        q = questions[r['questionId']]
+        order = PERMUTATIONS[dict(token['q'])[r['questionId']]]
+        item = {
+            'id': str(uuid.uuid5(uuid.UUID(session_id), r['questionId'])),
+            '__typename': 'UserProgress',
+            'userId': user_id,
+            'subjectId': q['subjectId'],
+            'questionId': r['questionId'],
+            'sessionId': session_id,
+            'isCorrect': r['isCorrect'],
+            'selectedAnswer': q['options'][order[r['selected']]] if r['selected'] is not None else '',
+            'correctAnswer': q['options'][int(q['answerIndex'])],
+            'timestamp': now,
+            'createdAt': now,
+            'updatedAt': now,
+        }
+        if q.get('difficulty'):
+            item['difficulty'] = q['difficulty']
+        progress.append(item)
+
+    if QUIZ_SESSION_TABLE:
+        score = sum(1 for r in graded if r['isCorrect'])
+        subject_ids = {questions[r['questionId']]['subjectId'] for r in graded}
+        session = {
+            'id': session_id,
+            '__typename': 'QuizSession',
+            'userId': user_id,
+            'questionCount': len(graded),
+            'score': score,
+            'accuracy': Decimal(str(round(score / len(graded), 4))),
+            'startTime': started,
+            'endTime': now,
+            'completed': True,
+            'createdAt': now,
+            'updatedAt': now,
+        }
+        if len(subject_ids) == 1:
+            session['subjectId'] = subject_ids.pop()
+            session['subjectName'] = questions[graded[0]['questionId']].get('subjectName', '')
+        claim, rest = ('sessions', session), progress
+    else:
+        claim, rest = ('progress', progress[0]), progress[1:]
+    try:
+        store.put(*claim, if_absent=True)
+    except storage.ConditionFailed:
+        return False
+
+    failed = store.batch_write('progress', puts=rest)
+    if failed:
+        logger.warning('%d UserProgress records were not written for session %s', len(failed), session_id)
+    unwritten = {item['id'] for item in failed}
+    _adaptive_note(user_id, [item for item in progress if item['id'] not in unwritten])
+    return True
+
+
+def _emit_request_metrics(route, status, started, handler_ms, cold, context, metrics, error=None):
+    """Print one EMF record; `metrics` is None for an unsampled failed request."""
+    record = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [['Route'], ['Route', 'Start']],
+                'Metrics': [],
+            }],
+        },
+        'Route': route,
+        'Start': 'cold' if cold else 'warm',
+        'statusCode': status,
+        'requestId': getattr(context, 'aws_request_id', None),
+        'Errors': 1 if status >= 500 else 0,
+    }
+    units = {'Errors': 'Count'}
+    if error is not None:
+        record['errorType'] = type(error).__name__
+    if metrics is not None:
+        record.update(
+            Latency=(time.perf_counter() - started) * 1000,
+            HandlerTime=handler_ms,
+            sampleRate=METRICS_SAMPLE_RATE,
+            dynamodb={op: {'calls': n, 'ms': round(ms, 3), 'units': u} for op, (n, ms, u) in metrics.pop('operations').items()},
+        )
+        record.update(metrics)
+        for name in ('Latency', 'HandlerTime', 'SerializeTime', 'DynamoDBTime'):
+            record[name] = round(record[name], 3)
+        units.update(
+            Latency='Milliseconds', HandlerTime='Milliseconds', SerializeTime='Milliseconds',
+            DynamoDBTime='Milliseconds', DynamoDBCalls='Count', ReadUnits='Count', WriteUnits='Count',
+        )
+        if cold:
+            record['InitTime'] = round(_request_metrics['initMs'], 3)
+            units['InitTime'] = 'Milliseconds'
+    record['_aws']['CloudWatchMetrics'][0]['Metrics'] = [{'Name': k, 'Unit': v} for k, v in units.items()]
+    print(_json_encoder.encode(record))
+
+
+def lambda_handler(event, context):
+    started = time.perf_counter()
+    if _request_metrics['initMs'] is None:
+        _request_metrics['initMs'] = (started - _INIT_STARTED) * 1000
+    method = event.get('httpMethod', 'GET')
+    path = event.get('path', '/')
+
+    if method == 'OPTIONS':
+        return {'statusCode': 200, 'headers': _cors_headers(event), 'body': ''}
+
+    route, params = _resolve_route(method, path)
+    if route is None:
+        return _response(event, 404, {'error': 'Route not found', 'path': path})
+    # Admin routes are hidden from everyone else
+    if route['admin'] and not _require_admin(event):
+        return _response(event, 404, {'error': 'Not found'})
+    # A CORS preflight or unknown route may reach a new container first; the
+    # cold start is reported by the first request that is measured
+    cold, _request_metrics['cold'] = _request_metrics['cold'], False
+
+    body = event.get('body') or ''
+    if event.get('isBase64Encoded') and body:
+        body = base64.b64decode(body).decode('utf-8')
+    req = Request(event, context, method, path, params, event.get('queryStringParameters') or {}, body)
+    metrics = None
+    if cold or random.random() < METRICS_SAMPLE_RATE:
+        metrics = {
+            'SerializeTime': 0.0, 'DynamoDBTime': 0.0, 'DynamoDBCalls': 0,
+            'ReadUnits': 0.0, 'WriteUnits': 0.0, 'operations': {},
+        }
+    _request_metrics['current'] = metrics
+    error = None
+    handler_started = time.perf_counter()
+    try:
+        res = route['handler'](req)
+    except BadRequest as e:
+        res = _response(event, 400, {'error': str(e)})
+    except Exception as e:
+        error = e
+        logger.exception('Unhandled error in %s %s', method, route['pattern'])
+        # Details stay in the log; the caller gets the request id to quote
+        res = _response(event, 500, {
+            'error': 'Internal server error',
+            'requestId': getattr(context, 'aws_request_id', None),
+        })
+    finally:
+        _request_metrics['current'] = None
+    handler_ms = (time.perf_counter() - handler_started) * 1000
+    if metrics is not None or error is not None:
+        try:
+            _emit_request_metrics(
+                f"{method} {route['pattern']}", res['statusCode'], started, handler_ms, cold, context, metrics, error,
+            )
+        except Exception:
+            logger.exception('Failed to emit request metrics')
+    return res
 
 
 def _gen_id():
-    import time, uuid
     return f"{int(time.time()*1000)}-{uuid.uuid4().hex[:8]}"
 
 
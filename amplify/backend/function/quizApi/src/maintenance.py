@@ -0,0 +1,316 @@
+"""Offline maintenance tasks for the quiz tables.
+
+Run from this directory with AWS credentials for the target account, e.g.
+
+    python maintenance.py backfill-random-keys
+    python maintenance.py backfill-content-hashes
+    python maintenance.py backfill-subject-difficulty
+    python maintenance.py import-csv ../../../../../cyber_questions.csv
+    python maintenance.py drop-import-checkpoints --dry-run
+    python maintenance.py export --format csv --segments 8 --out questions.csv
+    python maintenance.py recompute-counters --dry-run
+    python maintenance.py build-bundle --out quiz-bundle.qzb
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import bundle
+import index
+import storage
+
+
+def backfill_random_keys(dry_run=False):
+    """Give every question without a randomKey one, so the sampler can see it."""
+    updated = 0
+    cursor = None
+    while True:
+        items, cursor = index.store.scan('questions', cursor=cursor, fields=['questionId', 'randomKey'])
+        for item in items:
+            if 'randomKey' in item:
+                continue
+            if not dry_run:
+                try:
+                    index.store.update(
+                        'questions', {'questionId': item['questionId']},
+                        changes=index._random_key_fields(), expect={'randomKey': None},
+                    )
+                except storage.ConditionFailed:
+                    continue
+            updated += 1
+        if cursor is None:
+            break
+    return {'updated': updated, 'dryRun': dry_run}
+
+
+def backfill_content_hashes(segments=index.EXPORT_SEGMENTS, dry_run=False):
+    """Set or correct contentHash on every question, rebuild the hash markers,
+    and report duplicate groups.
+
+    A hash whose marker is missing or held by a question without that content
+    is given to the oldest-id question of its group; markers of hashes no
+    question has any more are deleted.
+    """
+    fields = ['questionId', 'question', 'options', 'subjectId', index.CONTENT_HASH_ATTR]
+    groups = {}
+    updated = 0
+    for page in index._scan_pages(segments, fields):
+        for item in page:
+            content_hash = index._content_hash(item['question'], item['options'], item['subjectId'])
+            groups.setdefault(content_hash, []).append(item['questionId'])
+            if item.get(index.CONTENT_HASH_ATTR) == content_hash:
+                continue
+            if not dry_run:
+                try:
+                    index.store.update(
+                        'questions', {'questionId': item['questionId']}, changes={index.CONTENT_HASH_ATTR: content_hash},
+                    )
+                except storage.ConditionFailed:  # deleted meanwhile
+                    continue
+            updated += 1
+    owners = index._find_duplicates(list(groups))
+    puts = [
+        {index.CONTENT_HASH_ATTR: h, 'questionId': min(ids)} for h, ids in groups.items() if owners.get(h) not in ids
+    ]
+    stale, cursor = [], None
+    while True:
+        markers, cursor = index.store.scan('hashes', cursor=cursor, fields=[index.CONTENT_HASH_ATTR])
+        stale.extend(m for m in markers if m[index.CONTENT_HASH_ATTR] not in groups)
+        if cursor is None:
+            break
+    failed = index.store.batch_write('hashes', puts=puts, deletes=stale) if not dry_run else []
+    duplicates = sorted(sorted(ids) for ids in groups.values() if len(ids) > 1)
+    return {
+        'updated': updated, 'markersWritten': len(puts), 'markersDeleted': len(stale), 'markersFailed': len(failed),
+        'duplicateGroups': duplicates[:100], 'duplicateGroupCount': len(duplicates), 'dryRun': dry_run,
+    }
+
+
+def backfill_subject_difficulty(segments=index.EXPORT_SEGMENTS, dry_run=False):
+    """Set or correct the subject/difficulty key that SubjectDifficultyIndex is built on."""
+    attr = storage.SUBJECT_DIFFICULTY_ATTR
+    updated = 0
+    for page in index._scan_pages(segments, ['questionId', 'subjectId', 'difficulty', attr]):
+        for item in page:
+            value = index._subject_difficulty(item)
+            if item.get(attr) == value:
+                continue
+            if not dry_run:
+                try:
+                    # Only while subject and difficulty are still what was read
+                    index.store.update(
+                        'questions', {'questionId': item['questionId']}, changes={attr: value},
+                        expect={'subjectId': item['subjectId'], 'difficulty': item.get('difficulty') or None},
+                    )
+                except storage.ConditionFailed:  # changed or deleted meanwhile
+                    continue
+            updated += 1
+    return {'updated': updated, 'dryRun': dry_run}
+
+
+def import_csv(path, job_id=None):
+    """Import a local CSV file through the same chunked, checkpointed pipeline as
+    POST /questions/import. Re-running with the printed jobId resumes it."""
+    job = index._load_csv_import(job_id) if job_id else None
+    if job is None:
+        job = index._start_csv_import({'path': os.path.abspath(path)}, job_id)
+
+    def open_stream(offset):
+        f = open(path, 'rb')
+        f.seek(offset)
+        return f
+
+    if job['status'] == 'running':
+        index._run_csv_import(job, open_stream)
+    return index._import_status(job)
+
+
+def drop_import_checkpoints(dry_run=False):
+    """Delete CSV import checkpoints of finished or abandoned jobs from the subjects table.
+
+    Jobs delete their own checkpoint when they finish; this clears the ones
+    left by earlier releases and by jobs that were never resumed.
+    """
+    prefix = index.META_PREFIX + 'import#'
+    now = time.time()
+    dropped = kept = 0
+    cursor = None
+    while True:
+        items, cursor = index.store.scan(
+            'subjects', cursor=cursor, fields=['subjectId', 'status', 'updatedAt', index.CSV_IMPORT_TTL_ATTR],
+        )
+        for item in items:
+            if not item['subjectId'].startswith(prefix):
+                continue
+            # Checkpoints from before expiresAt expire CSV_IMPORT_TTL_SECONDS after their last save
+            expires = item.get(index.CSV_IMPORT_TTL_ATTR) or (
+                index._progress_epoch(item.get('updatedAt')) + index.CSV_IMPORT_TTL_SECONDS
+            )
+            if item.get('status') == 'running' and float(expires) > now:
+                kept += 1
+                continue
+            if not dry_run:
+                index.store.delete('subjects', {'subjectId': item['subjectId']})
+            dropped += 1
+        if not cursor:
+            break
+    return {'dropped': dropped, 'kept': kept, 'dryRun': dry_run}
+
+
+def export(fmt='ndjson', segments=index.EXPORT_SEGMENTS, fields=None, subject_id=None, out=None):
+    """Write the question bank as NDJSON or CSV (cyber_questions.csv columns)."""
+    stream = open(out, 'wb') if out else sys.stdout.buffer
+    try:
+        for chunk in index._export_chunks(fmt, segments, fields, subject_id):
+            stream.write(chunk)
+    finally:
+        if out:
+            stream.close()
+        else:
+            stream.flush()
+
+
+def recompute_counters(segments=index.EXPORT_SEGMENTS, dry_run=False):
+    """Rebuild every subject's question counters from the questions table.
+
+    Writes made while this runs can be counted twice or missed; run it again
+    if the bank was being edited.
+    """
+    counts = {}
+    for page in index._scan_pages(segments, ['subjectId', 'difficulty']):
+        for item in page:
+            by_difficulty = counts.setdefault(item['subjectId'], {})
+            key = index._difficulty_key(item)
+            by_difficulty[key] = by_difficulty.get(key, 0) + 1
+
+    changed = []
+    cursor = None
+    while True:
+        subjects, cursor = index.store.scan('subjects', cursor=cursor)
+        for subject in subjects:
+            if index._is_meta_subject(subject):
+                continue
+            sid = subject['subjectId']
+            want = counts.get(sid, {})
+            have = {
+                k[len(index.COUNT_ATTR_PREFIX):]: v
+                for k, v in subject.items() if k.startswith(index.COUNT_ATTR_PREFIX) and v
+            }
+            if subject.get(index.COUNT_ATTR) == sum(want.values()) and have == want:
+                continue
+            changed.append({'subjectId': sid, 'was': subject.get(index.COUNT_ATTR), 'now': sum(want.values())})
+            if dry_run:
+                continue
+            changes = {index.COUNT_ATTR: sum(want.values())}
+            changes.update((index.COUNT_ATTR_PREFIX + difficulty, n) for difficulty, n in sorted(want.items()))
+            index.store.update(
+                'subjects', {'subjectId': sid},
+                changes=changes,
+                remove=[index.COUNT_ATTR_PREFIX + difficulty for difficulty in sorted(set(have) - set(want))],
+            )
+        if cursor is None:
+            break
+    orphaned = sorted(set(counts) - _subject_ids())
+    return {'changed': changed, 'orphanedSubjectIds': orphaned, 'dryRun': dry_run}
+
+
+def build_bundle(out=None, segments=index.EXPORT_SEGMENTS, attempts=3):
+    """Compile the question bank into a /quiz bundle for the current version marker.
+
+    `out` defaults to the first of QUIZ_BUNDLE_PATHS. The scan is retried when the marker moves while it runs, so a bundle
+    never claims a version whose writes it is missing.
+    """
+    out = out or next((p for p in index.QUIZ_BUNDLE_PATHS if p), None)
+    if not out:
+        raise ValueError('No bundle path: pass out or set QUIZ_BUNDLE_PATHS')
+    fields = index.QUIZ_PROJECTION + ('subjectId',)
+    for _ in range(attempts):
+        version = _questions_version()
+        records = []
+        for page in index._scan_pages(segments, fields):
+            for item in page:
+                data = index._json_encoder.encode({k: item[k] for k in index.QUIZ_PROJECTION if k in item})
+                records.append((item['subjectId'], index._difficulty_key(item), data.encode('utf-8')))
+        if _questions_version() == version:
+            bundle.write(out, version, records)
+            return {'path': out, 'version': version, 'questions': len(records), 'bytes': os.path.getsize(out)}
+    raise RuntimeError('The question bank kept changing during the build; try again')
+
+
+def _questions_version():
+    item = index.store.get('subjects', index.QUESTIONS_VERSION_KEY, fields=['version'], consistent=True) or {}
+    return int(item.get('version', 0))
+
+
+def _subject_ids():
+    ids = set()
+    cursor = None
+    while True:
+        items, cursor = index.store.scan('subjects', cursor=cursor, fields=['subjectId'])
+        ids.update(i['subjectId'] for i in items)
+        if cursor is None:
+            return ids
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('backfill-random-keys', help='set randomKey/randomShard on questions missing them')
+    p.add_argument('--dry-run', action='store_true')
+
+    p = sub.add_parser('backfill-content-hashes', help='set contentHash and hash markers, and list duplicate groups')
+    p.add_argument('--segments', type=int, default=index.EXPORT_SEGMENTS)
+    p.add_argument('--dry-run', action='store_true')
+
+    p = sub.add_parser('backfill-subject-difficulty', help='set subjectDifficulty on questions for SubjectDifficultyIndex')
+    p.add_argument('--segments', type=int, default=index.EXPORT_SEGMENTS)
+    p.add_argument('--dry-run', action='store_true')
+
+    p = sub.add_parser('import-csv', help='import questions from a CSV file in cyber_questions.csv layout')
+    p.add_argument('path')
+    p.add_argument('--job-id', help='resume (or name) an import job')
+
+    p = sub.add_parser('drop-import-checkpoints', help='delete checkpoints of finished or abandoned CSV imports')
+    p.add_argument('--dry-run', action='store_true')
+
+    p = sub.add_parser('export', help='export all questions with a parallel scan')
+    p.add_argument('--format', choices=sorted(index.EXPORT_FORMATS), default='ndjson')
+    p.add_argument('--segments', type=int, default=index.EXPORT_SEGMENTS)
+    p.add_argument('--fields', help='comma-separated attributes to include (ndjson only)')
+    p.add_argument('--subject-id')
+    p.add_argument('--out', help='output file (default: stdout)')
+
+    p = sub.add_parser('recompute-counters', help='rebuild subject question counters from the questions table')
+    p.add_argument('--segments', type=int, default=index.EXPORT_SEGMENTS)
+    p.add_argument('--dry-run', action='store_true')
+
+    p = sub.add_parser('build-bundle', help='compile the question bank into a bundle that serves /quiz')
+    p.add_argument('--out', help='default: the first of QUIZ_BUNDLE_PATHS')
+    p.add_argument('--segments', type=int, default=index.EXPORT_SEGMENTS)
+
+    args = parser.parse_args(argv)
+    if args.command == 'backfill-random-keys':
+        print(backfill_random_keys(dry_run=args.dry_run))
+    elif args.command == 'backfill-content-hashes':
+        print(json.dumps(backfill_content_hashes(args.segments, args.dry_run)))
+    elif args.command == 'backfill-subject-difficulty':
+        print(json.dumps(backfill_subject_difficulty(args.segments, args.dry_run)))
+    elif args.command == 'import-csv':
+        print(json.dumps(import_csv(args.path, args.job_id)))
+    elif args.command == 'drop-import-checkpoints':
+        print(json.dumps(drop_import_checkpoints(args.dry_run)))
+    elif args.command == 'export':
+        fields = [f.strip() for f in args.fields.split(',')] if args.fields else None
+        export(args.format, args.segments, fields, args.subject_id, args.out)
+    elif args.command == 'recompute-counters':
+        print(json.dumps(recompute_counters(args.segments, args.dry_run)))
+    elif args.command == 'build-bundle':
+        print(json.dumps(build_bundle(args.out, args.segments)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,245 @@
+"""In-memory inverted index for admin question search.
+
+Questions are numbered with dense slots in insertion order. Each term of
+their question, options, tags and subjectName maps to an array of slots, so
+postings stay sorted and compact (4 bytes per entry). Updating a question
+retires its old slot and appends a new one; retired slots are masked out at
+query time and squeezed out by compact() once they pile up.
+
+Queries are evaluated on bitmaps (Python ints with one bit per slot), so
+AND/OR run in C over N/64 words whatever the postings sizes. Bitmaps of
+frequent terms and of subjects are cached and extended as slots are added.
+
+Query terms match as prefixes (two characters or more) and all of them must
+match. Questions matching every term exactly rank first, then the most
+recently indexed (i.e. written) first.
+"""
+import bisect
+import marshal
+import os
+import re
+from array import array
+
+TEXT_FIELDS = ('question', 'options', 'tags', 'subjectName')
+MIN_PREFIX = 2
+# A prefix expands to at most this many terms (alphabetically first)
+MAX_EXPANSIONS = 2048
+# Terms with at least this many postings keep a cached bitmap
+BITMAP_CACHE_MIN = 1024
+
+SNAPSHOT_FORMAT = 1
+
+_TOKEN = re.compile(r'\w+')
+
+try:
+    _popcount = int.bit_count
+except AttributeError:  # Python < 3.10
+    def _popcount(bits):
+        return bin(bits).count('1')
+
+
+def tokenize(text):
+    return _TOKEN.findall(text.casefold())
+
+
+def document_terms(item):
+    parts = []
+    for field in TEXT_FIELDS:
+        value = item.get(field)
+        if isinstance(value, str):
+            parts.append(value)
+        elif value:
+            parts.extend(str(v) for v in value)
+    return set(tokenize(' '.join(parts)))
+
+
+def _bitmap(slot_lists, size):
+    buf = bytearray((size >> 3) + 1)
+    for slots in slot_lists:
+        for s in slots:
+            buf[s >> 3] |= 1 << (s & 7)
+    return int.from_bytes(buf, 'little')
+
+
+def _newest(bits, limit, out):
+    while bits and len(out) < limit:
+        top = bits.bit_length() - 1
+        out.append(top)
+        bits ^= 1 << top
+
+
+class SearchIndex:
+
+    def __init__(self, version=None):
+        self.version = version
+        self.ids = []  # slot -> questionId, None once retired
+        self.slots = {}  # questionId -> live slot
+        self.subjects = array('I')  # slot -> subject code
+        self.subject_codes = {}  # subjectId -> code
+        self.postings = {}  # term -> array('I') of slots, ascending
+        self.retired = 0
+        self._terms = None  # sorted terms for prefix lookups, rebuilt lazily
+        self._cache = {}  # term, ('subject', code) or 'live' -> (bitmap, slots covered)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def add(self, item):
+        """Index a question, replacing any earlier version of it."""
+        qid = item['questionId']
+        self.remove(qid)
+        slot = len(self.ids)
+        self.ids.append(qid)
+        self.slots[qid] = slot
+        self.subjects.append(self.subject_codes.setdefault(item.get('subjectId'), len(self.subject_codes)))
+        for term in document_terms(item):
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = array('I')
+                self._terms = None
+            postings.append(slot)
+
+    def remove(self, question_id):
+        slot = self.slots.pop(question_id, None)
+        if slot is None:
+            return
+        self.ids[slot] = None
+        self.retired += 1
+        live = self._cache.get('live')
+        if live is not None and slot < live[1]:
+            self._cache['live'] = (live[0] & ~(1 << slot), live[1])
+        if self.retired > max(1000, len(self.ids) // 4):
+            self.compact()
+
+    def compact(self):
+        """Renumber live slots densely and drop retired ones from the postings."""
+        remap = array('I', [0]) * len(self.ids)
+        ids, subjects = [], array('I')
+        for slot, qid in enumerate(self.ids):
+            if qid is not None:
+                remap[slot] = len(ids)
+                ids.append(qid)
+                subjects.append(self.subjects[slot])
+        postings = {}
+        for term, slots in self.postings.items():
+            live = array('I', [remap[s] for s in slots if self.ids[s] is not None])
+            if live:
+                postings[term] = live
+        self.ids, self.subjects, self.postings = ids, subjects, postings
+        self.slots = {qid: slot for slot, qid in enumerate(ids)}
+        self.retired = 0
+        self._terms = None
+        self._cache = {}
+
+    def _cached(self, key, new_slots):
+        """Bitmap for `key`, extended with the slots added since it was cached."""
+        size = len(self.ids)
+        bits, covered = self._cache.get(key, (0, 0))
+        if covered < size:
+            bits |= _bitmap([new_slots(covered)], size)
+            self._cache[key] = (bits, size)
+        return bits
+
+    def _term_bits(self, terms):
+        size = len(self.ids)
+        bits, small = 0, []
+        for term in terms:
+            postings = self.postings[term]
+            if len(postings) < BITMAP_CACHE_MIN:
+                small.append(postings)
+            else:
+                bits |= self._cached(term, lambda start, p=postings: p[bisect.bisect_left(p, start):])
+        return bits | _bitmap(small, size) if small else bits
+
+    def _live_bits(self):
+        ids = self.ids
+        return self._cached('live', lambda start: (s for s in range(start, len(ids)) if ids[s] is not None))
+
+    def _subject_bits(self, code):
+        subjects = self.subjects
+        return self._cached(('subject', code), lambda start: (
+            s for s in range(start, len(subjects)) if subjects[s] == code
+        ))
+
+    def _expand(self, token):
+        if len(token) < MIN_PREFIX:
+            return [token] if token in self.postings else []
+        if self._terms is None:
+            self._terms = sorted(self.postings)
+        terms = []
+        i = bisect.bisect_left(self._terms, token)
+        while i < len(self._terms) and self._terms[i].startswith(token) and len(terms) < MAX_EXPANSIONS:
+            terms.append(self._terms[i])
+            i += 1
+        return terms
+
+    def search(self, query, subject_id=None, limit=20):
+        """Return ([questionId], total matches) for a free-text query."""
+        tokens = list(dict.fromkeys(tokenize(query)))
+        subject = self.subject_codes.get(subject_id) if subject_id else None
+        if not tokens or (subject_id and subject is None):
+            return [], 0
+        expansions = [self._expand(t) for t in tokens]
+        if not all(expansions):
+            return [], 0
+        # Rarest first, so an empty intersection stops early
+        expansions.sort(key=lambda terms: sum(len(self.postings[t]) for t in terms))
+        matches = self._live_bits()
+        if subject is not None:
+            matches &= self._subject_bits(subject)
+        for terms in expansions:
+            matches &= self._term_bits(terms)
+            if not matches:
+                return [], 0
+
+        exact = matches
+        for token in tokens:
+            exact &= self._term_bits([token]) if token in self.postings else 0
+        top = []
+        _newest(exact, limit, top)
+        _newest(matches & ~exact, limit, top)
+        return [self.ids[s] for s in top], _popcount(matches)
+
+    def stats(self):
+        return {
+            'version': self.version,
+            'documents': len(self.slots),
+            'retired': self.retired,
+            'terms': len(self.postings),
+            'cachedBitmaps': len(self._cache),
+        }
+
+    def save(self, path):
+        """Write a snapshot atomically (temp file + rename)."""
+        if self.retired:
+            self.compact()
+        subject_ids = sorted(self.subject_codes, key=self.subject_codes.get)
+        data = (
+            SNAPSHOT_FORMAT, self.version, self.ids, subject_ids, self.subjects.tobytes(),
+            list(self.postings), [p.tobytes() for p in self.postings.values()],
+        )
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            marshal.dump(data, f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read a snapshot written by save(); None if missing or unreadable."""
+        try:
+            with open(path, 'rb') as f:
+                data = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        if not isinstance(data, tuple) or len(data) != 7 or data[0] != SNAPSHOT_FORMAT:
+            return None
+        _, version, ids, subject_ids, subjects, terms, postings = data
+        index = cls(version)
+        index.ids = ids
+        index.slots = {qid: slot for slot, qid in enumerate(ids)}
+        index.subjects.frombytes(subjects)
+        index.subject_codes = {sid: code for code, sid in enumerate(subject_ids)}
+        for term, raw in zip(terms, postings):
+            slots = index.postings[term] = array('I')
+            slots.frombytes(raw)
+        return index
@@ -0,0 +1,402 @@
+"""Storage backends for the quiz API.
+
+index.py reads and writes its tables only through the methods of `Storage`,
+so the same handlers run on DynamoDB (storage_dynamodb.DynamoStorage, the
+default) or on a single SQLite file (SqliteStorage, selected with
+QUIZ_STORAGE=sqlite:/path/to/quiz.db) on self-hosted nodes and in load tests.
+
+Tables are addressed by logical name (see KEYS); keys and items are plain
+dicts. Writes that take `expect` check it first: it maps attribute ->
+required value, where None means the attribute must be absent and a tuple
+means any one of its values. A failed check raises ConditionFailed.
+"""
+import abc
+import json
+import os
+import random
+import tempfile
+import threading
+import weakref
+from decimal import Decimal
+
+# Logical table -> primary key attribute
+KEYS = {
+    'questions': 'questionId',
+    'subjects': 'subjectId',
+    'progress': 'id',
+    'sessions': 'id',
+    'hashes': 'contentHash',
+}
+
+# Logical table -> {index name: partition key attribute} for query()
+INDEXES = {
+    'questions': {
+        'SubjectIndex': 'subjectId',
+        'SubjectDifficultyIndex': 'subjectDifficulty',
+    },
+    'subjects': {'SubjectNameIndex': 'subjectName'},
+    'progress': {'byUserId': 'userId'},
+}
+
+# sample() reads runs of questions ordered by this attribute, starting at
+# random pivots. Writers give every question a random integer in [0, 2**52).
+RANDOM_KEY_ATTR = 'randomKey'
+RANDOM_KEY_BITS = 52
+SAMPLE_PIVOTS = 4
+
+# Questions also carry '<subjectId>#<difficulty>' (NO_DIFFICULTY when they
+# have none), so one subject's questions of one difficulty are a single
+# index lookup, for query() and for sample().
+SUBJECT_DIFFICULTY_ATTR = 'subjectDifficulty'
+NO_DIFFICULTY = 'UNSPECIFIED'
+
+
+def subject_difficulty(subject_id, difficulty):
+    return f'{subject_id}#{difficulty or NO_DIFFICULTY}'
+
+
+class ConditionFailed(Exception):
+    """A conditional write found the item in another state than expected.
+
+    For transact(), `index` is the position of the first failing action.
+    """
+
+    def __init__(self, index=0):
+        super().__init__('The conditional request failed')
+        self.index = index
+
+
+class Storage(abc.ABC):
+    """The data access interface used by the handlers."""
+
+    def connect(self):
+        """Set up shared connections before the first concurrent use."""
+
+    @abc.abstractmethod
+    def get(self, table, key, fields=None, consistent=False):
+        """Return the item (only `fields` if given) or None."""
+
+    @abc.abstractmethod
+    def put(self, table, item, if_absent=False, expect=None):
+        """Write a whole item; with if_absent only when its key is new."""
+
+    @abc.abstractmethod
+    def update(self, table, key, changes=None, remove=(), add=None, expect=None, must_exist=True):
+        """Set `changes`, drop `remove` and add the numeric `add` deltas.
+
+        Creates the item when must_exist is False. Returns the new item.
+        """
+
+    @abc.abstractmethod
+    def delete(self, table, key, expect=None, must_exist=False):
+        """Remove the item; with must_exist only if it is there."""
+
+    @abc.abstractmethod
+    def query(self, table, index, value, limit=None, cursor=None, fields=None):
+        """Items whose index attribute equals value, a page at a time.
+
+        Returns (items, cursor); pass the cursor back for the next page.
+        It is None after the last page and always JSON-serialisable.
+        """
+
+    @abc.abstractmethod
+    def scan(self, table, limit=None, cursor=None, fields=None, segment=0, segments=1):
+        """Every item, a page at a time, as (items, cursor).
+
+        With segments > 1 only the segment-th of `segments` disjoint parts is
+        read, so the parts can be scanned in parallel.
+        """
+
+    @abc.abstractmethod
+    def batch_get(self, table, keys, fields=None, consistent=False):
+        """Items for the keys that exist, in no particular order."""
+
+    @abc.abstractmethod
+    def batch_write(self, table, puts=(), deletes=()):
+        """Unconditional puts and deletes; returns the items/keys not written."""
+
+    @abc.abstractmethod
+    def sample(self, subject_id, count, fields=None, difficulty=None):
+        """About `count` random questions of a subject (or the whole bank).
+
+        With difficulty, only the subject's questions of that difficulty.
+        """
+
+    @abc.abstractmethod
+    def transact(self, actions):
+        """Apply all actions or none of them.
+
+        Each action is a dict with 'op' ('put', 'update' or 'delete'),
+        'table' and the keyword arguments of the method of that name.
+        """
+
+
+def _matches(item, if_absent=False, must_exist=False, expect=None):
+    if if_absent and item is not None:
+        return False
+    if must_exist and item is None:
+        return False
+    for attr, want in (expect or {}).items():
+        have = (item or {}).get(attr)
+        if have not in (want if isinstance(want, tuple) else (want,)):
+            return False
+    return True
+
+
+def _project(item, fields):
+    if not fields:
+        return item
+    return {f: item[f] for f in fields if f in item}
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f'Object of type {type(value).__name__} cannot be stored')
+
+
+_encoder = json.JSONEncoder(default=_json_default, ensure_ascii=False, separators=(',', ':'))
+
+
+def _remove_database(path):
+    for name in (path, f'{path}-wal', f'{path}-shm'):
+        try:
+            os.remove(name)
+        except OSError:
+            pass
+
+
+class SqliteStorage(Storage):
+    """Storage in one SQLite file.
+
+    Each table keeps the item as JSON next to its key and the attributes that
+    are queried on (COLUMNS), which have real indexes: query() and sample()
+    are single index range scans. Connections are per thread; the database
+    runs in WAL mode so readers never wait for the (serialised) writers.
+    """
+
+    # Logical table -> {attribute: indexed column}
+    COLUMNS = {
+        'questions': {
+            'subjectId': 'subject_id',
+            RANDOM_KEY_ATTR: 'random_key',
+            SUBJECT_DIFFICULTY_ATTR: 'subject_difficulty',
+        },
+        'subjects': {'subjectName': 'subject_name'},
+        'progress': {'userId': 'user_id'},
+        'sessions': {},
+        'hashes': {},
+    }
+    SQL_INDEXES = {
+        'questions': [
+            ('subject_id', 'pk'), ('subject_id', 'random_key'), ('random_key',),
+            ('subject_difficulty', 'random_key'),
+        ],
+        'subjects': [('subject_name', 'pk')],
+        'progress': [('user_id', 'pk')],
+    }
+    BATCH_GET_MAX = 500
+
+    def __init__(self, path):
+        import sqlite3
+        self._sqlite3 = sqlite3
+        self._local = threading.local()
+        if path == ':memory:':
+            # A private temp file, removed with the instance. A shared-cache
+            # memory database would answer concurrent writers with
+            # SQLITE_LOCKED, which the busy timeout does not retry.
+            handle, path = tempfile.mkstemp(prefix='quizapi-', suffix='.db')
+            os.close(handle)
+            weakref.finalize(self, _remove_database, path)
+        self._path = path
+        self._keep = self._conn()
+        with self._keep:
+            for table, columns in self.COLUMNS.items():
+                types = {c: 'INTEGER' if c == 'random_key' else 'TEXT' for c in columns.values()}
+                cols = ''.join(f', {c} {t}' for c, t in types.items())
+                self._keep.execute(f'CREATE TABLE IF NOT EXISTS {table} (pk TEXT PRIMARY KEY{cols}, doc TEXT NOT NULL)')
+                # Files from before a column was added get it empty; backfills fill it in
+                have = {row[1] for row in self._keep.execute(f'PRAGMA table_info({table})')}
+                for column in types.keys() - have:
+                    self._keep.execute(f'ALTER TABLE {table} ADD COLUMN {column} {types[column]}')
+                for index in self.SQL_INDEXES.get(table, ()):
+                    self._keep.execute(
+                        f'CREATE INDEX IF NOT EXISTS {table}_{"_".join(index)} ON {table} ({", ".join(index)})'
+                    )
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._sqlite3.connect(self._path, timeout=30, isolation_level=None,
+                                         check_same_thread=False, cached_statements=256)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA temp_store=MEMORY')
+            conn.execute('PRAGMA mmap_size=268435456')
+            self._local.conn = conn
+        return conn
+
+    # -- rows --
+
+    def _row(self, table, item):
+        columns = self.COLUMNS[table]
+        values = [str(item[KEYS[table]])]
+        for attr in columns:
+            value = item.get(attr)
+            values.append(int(value) if attr == RANDOM_KEY_ATTR and value is not None else value)
+        values.append(_encoder.encode(item))
+        return values
+
+    def _upsert_sql(self, table):
+        cols = ['pk', *self.COLUMNS[table].values(), 'doc']
+        return f'INSERT OR REPLACE INTO {table} ({", ".join(cols)}) VALUES ({", ".join("?" * len(cols))})'
+
+    def _load(self, conn, table, key):
+        row = conn.execute(f'SELECT doc FROM {table} WHERE pk = ?', (str(key[KEYS[table]]),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _write(self, conn, table, key, item):
+        if item is None:
+            conn.execute(f'DELETE FROM {table} WHERE pk = ?', (str(key[KEYS[table]]),))
+        else:
+            conn.execute(self._upsert_sql(table), self._row(table, item))
+
+    def _apply(self, conn, action):
+        """Check and apply one write inside an open transaction; False if its check fails."""
+        op, table = action['op'], action['table']
+        key = action['item'] if op == 'put' else action['key']
+        key = {KEYS[table]: key[KEYS[table]]}
+        old = self._load(conn, table, key)
+        if op == 'put':
+            if not _matches(old, action.get('if_absent'), False, action.get('expect')):
+                return False
+            new = dict(action['item'])
+        elif op == 'update':
+            if not _matches(old, False, action.get('must_exist', True), action.get('expect')):
+                return False
+            new = dict(old or key)
+            new.update(action.get('changes') or {})
+            for attr in action.get('remove') or ():
+                new.pop(attr, None)
+            for attr, delta in (action.get('add') or {}).items():
+                new[attr] = new.get(attr, 0) + delta
+        else:
+            if not _matches(old, False, action.get('must_exist', False), action.get('expect')):
+                return False
+            new = None
+        self._write(conn, table, key, new)
+        action['result'] = new
+        return True
+
+    def _run(self, actions):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for i, action in enumerate(actions):
+                if not self._apply(conn, action):
+                    raise ConditionFailed(i)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _page(self, table, where, params, limit, cursor, fields):
+        sql = f'SELECT pk, doc FROM {table} WHERE {where}'
+        if cursor:
+            sql += ' AND pk > ?'
+            params = [*params, str(cursor[KEYS[table]])]
+        sql += ' ORDER BY pk LIMIT ?'
+        rows = self._conn().execute(sql, [*params, limit if limit else -1]).fetchall()
+        items = [_project(json.loads(doc), fields) for _, doc in rows]
+        next_cursor = {KEYS[table]: rows[-1][0]} if limit and len(rows) == limit else None
+        return items, next_cursor
+
+    # -- Storage --
+
+    def get(self, table, key, fields=None, consistent=False):
+        item = self._load(self._conn(), table, key)
+        return _project(item, fields) if item is not None else None
+
+    def put(self, table, item, if_absent=False, expect=None):
+        if not if_absent and not expect:
+            self._conn().execute(self._upsert_sql(table), self._row(table, item))
+            return
+        self._run([{'op': 'put', 'table': table, 'item': item, 'if_absent': if_absent, 'expect': expect}])
+
+    def update(self, table, key, changes=None, remove=(), add=None, expect=None, must_exist=True):
+        action = {'op': 'update', 'table': table, 'key': key, 'changes': changes, 'remove': remove,
+                  'add': add, 'expect': expect, 'must_exist': must_exist}
+        self._run([action])
+        return action['result']
+
+    def delete(self, table, key, expect=None, must_exist=False):
+        self._run([{'op': 'delete', 'table': table, 'key': key, 'expect': expect, 'must_exist': must_exist}])
+
+    def query(self, table, index, value, limit=None, cursor=None, fields=None):
+        column = self.COLUMNS[table][INDEXES[table][index]]
+        return self._page(table, f'{column} = ?', [value], limit, cursor, fields)
+
+    def scan(self, table, limit=None, cursor=None, fields=None, segment=0, segments=1):
+        if segments > 1:
+            return self._page(table, 'rowid % ? = ?', [segments, segment], limit, cursor, fields)
+        return self._page(table, '1', [], limit, cursor, fields)
+
+    def batch_get(self, table, keys, fields=None, consistent=False):
+        items = []
+        ids = [str(k[KEYS[table]]) for k in keys]
+        for start in range(0, len(ids), self.BATCH_GET_MAX):
+            chunk = ids[start:start + self.BATCH_GET_MAX]
+            rows = self._conn().execute(
+                f'SELECT doc FROM {table} WHERE pk IN ({", ".join("?" * len(chunk))})', chunk,
+            ).fetchall()
+            items.extend(_project(json.loads(doc), fields) for doc, in rows)
+        return items
+
+    def batch_write(self, table, puts=(), deletes=()):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(self._upsert_sql(table), [self._row(table, item) for item in puts])
+            conn.executemany(f'DELETE FROM {table} WHERE pk = ?', [(str(k[KEYS[table]]),) for k in deletes])
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return []
+
+    def sample(self, subject_id, count, fields=None, difficulty=None):
+        conn = self._conn()
+        if difficulty:
+            where, params = 'subject_difficulty = ? AND ', [subject_difficulty(subject_id, difficulty)]
+        elif subject_id:
+            where, params = 'subject_id = ? AND ', [subject_id]
+        else:
+            where, params = '', []
+        pivots = max(1, min(count, SAMPLE_PIVOTS))
+        per_pivot = -(-count // pivots)
+        picked = {}
+        for _ in range(pivots):
+            pivot = random.getrandbits(RANDOM_KEY_BITS)
+            want = min(per_pivot, count - len(picked))
+            # Read forwards from the pivot, wrapping around to the lowest keys,
+            # past the rows earlier runs already took
+            for op in ('>=', '<'):
+                if want <= 0:
+                    break
+                seen = f'pk NOT IN ({", ".join("?" * len(picked))}) AND ' if picked else ''
+                rows = conn.execute(
+                    f'SELECT pk, doc FROM questions WHERE {where}{seen}random_key {op} ? ORDER BY random_key LIMIT ?',
+                    [*params, *picked, pivot, want],
+                ).fetchall()
+                for pk, doc in rows:
+                    if pk not in picked:
+                        picked[pk] = _project(json.loads(doc), fields)
+                        want -= 1
+        selected = list(picked.values())[:count]
+        random.shuffle(selected)
+        return selected
+
+    def transact(self, actions):
+        self._run([dict(a) for a in actions])
@@ -0,0 +1,432 @@
+"""storage.Storage on DynamoDB (QUIZ_STORAGE=dynamodb, the default).
+
+Talks to the low-level client (see the note above DDB_MAX_POOL_CONNECTIONS
+in index.py) with minimal attribute-value serialisation. The client itself
+is the caller's: index.py passes in the function that makes each call, so
+request metrics see every one of them.
+"""
+import random
+import time
+from decimal import Decimal
+
+import storage
+
+
+# Minimal attribute-value (de)serialisation, in place of boto3's TypeSerializer.
+# Integral numbers come back as int, others as Decimal.
+
+def _to_av(value):
+    if isinstance(value, str):
+        return {'S': value}
+    if isinstance(value, bool):
+        return {'BOOL': value}
+    if isinstance(value, (int, Decimal)):
+        return {'N': str(value)}
+    if isinstance(value, float):
+        return {'N': repr(value)}
+    if value is None:
+        return {'NULL': True}
+    if isinstance(value, dict):
+        return {'M': {k: _to_av(v) for k, v in value.items()}}
+    if isinstance(value, (list, tuple)):
+        return {'L': [_to_av(v) for v in value]}
+    if isinstance(value, (bytes, bytearray)):
+        return {'B': bytes(value)}
+    if isinstance(value, (set, frozenset)) and value:
+        if all(isinstance(v, str) for v in value):
+            return {'SS': list(value)}
+        if all(isinstance(v, (int, Decimal)) and not isinstance(v, bool) for v in value):
+            return {'NS': [str(v) for v in value]}
+    raise TypeError(f'Unsupported DynamoDB value: {value!r}')
+
+
+def _number(raw):
+    if '.' in raw or 'e' in raw or 'E' in raw:
+        return Decimal(raw)
+    return int(raw)
+
+
+def _from_av(av):
+    (kind, value), = av.items()
+    if kind == 'S':
+        return value
+    if kind == 'N':
+        return _number(value)
+    if kind == 'M':
+        return {k: _from_av(v) for k, v in value.items()}
+    if kind == 'L':
+        return [_from_av(v) for v in value]
+    if kind == 'BOOL':
+        return value
+    if kind == 'NULL':
+        return None
+    if kind == 'SS':
+        return set(value)
+    if kind == 'NS':
+        return {_number(v) for v in value}
+    if kind == 'B':
+        return value
+    if kind == 'BS':
+        return set(value)
+    raise TypeError(f'Unsupported attribute type: {kind}')
+
+
+def _to_item(item):
+    return {k: _to_av(v) for k, v in item.items()}
+
+
+def _from_item(item):
+    return {k: _from_av(v) for k, v in item.items()}
+
+
+def _is_conditional_check_failure(error):
+    return getattr(error, 'response', {}).get('Error', {}).get('Code') == 'ConditionalCheckFailedException'
+
+
+def _cancellation_reasons(error):
+    """Per-action codes of a cancelled transaction ('None' for actions that passed)."""
+    return [r.get('Code') for r in getattr(error, 'response', {}).get('CancellationReasons', [])]
+
+
+class _Table:
+    """The subset of boto3's Table resource used here, on the low-level client.
+
+    Takes and returns plain Python values; expressions are strings.
+    """
+
+    _ITEM_PARAMS = ('Key', 'Item', 'ExclusiveStartKey')
+    _ITEM_RESULTS = ('Item', 'Attributes', 'LastEvaluatedKey')
+
+    def __init__(self, name, call):
+        self.name = name
+        self._ddb_call = call
+
+    def _call(self, operation, kwargs):
+        for param in self._ITEM_PARAMS:
+            if param in kwargs:
+                kwargs[param] = _to_item(kwargs[param])
+        if 'ExpressionAttributeValues' in kwargs:
+            kwargs['ExpressionAttributeValues'] = _to_item(kwargs['ExpressionAttributeValues'])
+        res = self._ddb_call(operation, TableName=self.name, **kwargs)
+        for field in self._ITEM_RESULTS:
+            if field in res:
+                res[field] = _from_item(res[field])
+        if 'Items' in res:
+            res['Items'] = [_from_item(i) for i in res['Items']]
+        return res
+
+    def get_item(self, **kwargs):
+        return self._call('get_item', kwargs)
+
+    def put_item(self, **kwargs):
+        return self._call('put_item', kwargs)
+
+    def update_item(self, **kwargs):
+        return self._call('update_item', kwargs)
+
+    def delete_item(self, **kwargs):
+        return self._call('delete_item', kwargs)
+
+    def query(self, **kwargs):
+        return self._call('query', kwargs)
+
+    def scan(self, **kwargs):
+        return self._call('scan', kwargs)
+
+
+class _Expression:
+    """Builds DynamoDB expressions with #name / :value placeholders."""
+
+    def __init__(self):
+        self._names = {}
+        self.values = {}
+
+    def name(self, attr):
+        alias = self._names.get(attr)
+        if alias is None:
+            alias = self._names[attr] = f'#n{len(self._names)}'
+        return alias
+
+    def value(self, value):
+        alias = f':v{len(self.values)}'
+        self.values[alias] = value
+        return alias
+
+    def projection(self, fields):
+        return ', '.join(self.name(f) for f in fields) if fields else None
+
+    def condition(self, key_attr, if_absent=False, must_exist=False, expect=None):
+        parts = []
+        if if_absent:
+            parts.append(f'attribute_not_exists({self.name(key_attr)})')
+        elif must_exist:
+            parts.append(f'attribute_exists({self.name(key_attr)})')
+        for attr, want in (expect or {}).items():
+            options = [
+                f'attribute_not_exists({self.name(attr)})' if v is None else f'{self.name(attr)} = {self.value(v)}'
+                for v in (want if isinstance(want, tuple) else (want,))
+            ]
+            parts.append(options[0] if len(options) == 1 else '(' + ' OR '.join(options) + ')')
+        return ' AND '.join(parts) or None
+
+    def update(self, changes=None, remove=(), add=None):
+        clauses = []
+        if changes:
+            clauses.append('SET ' + ', '.join(f'{self.name(k)} = {self.value(v)}' for k, v in changes.items()))
+        if remove:
+            clauses.append('REMOVE ' + ', '.join(self.name(k) for k in remove))
+        if add:
+            clauses.append('ADD ' + ', '.join(f'{self.name(k)} {self.value(v)}' for k, v in add.items()))
+        return ' '.join(clauses)
+
+    def kwargs(self, **params):
+        """The request parameters, minus unset ones, plus the placeholders."""
+        out = {k: v for k, v in params.items() if v is not None}
+        if self._names:
+            out['ExpressionAttributeNames'] = {alias: attr for attr, alias in self._names.items()}
+        if self.values:
+            out['ExpressionAttributeValues'] = self.values
+        return out
+
+
+class DynamoStorage(storage.Storage):
+    """storage.Storage on DynamoDB, through the low-level client.
+
+    `tables` maps logical table names (storage.KEYS) to DynamoDB table
+    names; a table without one raises RuntimeError when first used.
+    `call(operation, **kwargs)` makes one client call and `connect()` builds
+    the client, so the caller owns the client's configuration and metrics.
+    """
+
+    def __init__(self, tables, call, connect=None, *, batch_get_max=100,
+                 batch_write_max=25, batch_max_attempts=6, random_shards=8, sample_pivots=storage.SAMPLE_PIVOTS,
+                 sample_max_rounds=3):
+        self._table_names = dict(tables)
+        self._tables = {}
+        self._call = call
+        self._connect = connect
+        self.batch_get_max = batch_get_max
+        self.batch_write_max = batch_write_max
+        self.batch_max_attempts = batch_max_attempts
+        self.random_shards = random_shards
+        self.sample_pivots = sample_pivots
+        self.sample_max_rounds = sample_max_rounds
+
+    def _table(self, name):
+        table = self._tables.get(name)
+        if table is None:
+            table_name = self._table_names.get(name)
+            if not table_name:
+                raise RuntimeError(f'No DynamoDB table configured for {name}')
+            table = self._tables[name] = _Table(table_name, self._call)
+        return table
+
+    def connect(self):
+        if self._connect is not None:
+            self._connect()
+
+    def get(self, table, key, fields=None, consistent=False):
+        ex = _Expression()
+        res = self._table(table).get_item(**ex.kwargs(
+            Key=key,
+            ProjectionExpression=ex.projection(fields),
+            ConsistentRead=True if consistent else None,
+        ))
+        return res.get('Item')
+
+    def put(self, table, item, if_absent=False, expect=None):
+        ex = _Expression()
+        try:
+            self._table(table).put_item(**ex.kwargs(
+                Item=item,
+                ConditionExpression=ex.condition(storage.KEYS[table], if_absent=if_absent, expect=expect),
+            ))
+        except Exception as e:
+            if _is_conditional_check_failure(e):
+                raise storage.ConditionFailed() from e
+            raise
+
+    def update(self, table, key, changes=None, remove=(), add=None, expect=None, must_exist=True):
+        ex = _Expression()
+        try:
+            res = self._table(table).update_item(**ex.kwargs(
+                Key=key,
+                UpdateExpression=ex.update(changes, remove, add),
+                ConditionExpression=ex.condition(storage.KEYS[table], must_exist=must_exist, expect=expect),
+                ReturnValues='ALL_NEW',
+            ))
+        except Exception as e:
+            if _is_conditional_check_failure(e):
+                raise storage.ConditionFailed() from e
+            raise
+        return res['Attributes']
+
+    def delete(self, table, key, expect=None, must_exist=False):
+        ex = _Expression()
+        try:
+            self._table(table).delete_item(**ex.kwargs(
+                Key=key,
+                ConditionExpression=ex.condition(storage.KEYS[table], must_exist=must_exist, expect=expect),
+            ))
+        except Exception as e:
+            if _is_conditional_check_failure(e):
+                raise storage.ConditionFailed() from e
+            raise
+
+    def query(self, table, index, value, limit=None, cursor=None, fields=None):
+        ex = _Expression()
+        res = self._table(table).query(**ex.kwargs(
+            IndexName=index,
+            KeyConditionExpression=f'{ex.name(storage.INDEXES[table][index])} = {ex.value(value)}',
+            ProjectionExpression=ex.projection(fields),
+            Limit=limit,
+            ExclusiveStartKey=cursor,
+        ))
+        return res.get('Items', []), res.get('LastEvaluatedKey')
+
+    def scan(self, table, limit=None, cursor=None, fields=None, segment=0, segments=1):
+        ex = _Expression()
+        res = self._table(table).scan(**ex.kwargs(
+            ProjectionExpression=ex.projection(fields),
+            Limit=limit,
+            ExclusiveStartKey=cursor,
+            Segment=segment if segments > 1 else None,
+            TotalSegments=segments if segments > 1 else None,
+        ))
+        return res.get('Items', []), res.get('LastEvaluatedKey')
+
+    def batch_get(self, table, keys, fields=None, consistent=False):
+        """BatchGetItem in chunks, retrying unprocessed keys."""
+        table_name = self._table(table).name
+        ex = _Expression()
+        projection = ex.kwargs(ProjectionExpression=ex.projection(fields), ConsistentRead=True if consistent else None)
+        items = []
+        for start in range(0, len(keys), self.batch_get_max):
+            request = {'Keys': [_to_item(k) for k in keys[start:start + self.batch_get_max]], **projection}
+            for attempt in range(self.batch_max_attempts):
+                res = self._call('batch_get_item', RequestItems={table_name: request})
+                items.extend(_from_item(i) for i in (res.get('Responses') or {}).get(table_name, []))
+                unprocessed = (res.get('UnprocessedKeys') or {}).get(table_name)
+                if not unprocessed:
+                    break
+                request = unprocessed
+                time.sleep(random.uniform(0, min(1.0, 0.05 * 2 ** attempt)))
+            else:
+                raise RuntimeError(f'BatchGetItem left {len(request["Keys"])} keys unprocessed')
+        return items
+
+    def batch_write(self, table, puts=(), deletes=()):
+        """BatchWriteItem in chunks, retrying unprocessed items.
+
+        Returns the items and keys still unprocessed after batch_max_attempts.
+        """
+        table_name = self._table(table).name
+        key_attr = storage.KEYS[table]
+        requests = [('PutRequest', 'Item', item) for item in puts] + [('DeleteRequest', 'Key', key) for key in deletes]
+        failed = []
+        for start in range(0, len(requests), self.batch_write_max):
+            chunk = requests[start:start + self.batch_write_max]
+            originals = {str(body[key_attr]): body for _, _, body in chunk}
+            pending = [{kind: {field: _to_item(body)}} for kind, field, body in chunk]
+            for attempt in range(self.batch_max_attempts):
+                res = self._call('batch_write_item', RequestItems={table_name: pending})
+                pending = (res.get('UnprocessedItems') or {}).get(table_name, [])
+                if not pending:
+                    break
+                time.sleep(random.uniform(0, min(1.0, 0.05 * 2 ** attempt)))
+            for request in pending:
+                (body,) = next(iter(request.values())).values()
+                failed.append(originals[str(_from_av(body[key_attr]))])
+        return failed
+
+    def sample(self, subject_id, count, fields=None, difficulty=None):
+        """Pick about `count` questions with a few range queries around random pivots.
+
+        Each pivot reads a short run of the random-key index, wrapping around to
+        the start of the key space when the run hits the end, so the read cost
+        tracks `count` instead of the size of the bank. A run that overlaps an
+        earlier one reads on past the questions already picked.
+        """
+        pivots = max(1, min(count, self.sample_pivots))
+        per_pivot = -(-count // pivots)
+        picked = {}
+        for _ in range(self.sample_max_rounds):
+            for _ in range(pivots):
+                if difficulty:
+                    index_name = 'SubjectDifficultyIndex'
+                    partition = (storage.SUBJECT_DIFFICULTY_ATTR, storage.subject_difficulty(subject_id, difficulty))
+                elif subject_id:
+                    index_name, partition = 'SubjectRandomIndex', ('subjectId', subject_id)
+                else:
+                    index_name, partition = 'RandomIndex', ('randomShard', random.randrange(self.random_shards))
+                pivot = random.getrandbits(storage.RANDOM_KEY_BITS)
+                want = min(per_pivot, count - len(picked))
+                if want <= 0:
+                    break
+                for op in ('>=', '<'):
+                    start = None
+                    while want > 0:
+                        ex = _Expression()
+                        res = self._table('questions').query(**ex.kwargs(
+                            IndexName=index_name,
+                            KeyConditionExpression=(
+                                f'{ex.name(partition[0])} = {ex.value(partition[1])} '
+                                f'AND {ex.name(storage.RANDOM_KEY_ATTR)} {op} {ex.value(pivot)}'
+                            ),
+                            ProjectionExpression=ex.projection(fields),
+                            ExclusiveStartKey=start,
+                            Limit=want,
+                        ))
+                        for it in res.get('Items', []):
+                            if it['questionId'] not in picked:
+                                picked[it['questionId']] = it
+                                want -= 1
+                        start = res.get('LastEvaluatedKey')
+                        if not start:
+                            break
+                    if want <= 0:
+                        break
+            if len(picked) >= count:
+                break
+        selected = list(picked.values())[:count]
+        random.shuffle(selected)
+        return selected
+
+    def transact(self, actions):
+        """TransactWriteItems; raises ConditionFailed naming the first failed action."""
+        items = []
+        for action in actions:
+            table = self._table(action['table'])
+            key_attr = storage.KEYS[action['table']]
+            ex = _Expression()
+            if action['op'] == 'put':
+                kind, body = 'Put', ex.kwargs(
+                    Item=action['item'],
+                    ConditionExpression=ex.condition(key_attr, if_absent=action.get('if_absent'), expect=action.get('expect')),
+                )
+            elif action['op'] == 'update':
+                kind, body = 'Update', ex.kwargs(
+                    Key=action['key'],
+                    UpdateExpression=ex.update(action.get('changes'), action.get('remove') or (), action.get('add')),
+                    ConditionExpression=ex.condition(
+                        key_attr, must_exist=action.get('must_exist', True), expect=action.get('expect'),
+                    ),
+                )
+            else:
+                kind, body = 'Delete', ex.kwargs(
+                    Key=action['key'],
+                    ConditionExpression=ex.condition(
+                        key_attr, must_exist=action.get('must_exist', False), expect=action.get('expect'),
+                    ),
+                )
+            for field in ('Item', 'Key', 'ExpressionAttributeValues'):
+                if field in body:
+                    body[field] = _to_item(body[field])
+            items.append({kind: {'TableName': table.name, **body}})
+        try:
+            self._call('transact_write_items', TransactItems=items)
+        except Exception as e:
+            reasons = _cancellation_reasons(e)
+            if 'ConditionalCheckFailed' in reasons:
+                raise storage.ConditionFailed(reasons.index('ConditionalCheckFailed')) from e
+            raise
@@ -0,0 +1,36 @@
+"""Shared setup for the tests: index on a throwaway SQLite store, and events.
+
+Run from amplify/backend/function/quizApi with
+
+    python -m unittest discover tests
+"""
+import json
+import os
+import sys
+import tempfile
+
+os.environ['QUIZ_STORAGE'] = 'sqlite::memory:'
+os.environ['QUIZ_METRICS_SAMPLE_RATE'] = '0'
+# A snapshot left by an earlier run could match this run's questions version
+TEMP_DIR = tempfile.TemporaryDirectory(prefix='quizapi-tests-')
+os.environ['SEARCH_SNAPSHOT_PATH'] = os.path.join(TEMP_DIR.name, 'search.snap')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import index  # noqa: E402
+
+ADMIN = {'authorizer': {'jwt': {'claims': {'cognito:groups': 'Admin', 'sub': 'admin'}}}}
+USER = {'authorizer': {'jwt': {'claims': {'sub': 'user-1'}}}}
+
+
+def request(method, path, body=None, qs=None, context=ADMIN, headers=None):
+    """The raw lambda_handler response for an API Gateway event."""
+    return index.lambda_handler({
+        'httpMethod': method, 'path': path, 'queryStringParameters': qs, 'headers': headers or {},
+        'body': body if body is None or isinstance(body, str) else json.dumps(body), 'requestContext': context,
+    }, None)
+
+
+def call(method, path, body=None, qs=None, context=ADMIN, headers=None):
+    """(status, decoded JSON body) for an API Gateway event."""
+    res = request(method, path, body, qs, context, headers)
+    return res['statusCode'], json.loads(res['body']) if res.get('body') else None
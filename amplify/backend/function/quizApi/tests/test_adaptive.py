@@ -0,0 +1,46 @@
+"""adaptive.History ranking on the pure-Python path."""
+import random
+import unittest
+from unittest import mock
+
+import helpers  # noqa: F401
+import adaptive
+
+DAY = 86400.0
+
+
+class PythonRankTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(adaptive, 'numpy', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        random.seed(7)
+        self.now = 100 * DAY
+        self.history = adaptive.History()
+        for i in range(2000):
+            # Every tenth question is always missed
+            self.history.add(f'q{i}', 's', 'EASY', i % 10 != 0, self.now - 10 * DAY)
+
+    def test_candidate_cap_keeps_the_mix(self):
+        slots = self.history.select('s')
+        rounds, review, missed = 500, 0, 0
+        for _ in range(rounds):
+            ranked, r, new = self.history.rank(slots, 2000, 10, self.now, max_candidates=256)
+            self.assertEqual(r + new, 10)
+            self.assertTrue(set(ranked) <= set(slots))
+            review += r
+            missed += sum(1 for slot in ranked[:r] if slot % 10 == 0)
+        # Answers weigh 0.5, or 4.5 when missed: 1800 in all against 2000 new
+        # questions of weight 1, and the missed ones hold half of it
+        self.assertAlmostEqual(review / rounds, 10 * 1800 / 3800, delta=0.4)
+        self.assertAlmostEqual(missed / review, 0.5, delta=0.08)
+
+    def test_small_histories_are_ranked_whole(self):
+        slots = self.history.select('s')[:50]
+        ranked, review, _ = self.history.rank(slots, 0, 50, self.now, max_candidates=10)
+        self.assertEqual((sorted(ranked), review), (sorted(slots), 50))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+"""Bulk question delete/move and cascading subject delete, with their counters."""
+import unittest
+from unittest import mock
+
+from helpers import call
+import index
+
+
+class BulkTest(unittest.TestCase):
+
+    def _subject(self, suffix='', n=0):
+        name = f'Bulk {self._testMethodName}{suffix}'
+        sid = call('POST', '/subjects', {'subjectName': name})[1]['subjectId']
+        if not n:
+            return sid, []
+        report = call('POST', '/questions/bulk', {'questions': [
+            {'subject': name, 'question': f'{name} {i}?', 'options': ['a', 'b', 'c', 'd'], 'answerIndex': 0,
+             'difficulty': 'HARD' if i % 3 == 0 else 'EASY'}
+            for i in range(n)
+        ]})[1]
+        self.assertEqual(report['successful'], n)
+        return sid, [r['questionId'] for r in report['results']]
+
+    def _counts(self, sid):
+        subject = call('GET', f'/subjects/{sid}')[1]
+        return subject['questionCount'], subject['difficultyCounts']
+
+    def test_bulk_delete(self):
+        sid, ids = self._subject(n=6)
+        self.assertEqual(self._counts(sid), (6, {'HARD': 2, 'EASY': 4}))
+        status, report = call('POST', '/questions/bulk-delete', {'questionIds': [ids[0], ids[1], 'nope', ids[0]]})
+        self.assertEqual(status, 200)
+        self.assertEqual(
+            (report['processed'], report['successful'], report['skipped'], report['errors']), (3, 2, 1, 0),
+        )
+        self.assertEqual([r['status'] for r in report['results']], ['deleted', 'deleted', 'skipped'])
+        self.assertEqual(call('GET', f'/questions/{ids[0]}')[0], 404)
+        self.assertEqual(self._counts(sid), (4, {'HARD': 1, 'EASY': 3}))
+
+    def test_bulk_delete_reports_unprocessed_items(self):
+        sid, ids = self._subject(n=4)
+        batch_write = index.store.batch_write
+
+        def lose_one(table, puts=(), deletes=()):
+            lost = [key for key in deletes if key.get('questionId') == ids[0]]
+            batch_write(table, puts, [key for key in deletes if key not in lost])
+            return lost
+
+        with mock.patch.object(index.store, 'batch_write', side_effect=lose_one):
+            report = call('POST', '/questions/bulk-delete', {'questionIds': ids})[1]
+        self.assertEqual((report['successful'], report['errors']), (3, 1))
+        self.assertEqual(report['results'][0]['reason'], 'delete was not processed after retries')
+        self.assertEqual(self._counts(sid)[0], 1)
+        self.assertEqual(call('GET', f'/questions/{ids[0]}')[0], 200)
+
+    def test_bulk_move(self):
+        source, ids = self._subject(n=6)
+        target, _ = self._subject(' target')
+        report = call('POST', '/questions/bulk-move', {'questionIds': ids[:3] + ['nope'], 'subjectId': target})[1]
+        self.assertEqual([r['status'] for r in report['results']], ['moved', 'moved', 'moved', 'skipped'])
+        self.assertEqual(self._counts(source), (3, {'HARD': 1, 'EASY': 2}))
+        self.assertEqual(self._counts(target), (3, {'HARD': 1, 'EASY': 2}))
+        moved = call('GET', f'/questions/{ids[0]}')[1]
+        self.assertEqual((moved['subjectId'], moved['subjectName']), (target, f'Bulk {self._testMethodName} target'))
+        self.assertEqual(moved['subjectDifficulty'], index.storage.subject_difficulty(target, 'HARD'))
+
+        report = call('POST', '/questions/bulk-move', {'questionIds': ids[:1], 'subjectId': target})[1]
+        self.assertEqual(report['results'][0]['reason'], 'already in subject')
+        # Everything left in the source subject
+        report = call('POST', '/questions/bulk-move', {'fromSubjectId': source, 'subjectId': target})[1]
+        self.assertEqual((report['processed'], report['successful']), (3, 3))
+        self.assertEqual(self._counts(source), (0, {}))
+        self.assertEqual(self._counts(target), (6, {'HARD': 2, 'EASY': 4}))
+
+    def test_bad_requests(self):
+        sid, ids = self._subject(n=2)
+        self.assertEqual(call('POST', '/questions/bulk-delete', {'questionIds': []})[0], 400)
+        self.assertEqual(call('POST', '/questions/bulk-move', {'questionIds': ids, 'subjectId': 'nope'})[0], 400)
+        self.assertEqual(call('POST', '/questions/bulk-move', {'questionIds': 'x', 'subjectId': sid})[0], 400)
+        with mock.patch.object(index, 'BULK_MAX_ITEMS', 1):
+            self.assertEqual(call('POST', '/questions/bulk-delete', {'questionIds': ids})[0], 400)
+            target, _ = self._subject(' target')
+            status, body = call('POST', '/questions/bulk-move', {'fromSubjectId': sid, 'subjectId': target})
+        self.assertEqual((status, body['error']), (400, 'Subject has more than 1 questions; move them by questionIds'))
+
+    def test_cascading_subject_delete(self):
+        sid, ids = self._subject(n=5)
+        self.assertEqual(call('DELETE', f'/subjects/{sid}')[0], 400)
+        status, report = call('DELETE', f'/subjects/{sid}', qs={'cascade': 'true'})
+        self.assertEqual((status, report['successful'], report['subjectDeleted']), (200, 5, True))
+        self.assertEqual(call('GET', f'/subjects/{sid}')[0], 404)
+        self.assertEqual(index.store.batch_get('questions', [{'questionId': qid} for qid in ids]), [])
+        self.assertEqual(call('DELETE', f'/subjects/{sid}', qs={'cascade': '1'})[0], 404)
+
+    def test_cascade_keeps_the_subject_when_deletes_fail(self):
+        sid, ids = self._subject(n=3)
+        with mock.patch.object(index.store, 'batch_write', side_effect=RuntimeError('throttled')):
+            report = call('DELETE', f'/subjects/{sid}', qs={'cascade': 'true'})[1]
+        self.assertEqual((report['errors'], report['subjectDeleted']), (3, False))
+        self.assertEqual(self._counts(sid)[0], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+"""Quiz bundles: the file format, and serving GET /quiz from a built bundle."""
+import json
+import os
+import unittest
+from unittest import mock
+
+from helpers import TEMP_DIR, call, request
+import bundle
+import index
+import maintenance
+
+
+def _record(n):
+    return json.dumps({'questionId': f'q{n}', 'question': f'Question {n}?'}).encode('utf-8')
+
+
+class BundleFormatTest(unittest.TestCase):
+
+    def test_write_and_map(self):
+        path = os.path.join(TEMP_DIR.name, 'format.qzb')
+        records = [('s2', 'EASY', _record(0)), ('s1', 'HARD', _record(1)), ('s1', 'EASY', _record(2)),
+                   ('s1', 'HARD', _record(3))]
+        bundle.write(path, 7, records)
+        self.assertEqual(bundle.peek_version(path), 7)
+        current = bundle.open_bundle(path)
+        self.assertEqual(current.stats(), {'version': 7, 'path': path, 'questions': 4, 'subjects': 2})
+        self.assertEqual(current.subjects, {'s1': {'EASY': [0, 1], 'HARD': [1, 2]}, 's2': {'EASY': [3, 1]}})
+
+        ids = lambda records: [r['questionId'] for r in records]  # noqa: E731
+        self.assertEqual(ids(current.select()), ['q2', 'q1', 'q3', 'q0'])
+        self.assertEqual(ids(current.select('s1')), ['q2', 'q1', 'q3'])
+        self.assertEqual(ids(current.select('s1', 'HARD')), ['q1', 'q3'])
+        self.assertEqual(current.select('s1', 'MEDIUM'), ())
+        self.assertEqual(current.select('unknown'), ())
+        hard = current.select('s1', 'HARD')
+        self.assertEqual((hard[-1]['questionId'], ids(hard[:1])), ('q3', ['q1']))
+        with self.assertRaises(IndexError):
+            hard[2]
+
+    def test_not_a_bundle(self):
+        path = os.path.join(TEMP_DIR.name, 'junk.qzb')
+        with open(path, 'wb') as f:
+            f.write(b'QZB1 but not really a bundle header')
+        self.assertIsNone(bundle.peek_version(path))
+        self.assertIsNone(bundle.open_bundle(path))
+        self.assertIsNone(bundle.peek_version(os.path.join(TEMP_DIR.name, 'missing.qzb')))
+
+
+class BundleQuizTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(TEMP_DIR.name, f'{self._testMethodName}.qzb')
+        patches = (
+            mock.patch.object(index, 'QUIZ_BUNDLE_PATHS', [self.path]),
+            mock.patch.dict(index._quiz_bundle, {'bundle': None, 'checked': None, 'checkedAt': 0.0}),
+        )
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.name = f'Bundle {self._testMethodName}'
+        self.sid = call('POST', '/subjects', {'subjectName': self.name})[1]['subjectId']
+        report = call('POST', '/questions/bulk', {'questions': [
+            {'subject': self.name, 'question': f'{self.name} {n}?', 'options': ['a', 'b', 'c', 'd'],
+             'answerIndex': n % 4, 'difficulty': 'HARD' if n % 2 else 'EASY'}
+            for n in range(10)
+        ]})[1]
+        self.ids = {r['questionId'] for r in report['results']}
+
+    def _quiz(self, **qs):
+        res = request('GET', '/quiz', qs={'subjectId': self.sid, **qs})
+        return res['headers'].get('X-Quiz-Pool'), json.loads(res['body'])
+
+    def test_quiz_served_from_the_bundle(self):
+        built = maintenance.build_bundle(self.path, segments=4)
+        self.assertEqual(built['version'], index._current_questions_version())
+        self.assertGreaterEqual(built['questions'], 10)
+
+        hits = index._quiz_pool_stats['bundleHits']
+        pool, body = self._quiz(count='10')
+        self.assertEqual(pool, 'bundle')
+        self.assertEqual({q['questionId'] for q in body['questions']}, self.ids)
+        # Answers were carried through the bundle's records and reshuffled
+        stored = {it['questionId']: it for it in index._load_questions(self.ids).values()}
+        for q in body['questions']:
+            original = stored[q['questionId']]
+            self.assertEqual(sorted(q['options']), sorted(original['options']))
+            self.assertEqual(q['options'][q['answerIndex']], original['options'][int(original['answerIndex'])])
+
+        pool, body = self._quiz(difficulty='HARD', count='10')
+        self.assertEqual((pool, body['total']), ('bundle', 5))
+        self.assertEqual(index._quiz_pool_stats['bundleHits'] - hits, 2)
+        self.assertEqual(call('GET', '/quiz/pool')[1]['bundle']['path'], self.path)
+
+    def test_writes_retire_the_bundle(self):
+        maintenance.build_bundle(self.path)
+        self.assertEqual(self._quiz()[0], 'bundle')
+        call('DELETE', f'/questions/{sorted(self.ids)[0]}')
+        pool, body = self._quiz(count='10')
+        self.assertEqual((pool, body['total']), ('miss', 9))
+        # Rebuilt for the new version, it serves again
+        self.assertEqual(maintenance.build_bundle(self.path)['version'], index._current_questions_version())
+        with mock.patch.object(index, 'QUIZ_VERSION_CHECK_SECONDS', 0):
+            self.assertEqual(self._quiz()[0], 'bundle')
+
+
+if __name__ == '__main__':
+    unittest.main()
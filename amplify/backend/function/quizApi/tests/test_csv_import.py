@@ -0,0 +1,139 @@
+"""Resumable CSV import (POST /questions/import) on the SQLite backend."""
+import io
+import unittest
+
+from helpers import call
+import index
+import maintenance
+
+HEADER = 'question,option1,option2,option3,option4,answer_index,subject,difficulty\n'
+
+
+def _csv(rows, tag):
+    lines = [f'{tag} question {n}?,A{n},B{n},C{n},D{n},{n % 4},Imported,EASY\n' for n in range(rows)]
+    return (HEADER + ''.join(lines)).encode('utf-8')
+
+
+def _opener(data):
+    return lambda offset: io.BytesIO(data[offset:])
+
+
+def _budget(chunks):
+    """time_left_ms that allows `chunks` chunks and then runs out."""
+    calls = [0]
+
+    def time_left_ms():
+        calls[0] += 1
+        return 10**6 if calls[0] <= chunks else 0
+    return time_left_ms
+
+
+class _RangeNotSatisfiable(Exception):
+    response = {'Error': {'Code': 'InvalidRange'}}
+
+
+class _FakeS3:
+
+    def __init__(self, data):
+        self.data = data
+
+    def get_object(self, Bucket, Key, Range=None):
+        start = int(Range[len('bytes='):-1]) if Range else 0
+        if start >= len(self.data):
+            raise _RangeNotSatisfiable()
+        return {'Body': io.BytesIO(self.data[start:])}
+
+
+class CsvImportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.chunk_rows = index.CSV_IMPORT_CHUNK_ROWS
+        index.CSV_IMPORT_CHUNK_ROWS = 3
+
+    def tearDown(self):
+        index.CSV_IMPORT_CHUNK_ROWS = self.chunk_rows
+        index._clients.pop('s3', None)
+
+    def _start(self, data, job_id):
+        index._clients['s3'] = _FakeS3(data)
+        return index._start_csv_import({'bucket': 'b', 'key': f'{job_id}.csv'}, job_id)
+
+    def _questions(self, job):
+        items, _ = index.store.scan('questions', fields=['questionId'])
+        return [it for it in items if it['questionId'].startswith(f"import-{job['jobId']}")]
+
+    def _checkpoints(self):
+        items, _ = index.store.scan('subjects', fields=['subjectId'])
+        return {it['subjectId'] for it in items if it['subjectId'].startswith(index.META_PREFIX + 'import#')}
+
+    def test_last_chunk_ending_on_last_row_completes(self):
+        data = _csv(9, 'last-row')
+        job = self._start(data, 'last-row')
+        self.assertTrue(index._run_csv_import(job, index._open_s3_stream('b', 'k'), _budget(3)))
+        self.assertEqual(job['status'], 'completed')
+        self.assertIsNone(index._load_csv_import('last-row'))
+        self.assertEqual(int(job['offset']), len(data))
+        self.assertEqual(int(job['rowsDone']), 9)
+        self.assertEqual(len(self._questions(job)), 9)
+
+    def test_resume_across_chunk_boundary(self):
+        data = _csv(9, 'resume')
+        job = self._start(data, 'resume')
+        self.assertFalse(index._run_csv_import(job, index._open_s3_stream('b', 'k'), _budget(1)))
+        job = index._load_csv_import('resume')
+        self.assertEqual((job['status'], int(job['rowsDone'])), ('running', 3))
+        self.assertEqual(data[int(job['offset']):].split(b'\n')[0], b'resume question 3?,A3,B3,C3,D3,3,Imported,EASY')
+
+        self.assertTrue(index._run_csv_import(job, index._open_s3_stream('b', 'k'), _budget(5)))
+        self.assertEqual((job['status'], int(job['rowsDone']), int(job['successful'])), ('completed', 9, 9))
+        self.assertIsNone(index._load_csv_import('resume'))
+        self.assertEqual(len(self._questions(job)), 9)
+
+    def test_checkpoint_at_end_of_file_completes(self):
+        # A job saved as running with its offset at the end of the file (the
+        # state imports were left in before the read-ahead) finishes on resume
+        data = _csv(3, 'at-end')
+        job = self._start(data, 'at-end')
+        job.update(header=[c for c in index.CSV_IMPORT_COLUMNS], offset=len(data), rowsDone=3, successful=3)
+        index._save_import_checkpoint(job, 0)
+        self.assertTrue(index._run_csv_import(job, index._open_s3_stream('b', 'k')))
+        self.assertEqual(job['status'], 'completed')
+        self.assertIsNone(index._load_csv_import('at-end'))
+
+    def test_header_only(self):
+        job = self._start(HEADER.encode('utf-8'), 'header-only')
+        self.assertTrue(index._run_csv_import(job, _opener(HEADER.encode('utf-8'))))
+        self.assertEqual(job['status'], 'completed')
+
+    def test_finished_jobs_leave_no_checkpoint(self):
+        before = self._checkpoints()
+        data = _csv(4, 'routed')
+        index._clients['s3'] = _FakeS3(data)
+        status, body = call('POST', '/questions/import', {'bucket': 'b', 'key': 'routed.csv'})
+        self.assertEqual((status, body['status'], body['successful']), (200, 'completed', 4))
+        self.assertEqual(call('POST', '/questions/import', {'jobId': body['jobId']})[0], 404)
+
+        index._clients['s3'] = _FakeS3(b'question,answer_index\nQ?,0\n')
+        status, body = call('POST', '/questions/import', {'bucket': 'b', 'key': 'bad.csv'})
+        self.assertEqual((status, body['status']), (400, 'failed'))
+        self.assertEqual(self._checkpoints(), before)
+
+    def test_drop_import_checkpoints(self):
+        running = self._start(_csv(1, 'running'), 'running')
+        stale = self._start(_csv(1, 'stale'), 'stale')
+        stale[index.CSV_IMPORT_TTL_ATTR] = 1
+        index.store.put('subjects', stale)
+        legacy = self._start(_csv(1, 'legacy'), 'legacy')
+        legacy.update(status='completed')
+        del legacy[index.CSV_IMPORT_TTL_ATTR]
+        index.store.put('subjects', legacy)
+
+        self.assertEqual(maintenance.drop_import_checkpoints(), {'dropped': 2, 'kept': 1, 'dryRun': False})
+        self.assertEqual(index._load_csv_import('running')['jobId'], running['jobId'])
+        self.assertIsNone(index._load_csv_import('stale'))
+        self.assertIsNone(index._load_csv_import('legacy'))
+        index.store.delete('subjects', index._import_checkpoint_key('running'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+"""Content hash markers: duplicate questions are refused on every write path."""
+import unittest
+
+from helpers import call
+import index
+import maintenance
+
+
+class DuplicateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sid = call('POST', '/subjects', {'subjectName': f'Dup {self._testMethodName}'})[1]['subjectId']
+
+    def _create(self, text, sid=None):
+        return call('POST', '/questions', {
+            'subjectId': sid or self.sid, 'question': text, 'options': ['a', 'b', 'c', 'd'], 'answerIndex': 0,
+        })
+
+    def _marker(self, question):
+        return index.store.get('hashes', {'contentHash': question['contentHash']})
+
+    def test_create_update_delete(self):
+        status, first = self._create('Which port does SSH use?')
+        self.assertEqual(status, 201)
+        self.assertEqual(self._marker(first)['questionId'], first['questionId'])
+        # Case, spacing and option order do not make a new question
+        status, body = call('POST', '/questions', {
+            'subjectId': self.sid, 'question': ' which PORT does ssh use? ', 'options': ['d', 'c', 'b', 'a'],
+            'answerIndex': 3,
+        })
+        self.assertEqual((status, body['questionId']), (409, first['questionId']))
+
+        status, second = self._create('Which port does HTTPS use?')
+        status, body = call('PUT', f"/questions/{second['questionId']}", {'question': 'Which port does SSH use?'})
+        self.assertEqual((status, body['questionId']), (409, first['questionId']))
+
+        # Editing the content moves the marker; the old content is free again
+        status, edited = call('PUT', f"/questions/{first['questionId']}", {'question': 'Which port does SFTP use?'})
+        self.assertEqual(status, 200)
+        self.assertIsNone(self._marker(first))
+        self.assertEqual(self._marker(edited)['questionId'], first['questionId'])
+        self.assertEqual(self._create('Which port does SSH use?')[0], 201)
+
+        self.assertEqual(call('DELETE', f"/questions/{first['questionId']}")[0], 204)
+        self.assertIsNone(self._marker(edited))
+        self.assertEqual(self._create('Which port does SFTP use?')[0], 201)
+
+    def test_bulk_create_delete_and_move(self):
+        name = f'Dup {self._testMethodName}'
+        rows = [
+            {'subject': name, 'question': f'Bulk {n}?', 'options': ['a', 'b', 'c', 'd'], 'answerIndex': 0}
+            for n in (1, 2, 2)
+        ]
+        report = call('POST', '/questions/bulk', {'questions': rows})[1]
+        self.assertEqual((report['successful'], report['skipped']), (2, 1))
+        created = [r['questionId'] for r in report['results'] if r['status'] == 'created']
+        self.assertEqual(self._create('Bulk 1?')[0], 409)
+        self.assertEqual(call('POST', '/questions/bulk', {'questions': rows[:1]})[1]['skipped'], 1)
+
+        other = call('POST', '/subjects', {'subjectName': f'{name} 2'})[1]['subjectId']
+        status, taken = self._create('Bulk 2?', other)
+        self.assertEqual(status, 201)
+        report = call('POST', '/questions/bulk-move', {'questionIds': created, 'subjectId': other})[1]
+        self.assertEqual([r['status'] for r in report['results']], ['moved', 'skipped'])
+        moved = index.store.get('questions', {'questionId': created[0]})
+        self.assertEqual(self._marker(moved)['questionId'], created[0])
+        self.assertEqual(self._create('Bulk 1?')[0], 201)
+
+        report = call('POST', '/questions/bulk-delete', {'questionIds': [created[0], taken['questionId']]})[1]
+        self.assertEqual(report['successful'], 2)
+        self.assertIsNone(self._marker(moved))
+        self.assertIsNone(self._marker(taken))
+
+    def test_backfill_rebuilds_markers(self):
+        status, question = self._create('Which layer does TLS run at?')
+        index.store.delete('hashes', {'contentHash': question['contentHash']})
+        index.store.put('hashes', {'contentHash': 'stale', 'questionId': 'gone'})
+        report = maintenance.backfill_content_hashes(segments=1)
+        self.assertGreaterEqual(report['markersWritten'], 1)
+        self.assertGreaterEqual(report['markersDeleted'], 1)
+        self.assertEqual(self._marker(question)['questionId'], question['questionId'])
+        self.assertIsNone(index.store.get('hashes', {'contentHash': 'stale'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+"""GET /questions/export: NDJSON and CSV, inline or as an S3 multipart upload."""
+import csv
+import io
+import json
+import unittest
+from unittest import mock
+
+from helpers import call, request
+import index
+
+
+class _FakeS3:
+
+    def __init__(self):
+        self.parts, self.completed, self.aborted = {}, None, False
+
+    def create_multipart_upload(self, Bucket, Key, ContentType):
+        self.content_type = ContentType
+        return {'UploadId': 'u1'}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.parts[PartNumber] = Body
+        return {'ETag': f'"{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.completed = [p['PartNumber'] for p in MultipartUpload['Parts']]
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.aborted = True
+
+    def generate_presigned_url(self, method, Params, ExpiresIn):
+        return f"https://s3.example/{Params['Key']}"
+
+
+class ExportTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.sid = call('POST', '/subjects', {'subjectName': 'Export'})[1]['subjectId']
+        report = call('POST', '/questions/bulk', {'questions': [
+            {'subject': 'Export', 'question': f'Export {n}, with "quotes"?', 'options': ['a', 'b,c', 'd', 'e'],
+             'answerIndex': n % 4, 'difficulty': 'HARD' if n % 2 else 'EASY'}
+            for n in range(30)
+        ]})[1]
+        cls.ids = {r['questionId'] for r in report['results']}
+
+    def _export(self, **qs):
+        res = request('GET', '/questions/export', qs={'subjectId': self.sid, **qs})
+        return res['statusCode'], res['headers']['Content-Type'], res['body']
+
+    def test_ndjson(self):
+        status, content_type, body = self._export(segments='4')
+        self.assertEqual((status, content_type), (200, 'application/x-ndjson'))
+        items = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual({it['questionId'] for it in items}, self.ids)
+
+        items = [json.loads(line) for line in self._export(fields='questionId,difficulty')[2].splitlines()]
+        self.assertEqual({tuple(sorted(it)) for it in items}, {('difficulty', 'questionId')})
+
+    def test_csv_reads_back_as_import_rows(self):
+        status, content_type, body = self._export(format='csv')
+        self.assertEqual((status, content_type), (200, 'text/csv'))
+        header, *records = list(csv.reader(io.StringIO(body)))
+        self.assertEqual(header, index.CSV_IMPORT_COLUMNS)
+        rows = sorted((index._csv_record_to_row(header, r) for r in records), key=lambda r: r['question'])
+        self.assertEqual(len(rows), 30)
+        self.assertEqual(rows[0], {
+            'question': 'Export 0, with "quotes"?', 'options': ['a', 'b,c', 'd', 'e'], 'answerIndex': '0',
+            'subject': 'Export', 'difficulty': 'EASY',
+        })
+
+    def test_whole_bank_parallel_scan(self):
+        items = [json.loads(line) for line in request('GET', '/questions/export', qs={'segments': '8'})['body'].splitlines()]
+        ids = [it['questionId'] for it in items]
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertLessEqual(self.ids, set(ids))
+        self.assertEqual(len(ids), len(index.store.scan('questions', fields=['questionId'])[0]))
+
+    def test_limits(self):
+        self.assertEqual(self._export(format='xml')[0], 400)
+        with mock.patch.object(index, 'EXPORT_INLINE_MAX_BYTES', 1000):
+            status, _, body = self._export()
+        self.assertEqual((status, json.loads(body)['error']),
+                         (413, 'Export too large to return inline; set QUIZ_EXPORT_BUCKET'))
+
+    def test_multipart_upload(self):
+        qs = {'segments': '8'}
+        inline = request('GET', '/questions/export', qs=qs)['body'].encode('utf-8')
+        s3 = _FakeS3()
+        with mock.patch.dict(index._clients, {'s3': s3}), mock.patch.object(index, 'EXPORT_BUCKET', 'exports'), \
+                mock.patch.object(index, 'EXPORT_PART_BYTES', 1000):
+            status, body = call('GET', '/questions/export', qs=qs)
+        self.assertEqual(status, 200)
+        self.assertEqual((body['bucket'], body['bytes'], s3.content_type), ('exports', len(inline), 'application/x-ndjson'))
+        self.assertTrue(body['key'].startswith('exports/questions-') and body['key'].endswith('.ndjson'))
+        self.assertEqual(s3.completed, sorted(s3.parts))
+        self.assertGreater(len(s3.completed), 1)
+        self.assertFalse(s3.aborted)
+        # Segments finish in any order; the lines are the same
+        uploaded = b''.join(s3.parts[n] for n in s3.completed)
+        self.assertEqual(sorted(uploaded.splitlines()), sorted(inline.splitlines()))
+
+
+if __name__ == '__main__':
+    unittest.main()
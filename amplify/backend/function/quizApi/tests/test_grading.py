@@ -0,0 +1,77 @@
+"""POST /quiz/grade records a token once per user, on the SQLite backend."""
+import unittest
+
+from helpers import USER, call
+import index
+
+
+def _records(table, user_id):
+    items, _ = index.store.scan(table)
+    return [it for it in items if it.get('userId') == user_id]
+
+
+class GradingTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        index.QUIZ_TOKEN_SECRET = 'test-secret'
+        index.USER_PROGRESS_TABLE = 'UserProgress'
+        sid = call('POST', '/subjects', {'subjectName': 'Grading'})[1]['subjectId']
+        call('POST', '/questions/bulk', {'questions': [
+            {'subject': 'Grading', 'question': f'Grading {n}?', 'options': ['a', 'b', 'c', 'd'], 'answerIndex': n % 4}
+            for n in range(8)
+        ]})
+        cls.subject_id = sid
+
+    def setUp(self):
+        self.session_table = index.QUIZ_SESSION_TABLE
+
+    def tearDown(self):
+        index.QUIZ_SESSION_TABLE = self.session_table
+
+    def _quiz(self):
+        quiz = call('GET', '/quiz', qs={'subjectId': self.subject_id, 'count': '4'})[1]
+        return {'token': quiz['token'], 'answers': {q['questionId']: q['answerIndex'] for q in quiz['questions']}}
+
+    def _assert_replay_rejected(self, user_id, context):
+        attempt = self._quiz()
+        status, first = call('POST', '/quiz/grade', attempt, context=context)
+        self.assertEqual((status, first['score']), (200, 4))
+        progress = len(_records('progress', user_id))
+        status, replay = call('POST', '/quiz/grade', attempt, context=context)
+        self.assertEqual(status, 409)
+        self.assertEqual(replay['sessionId'], first['sessionId'])
+        self.assertEqual(len(_records('progress', user_id)), progress)
+        return first['sessionId']
+
+    def test_replay_with_sessions_table(self):
+        index.QUIZ_SESSION_TABLE = 'QuizSession'
+        session_id = self._assert_replay_rejected('user-1', USER)
+        self.assertEqual([s['id'] for s in _records('sessions', 'user-1') if s['id'] == session_id], [session_id])
+
+    def test_replay_without_sessions_table(self):
+        index.QUIZ_SESSION_TABLE = None
+        self._assert_replay_rejected('user-2', {'authorizer': {'jwt': {'claims': {'sub': 'user-2'}}}})
+
+    def test_other_user_and_anonymous(self):
+        attempt = self._quiz()
+        self.assertEqual(call('POST', '/quiz/grade', attempt, context=USER)[0], 200)
+        other = {'authorizer': {'jwt': {'claims': {'sub': 'user-3'}}}}
+        self.assertEqual(call('POST', '/quiz/grade', attempt, context=other)[0], 200)
+        # Nothing is recorded without a user, so grading stays repeatable
+        self.assertEqual(call('POST', '/quiz/grade', attempt, context={})[0], 200)
+        self.assertEqual(call('POST', '/quiz/grade', attempt, context={})[0], 200)
+
+    def test_answer_list_needs_string_question_ids(self):
+        attempt = self._quiz()
+        listed = [{'questionId': qid, 'selected': i} for qid, i in attempt['answers'].items()]
+        status, body = call('POST', '/quiz/grade', {'token': attempt['token'], 'answers': listed}, context={})
+        self.assertEqual((status, body['score']), (200, 4))
+        for bad in ([{'questionId': ['x'], 'selected': 0}], [{'selected': 0}], ['x']):
+            status, body = call('POST', '/quiz/grade', {'token': attempt['token'], 'answers': bad}, context={})
+            self.assertEqual(status, 400, bad)
+            self.assertEqual(body['error'], 'answers must be a list of {questionId, selected} objects')
+
+
+if __name__ == '__main__':
+    unittest.main()
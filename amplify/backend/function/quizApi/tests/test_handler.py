@@ -0,0 +1,71 @@
+"""lambda_handler: routing and error responses."""
+import unittest
+from unittest import mock
+
+from helpers import call
+import index
+
+
+class RoutingTest(unittest.TestCase):
+
+    def _pattern(self, method, path):
+        route, params = index._resolve_route(method, path)
+        return (route['pattern'], params) if route else None
+
+    def test_literal_segments_win_over_parameters(self):
+        self.assertEqual(self._pattern('POST', '/questions/bulk'), ('/questions/bulk', {}))
+        self.assertEqual(self._pattern('POST', '/questions/bulk-move'), ('/questions/bulk-move', {}))
+        self.assertEqual(self._pattern('GET', '/questions/search'), ('/questions/search', {}))
+        self.assertEqual(self._pattern('GET', '/questions/bulk'), ('/questions/{questionId}', {'questionId': 'bulk'}))
+        self.assertEqual(self._pattern('PUT', '/questions/q-1/'), ('/questions/{questionId}', {'questionId': 'q-1'}))
+        self.assertIsNone(self._pattern('PATCH', '/questions/q-1'))
+        self.assertIsNone(self._pattern('GET', '/questions/q-1/extra'))
+
+    def test_stage_and_base_path_prefixes(self):
+        self.assertEqual(self._pattern('POST', '/dev/questions/bulk'), ('/questions/bulk', {}))
+        self.assertEqual(self._pattern('GET', '/prod/subjects/s-1'), ('/subjects/{subjectId}', {'subjectId': 's-1'}))
+        self.assertIsNone(self._pattern('GET', '/a/b/subjects'))
+        with mock.patch.object(index, 'API_BASE_PATH', '/api/v1'):
+            self.assertEqual(self._pattern('GET', '/api/v1/quiz'), ('/quiz', {}))
+
+    def test_handler_routes_bulk_through_a_stage(self):
+        status, report = call('POST', '/dev/questions/bulk', {'questions': [
+            {'subject': 'Routing', 'question': 'Which route?', 'options': ['a', 'b', 'c', 'd'], 'answerIndex': 1},
+        ]})
+        self.assertEqual((status, report['successful']), (200, 1))
+        qid = report['results'][0]['questionId']
+        self.assertEqual(call('GET', f'/dev/questions/{qid}')[1]['question'], 'Which route?')
+        # Admin routes stay hidden from other callers
+        self.assertEqual(call('POST', '/questions/bulk', {'questions': []}, context={})[0], 404)
+        self.assertEqual(call('GET', '/nowhere')[0], 404)
+
+
+class ErrorResponseTest(unittest.TestCase):
+
+    def test_malformed_input_is_a_bad_request(self):
+        question = {'subjectId': 's', 'question': 'Q?', 'options': ['a', 'b', 'c', 'd'], 'answerIndex': 'z'}
+        cases = [
+            (('POST', '/subjects', '{"subjectName": '), 'Request body is not valid JSON'),
+            (('POST', '/subjects', '["Networks"]'), 'Request body must be a JSON object'),
+            (('GET', '/subjects', None, {'limit': 'ten'}), 'limit must be an integer'),
+            (('GET', '/subjects', None, {'nextToken': 'abc'}), 'Invalid nextToken'),
+            (('GET', '/questions', None, {'limit': '1.5'}), 'limit must be an integer'),
+            (('GET', '/quiz', None, {'count': 'many'}), 'count must be an integer'),
+            (('POST', '/questions', question), 'answerIndex must be an integer'),
+            (('PUT', '/questions/q1', {'answerIndex': 'z'}), 'answerIndex must be an integer'),
+        ]
+        for args, message in cases:
+            with self.subTest(args=args):
+                status, body = call(*args)
+                self.assertEqual(status, 400)
+                self.assertTrue(body['error'].startswith(message), body['error'])
+
+    def test_server_fault_stays_opaque(self):
+        with self.assertLogs(index.logger, 'ERROR'), \
+                mock.patch.object(index.store, 'scan', side_effect=RuntimeError('disk on fire')):
+            status, body = call('GET', '/subjects')
+        self.assertEqual((status, body['error']), (500, 'Internal server error'))
+
+
+if __name__ == '__main__':
+    unittest.main()
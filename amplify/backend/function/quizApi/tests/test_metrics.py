@@ -0,0 +1,40 @@
+"""Request metrics: which request reports the cold start."""
+import contextlib
+import io
+import json
+import unittest
+
+from helpers import request
+import index
+
+
+def _records(method, path):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        res = request(method, path, context={})
+    return res['statusCode'], [json.loads(line) for line in out.getvalue().splitlines() if line.startswith('{')]
+
+
+class ColdStartTest(unittest.TestCase):
+
+    def setUp(self):
+        saved = dict(index._request_metrics)
+        self.addCleanup(index._request_metrics.update, saved)
+        index._request_metrics.update(cold=True, initMs=None)
+        rate, index.METRICS_SAMPLE_RATE = index.METRICS_SAMPLE_RATE, 0.0
+        self.addCleanup(setattr, index, 'METRICS_SAMPLE_RATE', rate)
+
+    def test_preflight_and_unknown_route_leave_cold_start_to_routed_request(self):
+        self.assertEqual(_records('OPTIONS', '/quiz'), (200, []))
+        self.assertEqual(_records('GET', '/nope'), (404, []))
+        status, records = _records('GET', '/subjects')
+        self.assertEqual(status, 200)
+        (record,) = records
+        self.assertEqual(record['Start'], 'cold')
+        self.assertIn('InitTime', record)
+        # Warm, and unsampled at rate 0
+        self.assertEqual(_records('GET', '/subjects'), (200, []))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+"""GET /quiz: the warm-container pool, and whole-bank difficulty quizzes."""
+import threading
+import unittest
+from unittest import mock
+
+from helpers import call, request
+import index
+
+
+class WholeBankDifficultyTest(unittest.TestCase):
+
+    def setUp(self):
+        for name, value in (('QUIZ_BUNDLE_PATHS', []), ('QUIZ_MAX_SUBJECTS', 4)):
+            self.addCleanup(setattr, index, name, getattr(index, name))
+            setattr(index, name, value)
+        rows = [
+            {'subject': f'Cap {n % 10}', 'question': f'Cap question {n}?', 'options': ['a', 'b', 'c', 'd'],
+             'answerIndex': 0, 'difficulty': 'HARD' if n % 10 else 'EASY'}
+            for n in range(60)
+        ]
+        self.assertEqual(call('POST', '/questions/bulk', {'questions': rows})[1]['successful'], 60)
+
+    def test_one_scan_per_version_and_capped_subjects(self):
+        scans = []
+        scan = index.store.scan
+        index.store.scan = lambda table, *a, **k: scans.append(table) or scan(table, *a, **k)
+        self.addCleanup(setattr, index.store, 'scan', scan)
+
+        for _ in range(3):
+            status, body = call('GET', '/quiz', qs={'difficulty': 'HARD', 'count': '50'})
+            self.assertEqual(status, 200)
+            # At least nine subjects have HARD questions
+            self.assertEqual(len(body['subjects']), 4)
+        self.assertEqual(scans.count('subjects'), 1)
+
+        # Another difficulty filters the same cached counters
+        self.assertEqual(call('GET', '/quiz', qs={'difficulty': 'EASY'})[0], 200)
+        self.assertEqual(scans.count('subjects'), 1)
+        # A question write moves the version on
+        index._bump_questions_version()
+        self.assertEqual(call('GET', '/quiz', qs={'difficulty': 'EASY'})[0], 200)
+        self.assertEqual(scans.count('subjects'), 2)
+
+
+class QuizPoolTest(unittest.TestCase):
+
+    def test_version_bump_clears_the_pool_under_its_lock(self):
+        index._quiz_pool['held'] = {'items': []}
+        bump = threading.Thread(target=index._bump_questions_version)
+        with index._quiz_pool_lock:
+            bump.start()
+            bump.join(0.2)
+            # Waiting for the lock a pool reader or writer holds
+            self.assertTrue(bump.is_alive())
+            self.assertIn('held', index._quiz_pool)
+        bump.join()
+        self.assertNotIn('held', index._quiz_pool)
+
+    def test_pool_header_without_sources(self):
+        # No subject holds the difficulty: nothing was served from the bundle
+        with mock.patch.object(index, '_subjects_with', return_value=[]):
+            res = request('GET', '/quiz', qs={'difficulty': 'MEDIUM'})
+        self.assertEqual((res['statusCode'], res['headers']['X-Quiz-Pool']), (200, 'miss'))
+
+
+if __name__ == '__main__':
+    unittest.main()
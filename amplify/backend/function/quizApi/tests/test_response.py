@@ -0,0 +1,79 @@
+"""_response: JSON encoding, ETag/304 and gzip negotiation."""
+import base64
+import gzip
+import json
+import unittest
+from decimal import Decimal
+
+from helpers import call, request
+import index
+
+
+def _event(**headers):
+    return {'headers': headers}
+
+
+class EncodingTest(unittest.TestCase):
+
+    def test_dynamodb_values(self):
+        res = index._response(_event(), 200, {'n': Decimal('3'), 'f': Decimal('1.5'), 'tags': {'b', 'a'}})
+        self.assertEqual(json.loads(res['body']), {'n': 3, 'f': 1.5, 'tags': ['a', 'b']})
+        self.assertEqual(res['headers']['Content-Type'], 'application/json')
+
+
+class ETagTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sid = call('POST', '/subjects', {'subjectName': f'ETag {self._testMethodName}'})[1]['subjectId']
+        self.path = f'/subjects/{self.sid}'
+
+    def test_if_none_match(self):
+        first = request('GET', self.path)
+        tag = first['headers']['ETag']
+        self.assertTrue(tag.startswith('W/"'))
+        self.assertEqual(request('GET', self.path)['headers']['ETag'], tag)
+
+        for header in (tag, f'W/"other", {tag}', '*'):
+            res = request('GET', self.path, headers={'If-None-Match': header})
+            self.assertEqual((res['statusCode'], res['body'], res['headers']['ETag']), (304, '', tag))
+        self.assertEqual(request('GET', self.path, headers={'if-none-match': 'W/"other"'})['statusCode'], 200)
+
+        # A change gives a new tag, so the old one no longer matches
+        self.assertEqual(call('PUT', self.path, {'description': 'changed'})[0], 200)
+        res = request('GET', self.path, headers={'If-None-Match': tag})
+        self.assertEqual(res['statusCode'], 200)
+        self.assertNotEqual(res['headers']['ETag'], tag)
+
+    def test_writes_carry_no_etag(self):
+        res = request('PUT', self.path, {'description': 'x'}, headers={'If-None-Match': '*'})
+        self.assertEqual(res['statusCode'], 200)
+        self.assertNotIn('ETag', res['headers'])
+
+
+class GzipTest(unittest.TestCase):
+
+    body = {'items': [{'questionId': f'q{n}', 'question': 'Which port does SSH use?'} for n in range(100)]}
+
+    def test_large_bodies_are_gzipped_for_clients_that_accept_it(self):
+        res = index._response(_event(**{'Accept-Encoding': 'br, gzip;q=0.8'}), 200, self.body)
+        self.assertEqual((res['headers']['Content-Encoding'], res['headers']['Vary']), ('gzip', 'Accept-Encoding'))
+        self.assertTrue(res['isBase64Encoded'])
+        self.assertEqual(json.loads(gzip.decompress(base64.b64decode(res['body']))), self.body)
+
+    def test_plain_responses(self):
+        cases = [
+            (_event(), self.body),
+            (_event(**{'accept-encoding': 'gzip;q=0'}), self.body),
+            (_event(**{'Accept-Encoding': 'deflate'}), self.body),
+            (_event(**{'Accept-Encoding': 'gzip'}), {'small': True}),
+        ]
+        for event, body in cases:
+            with self.subTest(event=event, size=len(json.dumps(body))):
+                res = index._response(event, 200, body)
+                self.assertNotIn('Content-Encoding', res['headers'])
+                self.assertNotIn('isBase64Encoded', res)
+                self.assertEqual(json.loads(res['body']), body)
+
+
+if __name__ == '__main__':
+    unittest.main()
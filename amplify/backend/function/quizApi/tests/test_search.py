@@ -0,0 +1,99 @@
+"""Question search: SearchIndex ranking and GET /questions/search."""
+import os
+import unittest
+from unittest import mock
+
+from helpers import TEMP_DIR, call
+import index
+import search
+
+
+def _q(qid, text, subject='s1', **extra):
+    return {'questionId': qid, 'subjectId': subject, 'question': text, 'options': [], **extra}
+
+
+class SearchIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = search.SearchIndex(version=1)
+        for item in (
+            _q('old-exact', 'Which port does SSH use?'),
+            _q('prefix', 'Is SSHv2 safer than telnet?'),
+            _q('new-exact', 'SSH keys: which type is strongest?'),
+            _q('other', 'What does TLS stand for?', 's2', tags=['ssh']),
+        ):
+            self.index.add(item)
+
+    def test_exact_matches_rank_first_then_newest(self):
+        self.assertEqual(self.index.search('ssh'), (['other', 'new-exact', 'old-exact', 'prefix'], 4))
+        self.assertEqual(self.index.search('ssh', limit=2), (['other', 'new-exact'], 4))
+
+    def test_every_term_must_match(self):
+        self.assertEqual(self.index.search('ssh port'), (['old-exact'], 1))
+        self.assertEqual(self.index.search('whi ss'), (['new-exact', 'old-exact'], 2))
+        self.assertEqual(self.index.search('ssh nothing'), ([], 0))
+        # One-character tokens only match whole terms
+        self.assertEqual(self.index.search('s'), ([], 0))
+
+    def test_subject_filter(self):
+        self.assertEqual(self.index.search('ssh', 's2'), (['other'], 1))
+        self.assertEqual(self.index.search('ssh', 'unknown'), ([], 0))
+
+    def test_updates_and_removals(self):
+        self.index.add(_q('old-exact', 'Which port does SFTP use?'))
+        self.assertEqual(self.index.search('ssh')[0], ['other', 'new-exact', 'prefix'])
+        # The rewritten question is now the newest
+        self.assertEqual(self.index.search('which')[0], ['old-exact', 'new-exact'])
+        self.index.remove('other')
+        self.assertEqual(self.index.search('ssh'), (['new-exact', 'prefix'], 2))
+        self.index.compact()
+        self.assertEqual(self.index.search('ssh'), (['new-exact', 'prefix'], 2))
+        self.assertEqual(len(self.index), 3)
+
+    def test_cached_bitmaps_follow_new_slots(self):
+        with mock.patch.object(search, 'BITMAP_CACHE_MIN', 1):
+            self.assertEqual(self.index.search('ssh')[1], 4)
+            self.index.add(_q('late', 'SSH agent forwarding'))
+            self.index.remove('prefix')
+            self.assertEqual(self.index.search('ssh'), (['late', 'other', 'new-exact', 'old-exact'], 4))
+            self.assertEqual(self.index.search('ssh', 's1')[1], 3)
+
+    def test_snapshot_round_trip(self):
+        self.index.remove('prefix')
+        path = os.path.join(TEMP_DIR.name, 'round-trip.snap')
+        self.index.save(path)
+        loaded = search.SearchIndex.load(path)
+        self.assertEqual(loaded.version, 1)
+        for query in ('ssh', 'which', 'ssh port', 'tls'):
+            self.assertEqual(loaded.search(query), self.index.search(query))
+        with open(path, 'wb') as f:
+            f.write(b'not a snapshot')
+        self.assertIsNone(search.SearchIndex.load(path))
+
+
+class SearchRouteTest(unittest.TestCase):
+
+    def test_search_follows_writes(self):
+        sid = call('POST', '/subjects', {'subjectName': 'Search route'})[1]['subjectId']
+        qids = [
+            call('POST', '/questions', {
+                'subjectId': sid, 'question': text, 'options': ['a', 'b', 'c', 'd'], 'answerIndex': 0,
+            })[1]['questionId']
+            for text in ('Zebrafish kernel question one?', 'Zebrafish kernel question two?')
+        ]
+        status, body = call('GET', '/questions/search', qs={'q': 'zebrafish kern', 'subjectId': sid})
+        self.assertEqual(status, 200)
+        self.assertEqual(([it['questionId'] for it in body['items']], body['total']), (qids[::-1], 2))
+
+        # Writes after the index was built are applied to it in place
+        call('PUT', f'/questions/{qids[1]}', {'question': 'Unrelated now?'})
+        call('DELETE', f'/questions/{qids[0]}')
+        status, body = call('GET', '/questions/search', qs={'q': 'zebrafish'})
+        self.assertEqual((body['items'], body['total']), ([], 0))
+        self.assertEqual(call('GET', '/questions/search', qs={'q': 'unrelated'})[1]['total'], 1)
+        self.assertEqual(body['index']['version'], index._current_questions_version())
+        self.assertEqual(call('GET', '/questions/search')[0], 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
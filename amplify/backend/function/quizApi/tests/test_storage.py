@@ -0,0 +1,68 @@
+"""SqliteStorage: parallel writers and random-key sampling."""
+import random
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from helpers import call
+import index
+import storage
+
+
+class SqliteConcurrencyTest(unittest.TestCase):
+
+    def _questions(self, subject, n):
+        sid = call('POST', '/subjects', {'subjectName': subject})[1]['subjectId']
+        rows = [
+            {'subject': subject, 'question': f'{subject} {i}?', 'options': ['a', 'b', 'c', 'd'], 'answerIndex': 0}
+            for i in range(n)
+        ]
+        report = call('POST', '/questions/bulk', {'questions': rows})[1]
+        self.assertEqual(report['successful'], n)
+        return [r['questionId'] for r in report['results']], sid
+
+    def _in_subject(self, sid):
+        return {it['questionId'] for it in index.store.query('questions', 'SubjectIndex', sid)[0]}
+
+    def test_memory_store_takes_parallel_writers(self):
+        store = storage.SqliteStorage(':memory:')
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            list(pool.map(lambda n: store.update('subjects', {'subjectId': 's'}, add={'n': 1}, must_exist=False),
+                          range(400)))
+            list(pool.map(lambda n: store.batch_write('questions', puts=[{'questionId': f'{n}-{i}'} for i in range(5)]),
+                          range(100)))
+        self.assertEqual(store.get('subjects', {'subjectId': 's'})['n'], 400)
+        self.assertEqual(len(store.scan('questions')[0]), 500)
+
+    def test_bulk_move_whole_subject(self):
+        ids, source = self._questions('Concurrent move', 60)
+        target = call('POST', '/subjects', {'subjectName': 'Concurrent move target'})[1]['subjectId']
+        report = call('POST', '/questions/bulk-move', {'fromSubjectId': source, 'subjectId': target})[1]
+        self.assertEqual((report['processed'], report['successful']), (60, 60))
+        self.assertEqual(self._in_subject(target), set(ids))
+        self.assertEqual(self._in_subject(source), set())
+
+    def test_bulk_delete(self):
+        ids, source = self._questions('Concurrent delete', 400)
+        report = call('POST', '/questions/bulk-delete', {'questionIds': ids})[1]
+        self.assertEqual((report['successful'], report['errors']), (400, 0))
+        self.assertEqual(self._in_subject(source), set())
+        self.assertEqual(index.store.batch_get('questions', [{'questionId': qid} for qid in ids]), [])
+
+
+class SqliteSampleTest(unittest.TestCase):
+
+    def test_overlapping_runs_still_fill_the_sample(self):
+        store = storage.SqliteStorage(':memory:')
+        store.batch_write('questions', puts=[
+            {'questionId': f'q{n}', 'subjectId': 's', storage.RANDOM_KEY_ATTR: random.getrandbits(storage.RANDOM_KEY_BITS)}
+            for n in range(12)
+        ])
+        random.seed(3)
+        for _ in range(200):
+            picked = [it['questionId'] for it in store.sample('s', 10, ['questionId'])]
+            self.assertEqual(len(set(picked)), 10)
+        self.assertEqual(len(store.sample('s', 20)), 12)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+"""Subject update/delete edge cases, through lambda_handler on the SQLite backend."""
+import unittest
+
+from helpers import call
+import index
+
+
+class SubjectTest(unittest.TestCase):
+
+    def test_unknown_subject(self):
+        self.assertEqual(call('DELETE', '/subjects/nope')[0], 404)
+        self.assertEqual(call('PUT', '/subjects/nope', {'description': 'x'})[0], 404)
+        self.assertEqual(call('DELETE', '/subjects/__meta__#questions-version')[0], 404)
+
+    def test_question_added_after_count_check(self):
+        status, subject = call('POST', '/subjects', {'subjectName': 'Racing'})
+        self.assertEqual(status, 201)
+        sid = subject['subjectId']
+        self.assertEqual(call('POST', '/questions', {
+            'subjectId': sid, 'question': 'Q?', 'options': ['a', 'b', 'c', 'd'], 'answerIndex': 0,
+        })[0], 201)
+        # The count was read as 0 before the question landed
+        question_count, index._question_count = index._question_count, lambda *a, **k: 0
+        try:
+            status, body = call('DELETE', f'/subjects/{sid}')
+        finally:
+            index._question_count = question_count
+        self.assertEqual((status, body['error']), (400, 'Subject has questions; delete them first'))
+        self.assertEqual(call('GET', f'/subjects/{sid}')[0], 200)
+
+    def test_delete_empty_subject(self):
+        sid = call('POST', '/subjects', {'subjectName': 'Empty'})[1]['subjectId']
+        self.assertEqual(call('DELETE', f'/subjects/{sid}')[0], 204)
+        self.assertEqual(call('DELETE', f'/subjects/{sid}')[0], 404)
+
+
+if __name__ == '__main__':
+    unittest.main()